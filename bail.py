@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Single-poller lease: only the instance holding it polls Telegram.
+
+The holder renews it every LEASE_TTL / 3 seconds and releases it once its
+state is flushed, so the next instance takes over right away; a crashed
+holder is taken over LEASE_TTL seconds after its last renewal. The lease is
+a file under lock (LEASE_FILE, same disk), or a Redis key with
+BOT_STORAGE=redis.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+import logging
+from etat_partage import verrou_fichier, ecrire_json, lire_json
+from stockage_sqlite import backend_stockage, get_stockage
+
+logger = logging.getLogger(__name__)
+
+LEASE_FILE = os.getenv("LEASE_FILE", "bot.lease")
+LEASE_TTL = float(os.getenv("LEASE_TTL", "15"))
+# Seconds between two attempts while another instance holds the lease
+LEASE_RETRY = 0.2
+
+# KEYS: lease key; ARGV: owner, ttl in ms
+SCRIPT_RENOUVELER = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+SCRIPT_LIBERER = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class Bail:
+    """Lease stored in a JSON file: {"proprietaire": ..., "expire": timestamp}"""
+
+    def __init__(self, fichier=LEASE_FILE, duree=LEASE_TTL):
+        self.fichier = fichier
+        self.duree = duree
+        self.proprietaire = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.arret = threading.Event()
+        self.thread = None
+        # Called (from the heartbeat thread) when another instance took the lease
+        self.perdu = None
+
+    def titulaire(self):
+        """Current holder, None when free or expired"""
+        try:
+            data = lire_json(self.fichier)
+        except ValueError:
+            return None
+        if not data or data.get("expire", 0) < time.time():
+            return None
+        return data.get("proprietaire")
+
+    def essayer(self):
+        """Take (or renew) the lease if it is free, expired or already ours"""
+        with verrou_fichier(self.fichier):
+            if self.titulaire() not in (None, self.proprietaire):
+                return False
+            ecrire_json(self.fichier, {"proprietaire": self.proprietaire, "expire": time.time() + self.duree})
+            return True
+
+    def liberer_bail(self):
+        with verrou_fichier(self.fichier):
+            if self.titulaire() == self.proprietaire:
+                os.remove(self.fichier)
+
+    def acquerir(self):
+        """Block until the lease is ours, then keep it renewed"""
+        attente = None
+        while not self.essayer():
+            if attente is None:
+                attente = time.monotonic()
+                logger.info(f"Waiting for instance {self.titulaire()} to release the polling lease")
+            time.sleep(LEASE_RETRY)
+        if attente is not None:
+            logger.info(f"Polling lease taken over after {time.monotonic() - attente:.1f}s")
+        self.arret.clear()
+        self.thread = threading.Thread(target=self._entretenir, name="lease", daemon=True)
+        self.thread.start()
+
+    def _entretenir(self):
+        while not self.arret.wait(self.duree / 3):
+            try:
+                garde = self.essayer()
+            except Exception as e:
+                logger.error(f"Could not renew the polling lease: {e}")
+                continue
+            if not garde:
+                logger.error("Polling lease lost to another instance")
+                if self.perdu:
+                    self.perdu()
+                return
+
+    def liberer(self):
+        """Stop renewing and release the lease (after the state is flushed)"""
+        self.arret.set()
+        if self.thread is None:
+            return
+        self.thread = None
+        try:
+            self.liberer_bail()
+        except Exception as e:
+            logger.error(f"Could not release the polling lease: {e}")
+
+class BailRedis(Bail):
+    """Same lease as a Redis key with a TTL (SET NX PX)"""
+
+    def __init__(self, client, cle, duree=LEASE_TTL):
+        super().__init__(cle, duree)
+        self.client = client
+        self.renouveler = client.register_script(SCRIPT_RENOUVELER)
+        self.liberer_script = client.register_script(SCRIPT_LIBERER)
+
+    def titulaire(self):
+        return self.client.get(self.fichier)
+
+    def essayer(self):
+        ttl = int(self.duree * 1000)
+        if self.renouveler(keys=[self.fichier], args=[self.proprietaire, ttl]):
+            return True
+        return bool(self.client.set(self.fichier, self.proprietaire, nx=True, px=ttl))
+
+    def liberer_bail(self):
+        self.liberer_script(keys=[self.fichier], args=[self.proprietaire])
+
+def get_bail():
+    """Lease of the selected backend"""
+    if backend_stockage() == "redis":
+        stockage = get_stockage()
+        return BailRedis(stockage.client, stockage.cle("bail"))
+    return Bail()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the message-handling hot path: handle_message driven with
+synthetic Updates (stubbed bot, no network) over several scenarios.
+
+Usage: python bench_handle.py [--scenarios canaux,historique,editions,corrections,progression]
+                              [--messages 20000] [--output bench_results.json]
+                              [--compare previous.json] [--logs]
+
+Each scenario runs in a fresh process and an empty temporary directory, with
+the storage backend of the environment (BOT_STORAGE). Reported per scenario:
+throughput and p50/p99 latency of handle_message, bytes written (write
+syscalls, including the final flush), and timings of update_compteurs,
+save_processed_messages and afficher_compteurs_canal once the state has grown.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from bench_parseur import main_cartes
+
+SCENARIOS = {
+    "canaux": "1000 channels, final results only",
+    "historique": "400 channels with a full dedup window preloaded, 20% duplicates",
+    "editions": "20 channels, every result edited 5 times",
+    "corrections": "20 channels, every result edited twice with a different hand",
+    "progression": "50 channels, 9 progress updates per final result",
+}
+
+# ----- Scenario generation -----
+
+def resultat(rng, numero, en_cours=False):
+    joueur = main_cartes(rng, rng.choice([2, 3]))
+    banquier = main_cartes(rng, rng.choice([2, 3]))
+    if en_cours:
+        return f"⏰#n{numero}. ▶️ 0({joueur[:4]}) - 0({banquier[:4]})"
+    return f"#n{numero}. ✅{rng.randint(0, 9)}({joueur}) - {rng.randint(0, 9)}({banquier}) #T{rng.randint(0, 27)}"
+
+def generer(scenario, nombre, seed=42):
+    """(chat_id, text, edited) of the messages of a scenario"""
+    rng = random.Random(seed)
+    messages = []
+    if scenario == "canaux":
+        numeros = {}
+        while len(messages) < nombre:
+            chat_id = -1000000000000 - rng.randrange(1000)
+            numeros[chat_id] = numeros.get(chat_id, 0) + 1
+            messages.append((chat_id, resultat(rng, numeros[chat_id]), False))
+    elif scenario == "historique":
+        numeros = {}
+        while len(messages) < nombre:
+            chat_id = -1000000000000 - rng.randrange(400)
+            numero = numeros.get(chat_id, 2048)
+            if rng.random() < 0.2:
+                numero -= rng.randrange(1, 2048)
+            else:
+                numero = numeros[chat_id] = numero + 1
+            messages.append((chat_id, resultat(rng, numero), False))
+    elif scenario == "editions":
+        numero = 0
+        while len(messages) < nombre:
+            numero += 1
+            for chat_id in range(-1000000000020, -1000000000000):
+                texte = resultat(rng, numero)
+                messages.append((chat_id, texte, False))
+                messages.extend((chat_id, texte + " ✏️" * i, True) for i in range(1, 6))
+    elif scenario == "corrections":
+        numero = 0
+        while len(messages) < nombre:
+            numero += 1
+            for chat_id in range(-1000000000020, -1000000000000):
+                messages.append((chat_id, resultat(rng, numero), False))
+                messages.extend((chat_id, resultat(rng, numero), True) for _ in range(2))
+    elif scenario == "progression":
+        numero = 0
+        while len(messages) < nombre:
+            numero += 1
+            for chat_id in range(-1000000000050, -1000000000000):
+                messages.extend((chat_id, resultat(rng, numero, True), False) for _ in range(9))
+                messages.append((chat_id, resultat(rng, numero), False))
+    return messages[:nombre]
+
+def precharger(scenario):
+    """State files present before the bot starts"""
+    if scenario == "historique":
+        cles = [f"{-1000000000000 - canal}_{numero}" for canal in range(400) for numero in range(1, 2049)]
+        with open("processed_messages.json", "w", encoding="utf-8") as f:
+            json.dump(cles, f)
+
+# ----- Stubbed Telegram side -----
+
+class StubBot:
+    """Answers the calls handle_message makes, without network"""
+    defaults = None
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, *args, **kwargs):
+        self.sent += 1
+        return SimpleNamespace(message_id=self.sent)
+
+    async def edit_message_text(self, *args, **kwargs):
+        self.sent += 1
+        return True
+
+def construire_updates(messages, bot):
+    from telegram import Update
+    updates = []
+    for i, (chat_id, texte, modifie) in enumerate(messages):
+        message = {"message_id": i + 1, "date": 1700000000 + i,
+                   "chat": {"id": chat_id, "type": "channel", "title": "bench"}, "text": texte}
+        if modifie:
+            message["edit_date"] = 1700000000 + i
+        cle = "edited_channel_post" if modifie else "channel_post"
+        updates.append(Update.de_json({"update_id": i + 1, cle: message}, bot))
+    return updates
+
+# ----- Measurements -----
+
+def octets_ecrits():
+    """Bytes passed to write() by this process (Linux), None elsewhere"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for ligne in f:
+                if ligne.startswith("wchar:"):
+                    return int(ligne.split()[1])
+    except OSError:
+        return None
+
+def percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * p))]
+
+def chronometrer(fonction, repetitions):
+    """Mean microseconds per call"""
+    debut = time.perf_counter()
+    for _ in range(repetitions):
+        fonction()
+    return (time.perf_counter() - debut) / repetitions * 1e6
+
+def executer(scenario, nombre, logs):
+    """Run one scenario in the current directory and return its results"""
+    # Flood limits would only measure the token buckets
+    os.environ.update(SEND_GLOBAL_PER_SECOND="1e9", SEND_CHAT_PER_MINUTE="1e9",
+                      SEND_CHAT_BURST="1000000000", SEND_MAX_QUEUE="1000000000")
+    precharger(scenario)
+
+    import logging
+    import render_bot
+    from compteur import update_compteurs_delta, get_compteurs, get_version
+    from persistance import persistence_executor
+    from envoi import send_queue
+    from style import afficher_compteurs_canal
+    import tendances
+    if logs:
+        logging.getLogger().handlers[0].stream = open("bot.log", "a", encoding="utf-8")
+    else:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    bot = StubBot()
+    messages = generer(scenario, nombre)
+    updates = construire_updates(messages, bot)
+    context = SimpleNamespace(bot=bot, args=[])
+
+    octets_debut = octets_ecrits()
+    persistence_executor.start()
+    render_bot.load_state()
+
+    async def piloter():
+        latences = []
+        debut = time.perf_counter()
+        for update in updates:
+            t = time.perf_counter_ns()
+            await render_bot.handle_message(update, context)
+            latences.append(time.perf_counter_ns() - t)
+        duree = time.perf_counter() - debut
+        # Let the queued replies go out before the components are timed
+        while send_queue.workers:
+            await asyncio.sleep(0.01)
+        return latences, duree
+
+    latences, duree = asyncio.run(piloter())
+
+    # Edit corrections must reach the time buckets as well as the counters
+    coherent = all(
+        [sum(serie.data[i::4]) for i in range(4)] == [get_compteurs(canal).get(s, 0) for s in tendances.SYMBOLES]
+        for canal in {m[0] for m in messages}
+        for serie in [tendances.get_series(canal)["day"]])
+
+    chat_id = messages[-1][0]
+    compteurs = get_compteurs(chat_id)
+    composants = {
+        "update_compteurs_us": chronometrer(lambda: update_compteurs_delta(chat_id, {"♠️": 1}), 2000),
+        "save_processed_messages_us": chronometrer(render_bot.save_processed_messages, 2000),
+        "afficher_compteurs_canal_us": chronometrer(lambda: afficher_compteurs_canal(compteurs, 5), 20000),
+        "afficher_compteurs_canal_cache_us": chronometrer(
+            lambda: afficher_compteurs_canal(compteurs, 5, (chat_id, get_version(chat_id))), 20000),
+    }
+
+    debut_flush = time.perf_counter()
+    writer = persistence_executor.metrics()
+    render_bot.save_state()
+    flush = time.perf_counter() - debut_flush
+    octets_fin = octets_ecrits()
+
+    return {
+        "description": SCENARIOS[scenario],
+        "messages": len(updates),
+        "seconds": round(duree, 4),
+        "throughput": round(len(updates) / duree, 1),
+        "p50_us": round(percentile(latences, 0.50) / 1000, 2),
+        "p99_us": round(percentile(latences, 0.99) / 1000, 2),
+        "max_us": round(max(latences) / 1000, 2),
+        "bytes_written": None if octets_debut is None else octets_fin - octets_debut,
+        "bytes_on_disk": sum(os.path.getsize(f) for f in os.listdir(".") if os.path.isfile(f)),
+        "final_flush_seconds": round(flush, 4),
+        "replies": bot.sent,
+        "history_matches_counters": coherent,
+        "writes": writer["written"],
+        "writes_coalesced": writer["coalesced"],
+        "components": {nom: round(valeur, 3) for nom, valeur in composants.items()},
+    }
+
+# ----- Driver -----
+
+def comparer(resultats, precedent):
+    """Print the change of each scenario against a previous results file"""
+    with open(precedent, "r", encoding="utf-8") as f:
+        ancien = json.load(f)["scenarios"]
+    print(f"\nComparison with {precedent}:")
+    for nom, r in resultats.items():
+        if nom not in ancien:
+            continue
+        a = ancien[nom]
+        print(f"  {nom:12s} throughput x{r['throughput'] / a['throughput']:.2f}  "
+              f"p99 x{r['p99_us'] / a['p99_us']:.2f}  "
+              f"bytes {a['bytes_written']} -> {r['bytes_written']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark handle_message over synthetic scenarios")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="Previous results file")
+    parser.add_argument("--logs", action="store_true", help="Keep INFO logging (written to bot.log)")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(executer(args.run, args.messages, args.logs)))
+        return
+
+    resultats = {}
+    for scenario in args.scenarios.split(","):
+        if scenario not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {scenario!r} ({', '.join(SCENARIOS)})")
+        with tempfile.TemporaryDirectory() as dossier:
+            commande = [sys.executable, os.path.abspath(__file__), "--run", scenario,
+                        "--messages", str(args.messages)] + (["--logs"] if args.logs else [])
+            sortie = subprocess.run(commande, cwd=dossier, capture_output=True, text=True)
+        if sortie.returncode:
+            raise SystemExit(f"Scenario {scenario} failed:\n{sortie.stderr}")
+        r = resultats[scenario] = json.loads(sortie.stdout.strip().splitlines()[-1])
+        print(f"{scenario:12s} {r['throughput']:9.0f} msg/s  p50 {r['p50_us']:7.1f} µs  "
+              f"p99 {r['p99_us']:7.1f} µs  written {r['bytes_written']} B")
+        if not r["history_matches_counters"]:
+            print(f"  {scenario}: time buckets do not match the counters")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "storage": os.getenv("BOT_STORAGE", "json"),
+            "messages": args.messages,
+            "scenarios": resultats,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        comparer(resultats, args.compare)
+
+if __name__ == "__main__":
+    main()
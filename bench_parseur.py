@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: parseur.analyser_message vs the former inline parsing of handle_message
+
+Usage: python bench_parseur.py [--messages 20000] [--repeat 5] [--corpus fichier.txt]
+The corpus file holds one message per line (escaped newlines as \\n); without
+it, messages are generated in the channel layout (progress + final versions).
+"""
+import argparse
+import platform
+import random
+import statistics
+import re
+import time
+from parseur import analyser_message
+
+RANGS = ["A", "2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K"]
+COULEURS = ["♠️", "♥️", "♦️", "♣️", "❤️"]
+
+def main_cartes(rng, n):
+    return "".join(rng.choice(RANGS) + rng.choice(COULEURS) for _ in range(n))
+
+def generer_corpus(nombre, seed=42):
+    """Progress then final versions of consecutive games, as posted by the channels"""
+    rng = random.Random(seed)
+    corpus = []
+    numero = 1
+    while len(corpus) < nombre:
+        joueur = main_cartes(rng, rng.choice([2, 3]))
+        banquier = main_cartes(rng, rng.choice([2, 3]))
+        corpus.append(f"⏰#n{numero}. ▶️ 0({joueur[:4]}) - 0({banquier[:4]})")
+        symbole = "🔰" if numero % 7 == 0 else "✅"
+        corpus.append(f"#n{numero}. {symbole}{rng.randint(0, 9)}({joueur}) - "
+                      f"{rng.randint(0, 9)}({banquier}) #T{rng.randint(0, 27)} 🔵#R")
+        if numero % 10 == 0:
+            corpus.append(f"Résultat du tirage ({main_cartes(rng, 3)})")
+        numero += 1
+    return corpus[:nombre]
+
+def ancien_parseur(text):
+    """Parsing steps of handle_message before parseur.py, kept as the reference"""
+    match_numero = re.search(r"#n(\d+)", text)
+    numero = None
+    if match_numero:
+        numero = int(match_numero.group(1))
+        progress_indicators = ['⏰', '▶', '🕐', '➡️']
+        confirmation_symbols = ['✅', '🔰']
+        has_progress = any(indicator in text for indicator in progress_indicators)
+        has_confirmation = any(symbol in text for symbol in confirmation_symbols)
+        if has_progress and not has_confirmation:
+            return numero, None
+    match = re.search(r'\(([^()]*)\)', text)
+    if not match:
+        return numero, None
+    content = match.group(1)
+    cards_found = {}
+    heart_count = content.count("❤️") + content.count("♥️")
+    if heart_count > 0:
+        cards_found["❤️"] = heart_count
+    for symbol in ["♦️", "♣️", "♠️"]:
+        count = content.count(symbol)
+        if count > 0:
+            cards_found[symbol] = count
+    return numero, cards_found
+
+def nouveau_parseur(text):
+    resultat = analyser_message(text)
+    if resultat.en_cours or resultat.contenu is None:
+        return resultat.numero, None
+    return resultat.numero, resultat.cartes()
+
+def mesurer(fonction, corpus, repeat):
+    """Best and median time over repeat runs, in ns per message"""
+    durees = []
+    for _ in range(repeat):
+        debut = time.perf_counter()
+        for text in corpus:
+            fonction(text)
+        durees.append((time.perf_counter() - debut) / len(corpus) * 1e9)
+    return min(durees), statistics.median(durees)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the message parser")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--corpus", help="File with one message per line")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            corpus = [line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip()]
+        source = args.corpus
+    else:
+        corpus = generer_corpus(args.messages)
+        source = "generated (seed 42)"
+
+    # Both parsers must agree before timing means anything
+    for text in corpus:
+        ancien = ancien_parseur(text)
+        nouveau = nouveau_parseur(text)
+        if ancien != nouveau and not (ancien[1] == {} and nouveau[1] == {}):
+            raise SystemExit(f"Mismatch on {text!r}: {ancien} != {nouveau}")
+
+    ancien_ns, ancien_median = mesurer(ancien_parseur, corpus, args.repeat)
+    nouveau_ns, nouveau_median = mesurer(nouveau_parseur, corpus, args.repeat)
+    # Quote the figures with this line: the ratio depends on the machine
+    print(f"Python {platform.python_version()} on {platform.machine()} {platform.system()}, "
+          f"corpus {source}, {args.repeat} runs")
+    print(f"Messages: {len(corpus)}")
+    print(f"Inline parsing:  {ancien_ns:8.0f} ns/message (median {ancien_median:.0f})")
+    print(f"analyser_message: {nouveau_ns:7.0f} ns/message (median {nouveau_median:.0f})")
+    print(f"Speedup: x{ancien_ns / nouveau_ns:.2f} best, x{ancien_median / nouveau_median:.2f} median")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,69 @@
 
 import json
 import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from itertools import count, islice
+from stockage_sqlite import get_stockage
+from etat_partage import verrou_fichier, ecrire_json, lire_json, mettre_de_cote
+from persistance import persistence_executor
+import tendances
+import registre_parties
+import statistiques
+import metriques
 
-# Structure: {chat_id: {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}}
-compteurs_par_canal = {}
+logger = logging.getLogger(__name__)
+
+# Bounded LRU cache: {chat_id: {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}}, least
+# recently used first. A channel is loaded on first access; clean channels
+# beyond CACHE_SIZE or idle for CACHE_TTL seconds (0: no TTL) are dropped,
+# dirty ones only once the flush has written them.
+compteurs_par_canal = OrderedDict()
+CACHE_SIZE = int(os.getenv("COMPTEURS_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("COMPTEURS_CACHE_TTL", "0"))
+# Channels preloaded at startup, most active first
+WARMUP = int(os.getenv("COMPTEURS_WARMUP", "0"))
+# Entries looked at past the limit on a miss, so dirty channels can be skipped
+EVICTION_SCAN = 32
+derniers_acces = {}
+
+cache_resultats = metriques.registre.compteur("bot_channel_cache_total", "Channel counter cache lookups and evictions",
+                                              "result", ("hit", "miss", "eviction"))
+cache_hits = cache_resultats.labels("hit")
+cache_misses = cache_resultats.labels("miss")
+cache_evictions = cache_resultats.labels("eviction")
+metriques.registre.jauge("bot_channel_cache_size", "Channels in the counter cache", lambda: len(compteurs_par_canal))
+
+# Write-behind: channels changed in memory but not yet written to disk.
+# Files receive the deltas of this process, merged under the file lock, so
+# several bot processes can count into the same files; channels reset or
+# replaced here are written as a whole instead. Dedup and the game ledger
+# stay per process with files (see etat_partage).
+canaux_modifies = set()
+deltas_en_attente = {}
+canaux_remplaces = set()
+# Channels the running flush is writing (not evicted either)
+en_ecriture = set()
+# Changed on every change of a channel: renders are memoized per (chat_id, version).
+# Taken from one sequence, so a channel evicted and loaded again gets a new one.
+versions_canal = {}
+sequence_versions = count(1)
+verrou_compteurs = threading.RLock()
+FLUSH_INTERVAL = float(os.getenv("COMPTEURS_FLUSH_INTERVAL", "2"))
+
+# Global totals kept in memory, and the channel index + global rollup files
+# updated with the flush (read by the web process)
+ROLLUP_FILE = "compteurs_global.json"
+INDEX_FILE = "compteurs_canaux.json"
+compteurs_global = None
+# Channels to write in the index file with the next flush
+index_a_ecrire = set()
+cache_index = {"signature": None, "totaux": {}}
+
+def compteurs_vides():
+    return {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
 
 def get_compteurs_fichier(chat_id):
     """Get filename for specific channel counters"""
@@ -11,47 +71,50 @@ def get_compteurs_fichier(chat_id):
 
 def charger_compteurs_canal(chat_id):
     """Load counters for specific channel"""
+    stockage = get_stockage()
+    if stockage:
+        return stockage.get_compteurs(chat_id)
+
     fichier = get_compteurs_fichier(chat_id)
-    compteurs_defaut = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
-    
-    if os.path.exists(fichier):
-        try:
-            with open(fichier, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data
-        except (json.JSONDecodeError, FileNotFoundError):
-            pass
-    
-    return compteurs_defaut.copy()
+    try:
+        return lire_json(fichier) or compteurs_vides()
+    except json.JSONDecodeError as e:
+        # Starting again from zero would overwrite the real totals with the
+        # next flush: keep the file aside and use the last indexed totals
+        logger.error(f"Corrupted counters file {fichier}: {e}")
+        mettre_de_cote(fichier)
+        compteurs = (lire_index_canaux() or {}).get(chat_id)
+        if compteurs is None:
+            logger.error(f"No indexed totals for {chat_id}, counters start from zero")
+            return compteurs_vides()
+        return dict(compteurs)
 
 def sauvegarder_compteurs_canal(chat_id, compteurs):
-    """Save counters for specific channel"""
-    fichier = get_compteurs_fichier(chat_id)
-    with open(fichier, "w", encoding="utf-8") as f:
-        json.dump(compteurs, f, ensure_ascii=False)
+    """Save counters for specific channel (atomic: tmp file + rename)"""
+    stockage = get_stockage()
+    if stockage:
+        stockage.sauver_compteurs(chat_id, compteurs)
+        return
 
-def get_compteurs(chat_id):
-    """Get current counters for channel"""
-    if chat_id not in compteurs_par_canal:
-        compteurs_par_canal[chat_id] = charger_compteurs_canal(chat_id)
-    return compteurs_par_canal[chat_id]
+    fichier = get_compteurs_fichier(chat_id)
+    with verrou_fichier(fichier):
+        ecrire_json(fichier, compteurs)
 
-def update_compteurs(chat_id, symbole, count):
-    """Update counter for specific symbol in channel"""
-    if chat_id not in compteurs_par_canal:
-        compteurs_par_canal[chat_id] = charger_compteurs_canal(chat_id)
-    
-    compteurs_par_canal[chat_id][symbole] += count
-    sauvegarder_compteurs_canal(chat_id, compteurs_par_canal[chat_id])
+def fusionner_compteurs_canal(chat_id, delta):
+    """Add a delta to the counters file of a channel under its lock.
 
-def reset_compteurs_canal(chat_id):
-    """Reset all counters for specific channel"""
-    compteurs_defaut = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
-    compteurs_par_canal[chat_id] = compteurs_defaut.copy()
-    sauvegarder_compteurs_canal(chat_id, compteurs_par_canal[chat_id])
+    Returns the totals written, which include what other processes merged.
+    """
+    fichier = get_compteurs_fichier(chat_id)
+    with verrou_fichier(fichier):
+        compteurs = charger_compteurs_canal(chat_id)
+        for symbole, count in delta.items():
+            compteurs[symbole] = compteurs.get(symbole, 0) + count
+        ecrire_json(fichier, compteurs)
+    return compteurs
 
-def get_all_channels():
-    """Get list of all channels with counters"""
+def lister_fichiers_canaux():
+    """Channels found by scanning the compteurs_<id>.json files"""
     channels = []
     for fichier in os.listdir("."):
         if fichier.startswith("compteurs_") and fichier.endswith(".json"):
@@ -62,6 +125,426 @@ def get_all_channels():
                 continue
     return channels
 
+def lire_index_canaux():
+    """Channel totals from the index file, None if missing or invalid"""
+    try:
+        index = lire_json(INDEX_FILE)
+        return None if index is None else {int(chat_id): compteurs for chat_id, compteurs in index.items()}
+    except (json.JSONDecodeError, ValueError, AttributeError):
+        return None
+
+def charger_rollup():
+    """Load the global totals (once per process); channel totals are not kept"""
+    global compteurs_global
+    with verrou_compteurs:
+        if compteurs_global is not None:
+            return
+        stockage = get_stockage()
+        if stockage:
+            totaux = stockage.totaux_canaux()
+        else:
+            totaux = lire_index_canaux()
+            if totaux is None:
+                # First run: one directory scan builds the index
+                totaux = {chat_id: charger_compteurs_canal(chat_id) for chat_id in lister_fichiers_canaux()}
+                index_a_ecrire.update(totaux)
+        total = compteurs_vides()
+        for compteurs in totaux.values():
+            for symbole, count in compteurs.items():
+                total[symbole] = total.get(symbole, 0) + count
+        compteurs_global = total
+
+def maj_rollup(chat_id, ancien, compteurs):
+    """Adjust the global totals by the change of a channel from ancien to compteurs"""
+    charger_rollup()
+    for symbole in set(ancien) | set(compteurs):
+        diff = compteurs.get(symbole, 0) - ancien.get(symbole, 0)
+        if diff:
+            compteurs_global[symbole] = compteurs_global.get(symbole, 0) + diff
+    index_a_ecrire.add(chat_id)
+
+def ajouter_au_cache(chat_id, compteurs):
+    """Insert loaded counters as the most recently used channel"""
+    with verrou_compteurs:
+        existant = compteurs_par_canal.get(chat_id)
+        if existant is not None:
+            return existant
+        # Deltas not flushed yet when the channel was evicted
+        for symbole, count in deltas_en_attente.get(chat_id, {}).items():
+            compteurs[symbole] = compteurs.get(symbole, 0) + count
+        # Room is made first, so the new entry is never the one evicted
+        if len(compteurs_par_canal) >= CACHE_SIZE:
+            evincer(CACHE_SIZE - 1)
+        compteurs_par_canal[chat_id] = compteurs
+        versions_canal[chat_id] = next(sequence_versions)
+        if CACHE_TTL:
+            derniers_acces[chat_id] = time.monotonic()
+        if not get_stockage():
+            # Heals an index left behind by a crash between two writes
+            index_a_ecrire.add(chat_id)
+        return compteurs
+
+def get_compteurs(chat_id):
+    """Get current counters for channel (loaded on a cache miss)"""
+    with verrou_compteurs:
+        compteurs = compteurs_par_canal.get(chat_id)
+        if compteurs is not None:
+            compteurs_par_canal.move_to_end(chat_id)
+            if CACHE_TTL:
+                derniers_acces[chat_id] = time.monotonic()
+            cache_hits.inc()
+            return compteurs
+    cache_misses.inc()
+    return ajouter_au_cache(chat_id, charger_compteurs_canal(chat_id))
+
+def retirer_du_cache(chat_id):
+    compteurs_par_canal.pop(chat_id, None)
+    versions_canal.pop(chat_id, None)
+    derniers_acces.pop(chat_id, None)
+    cache_evictions.inc()
+    tendances.liberer(chat_id)
+    registre_parties.liberer(chat_id)
+    statistiques.liberer(chat_id)
+
+def evincer(taille=None, complet=False):
+    """Drop least recently used channels beyond taille (default CACHE_SIZE)
+    and channels idle for longer than CACHE_TTL.
+
+    Dirty channels are skipped: the flush writes them first. A miss only
+    looks at the oldest entries; complet scans the whole cache (flush).
+    """
+    if taille is None:
+        taille = CACHE_SIZE
+    with verrou_compteurs:
+        limite = time.monotonic() - CACHE_TTL if CACHE_TTL else None
+        if complet:
+            candidats = list(compteurs_par_canal)
+        else:
+            candidats = list(islice(compteurs_par_canal, max(len(compteurs_par_canal) - taille, 0) + EVICTION_SCAN))
+        for chat_id in candidats:
+            expire = limite is not None and derniers_acces.get(chat_id, 0) < limite
+            if len(compteurs_par_canal) <= taille and not expire:
+                # Least recently used first: the remaining ones are newer
+                break
+            if chat_id in canaux_modifies or chat_id in en_ecriture:
+                continue
+            retirer_du_cache(chat_id)
+
+def get_cache_stats():
+    """Size and hit/miss/eviction counters of the channel cache"""
+    with verrou_compteurs:
+        return {
+            "size": len(compteurs_par_canal),
+            "capacity": CACHE_SIZE,
+            "dirty": len(canaux_modifies),
+            "hits": cache_hits.valeur,
+            "misses": cache_misses.valeur,
+            "evictions": cache_evictions.valeur,
+        }
+
+def prechauffer(nombre=WARMUP):
+    """Load the nombre channels with the largest totals into the cache"""
+    nombre = min(nombre, CACHE_SIZE)
+    if nombre <= 0:
+        return 0
+    totaux = lire_totaux_canaux()
+    actifs = sorted(totaux, key=lambda chat_id: sum(totaux[chat_id].values()), reverse=True)[:nombre]
+    stockage = get_stockage()
+    # Least active first, so the most active end up most recently used
+    for chat_id in reversed(actifs):
+        # The store totals are exact; the index may lag behind the files
+        ajouter_au_cache(chat_id, dict(totaux[chat_id]) if stockage else charger_compteurs_canal(chat_id))
+    return len(actifs)
+
+def get_version(chat_id):
+    """Version of the counters of a channel in this process"""
+    return versions_canal.get(chat_id, 0)
+
+def get_compteurs_global():
+    """Totals over all channels"""
+    charger_rollup()
+    with verrou_compteurs:
+        return dict(compteurs_global)
+
+def update_compteurs_delta(chat_id, delta, numero=None, horodatage=None, retraite=False):
+    """Apply a whole {symbol: count} delta in memory, written by the next flush.
+
+    With a storage backend (SQLite, Redis) the delta and the game number
+    (dedup key) are committed right away in a single transaction instead;
+    the game is only counted if no other worker claimed it first, unless
+    retraite (correction of an edited result). The delta is also added to the
+    time buckets of the channel at horodatage (default: now).
+    Returns False when the game was not counted. With a backend this blocks
+    on the store: async callers run it with asyncio.to_thread.
+    """
+    stockage = get_stockage()
+    if not stockage and not delta:
+        return True
+    # Loaded before the write, so the delta is not counted twice in memory
+    if compteurs_global is None:
+        charger_rollup()
+    compteurs = get_compteurs(chat_id)
+    totaux = None
+    if stockage and (delta or numero is not None):
+        totaux = stockage.enregistrer_partie(chat_id, numero, delta, retraite)
+        if totaux is None:
+            return False
+
+    appliquer_delta(chat_id, compteurs, delta, totaux)
+    tendances.enregistrer(chat_id, delta, horodatage)
+    # A correction of an edited game is not a new game for the statistics
+    if delta and not retraite:
+        statistiques.enregistrer_partie(chat_id, delta)
+    return True
+
+def update_compteurs_lot(chat_id, parties):
+    """update_compteurs_delta for several games of a channel [(numero, delta,
+    horodatage, retraite)]: one storage transaction and one in-memory update
+    for the whole list. Returns the games counted.
+    """
+    stockage = get_stockage()
+    if compteurs_global is None:
+        charger_rollup()
+    compteurs = get_compteurs(chat_id)
+    totaux = None
+    if stockage:
+        totaux, indexes = stockage.enregistrer_parties(
+            chat_id, [(numero, delta, retraite) for numero, delta, _, retraite in parties])
+        parties = [parties[i] for i in indexes]
+    somme = {}
+    for _, delta, _, _ in parties:
+        for symbole, count in delta.items():
+            somme[symbole] = somme.get(symbole, 0) + count
+    if somme or totaux is not None:
+        appliquer_delta(chat_id, compteurs, somme, totaux)
+    for _, delta, horodatage, retraite in parties:
+        tendances.enregistrer(chat_id, delta, horodatage)
+        if delta and not retraite:
+            statistiques.enregistrer_partie(chat_id, delta)
+    return parties
+
+def appliquer_delta(chat_id, compteurs, delta, totaux=None):
+    """Apply a delta (or the totals of the store) to the cached counters"""
+    stockage = get_stockage()
+    with verrou_compteurs:
+        ancien = dict(compteurs)
+        if totaux is not None:
+            # Totals of the store: include the games of other workers
+            compteurs.update(totaux)
+        else:
+            for symbole, count in delta.items():
+                compteurs[symbole] = compteurs.get(symbole, 0) + count
+        maj_rollup(chat_id, ancien, compteurs)
+        if chat_id in compteurs_par_canal:
+            versions_canal[chat_id] = next(sequence_versions)
+        if not stockage:
+            en_attente = deltas_en_attente.setdefault(chat_id, {})
+            for symbole, count in delta.items():
+                en_attente[symbole] = en_attente.get(symbole, 0) + count
+            canaux_modifies.add(chat_id)
+
+def update_compteurs(chat_id, symbole, count):
+    """Update counter for specific symbol in channel"""
+    update_compteurs_delta(chat_id, {symbole: count})
+
+def fixer_compteurs(chat_id, compteurs):
+    """Put counters in place of the cached ones (caller holds verrou_compteurs)"""
+    ancien = compteurs_par_canal.get(chat_id) or charger_compteurs_canal(chat_id)
+    compteurs_par_canal[chat_id] = dict(compteurs)
+    compteurs_par_canal.move_to_end(chat_id)
+    maj_rollup(chat_id, ancien, compteurs)
+    versions_canal[chat_id] = next(sequence_versions)
+    deltas_en_attente.pop(chat_id, None)
+
+def reset_compteurs_canal(chat_id):
+    """Reset all counters for specific channel"""
+    stockage = get_stockage()
+    charger_rollup()
+    with verrou_compteurs:
+        fixer_compteurs(chat_id, compteurs_vides())
+        if stockage:
+            canaux_modifies.discard(chat_id)
+            stockage.reset_canal(chat_id)
+        else:
+            canaux_remplaces.add(chat_id)
+            canaux_modifies.add(chat_id)
+    tendances.reset_canal(chat_id)
+    statistiques.reset_canal(chat_id)
+    persistence_executor.submit("tendances", tendances.flush_tendances)
+    if not stockage:
+        persistence_executor.submit("compteurs", flush_compteurs)
+
+def remplacer_compteurs_canal(chat_id, compteurs):
+    """Overwrite the counters of a channel (replay), written by the next flush"""
+    stockage = get_stockage()
+    charger_rollup()
+    with verrou_compteurs:
+        fixer_compteurs(chat_id, compteurs)
+        if stockage:
+            stockage.sauver_compteurs(chat_id, compteurs)
+        else:
+            canaux_remplaces.add(chat_id)
+            canaux_modifies.add(chat_id)
+
+def ecrire_index(canaux, ecrits=None):
+    """Copy the totals of the channel files into the index file and adjust
+    the global rollup file by their difference, both under the index lock
+    (several bot processes write them). ecrits holds the totals this flush
+    just wrote, the other files are read. Returns the global totals."""
+    ecrits = ecrits or {}
+    with verrou_fichier(INDEX_FILE):
+        try:
+            index = lire_json(INDEX_FILE, {})
+        except json.JSONDecodeError as e:
+            logger.error(f"Corrupted counter index: {e}")
+            mettre_de_cote(INDEX_FILE)
+            index = {str(chat_id): charger_compteurs_canal(chat_id) for chat_id in lister_fichiers_canaux()}
+        try:
+            # Without an index the global file cannot be trusted: summed again
+            total = lire_json(ROLLUP_FILE) if os.path.exists(INDEX_FILE) else None
+        except json.JSONDecodeError:
+            total = None
+        if total is None:
+            total = compteurs_vides()
+            for compteurs in index.values():
+                for symbole, count in compteurs.items():
+                    total[symbole] = total.get(symbole, 0) + count
+
+        for chat_id in canaux:
+            compteurs = ecrits.get(chat_id) or charger_compteurs_canal(chat_id)
+            ancien = index.get(str(chat_id), {})
+            for symbole in set(ancien) | set(compteurs):
+                total[symbole] = total.get(symbole, 0) + compteurs.get(symbole, 0) - ancien.get(symbole, 0)
+            index[str(chat_id)] = compteurs
+        ecrire_json(INDEX_FILE, index)
+        ecrire_json(ROLLUP_FILE, total)
+    return total
+
+def flush_compteurs():
+    """Merge every modified channel into its file, update the rollup files,
+    then evict what the cache no longer needs"""
+    global compteurs_global
+    with verrou_compteurs:
+        a_ecrire = {chat_id: (deltas_en_attente.pop(chat_id, {}),
+                              dict(compteurs_par_canal[chat_id]) if chat_id in canaux_remplaces else None)
+                    for chat_id in canaux_modifies}
+        canaux_modifies.clear()
+        canaux_remplaces.clear()
+        en_ecriture.update(a_ecrire)
+    ecrits = {}
+
+    for chat_id, (delta, remplacement) in a_ecrire.items():
+        try:
+            if remplacement is not None:
+                sauvegarder_compteurs_canal(chat_id, remplacement)
+                ecrits[chat_id] = remplacement
+                continue
+            sur_disque = ecrits[chat_id] = fusionner_compteurs_canal(chat_id, delta)
+        except OSError as e:
+            logger.error(f"Could not save counters for {chat_id}: {e}")
+            with verrou_compteurs:
+                if remplacement is not None:
+                    canaux_remplaces.add(chat_id)
+                elif chat_id not in canaux_remplaces:
+                    en_attente = deltas_en_attente.setdefault(chat_id, {})
+                    for symbole, count in delta.items():
+                        en_attente[symbole] = en_attente.get(symbole, 0) + count
+                canaux_modifies.add(chat_id)
+            continue
+
+        with verrou_compteurs:
+            actuels = compteurs_par_canal.get(chat_id)
+            if chat_id in canaux_remplaces or actuels is None:
+                continue
+            # Games merged by other bot processes show up in this one
+            compteurs = dict(sur_disque)
+            for symbole, count in deltas_en_attente.get(chat_id, {}).items():
+                compteurs[symbole] = compteurs.get(symbole, 0) + count
+            if compteurs != actuels:
+                actuels.update(compteurs)
+                versions_canal[chat_id] = next(sequence_versions)
+
+    with verrou_compteurs:
+        en_ecriture.clear()
+        canaux = set(index_a_ecrire) if not get_stockage() else set()
+        index_a_ecrire.clear()
+    if canaux:
+        try:
+            total = ecrire_index(canaux, ecrits)
+            with verrou_compteurs:
+                # Global totals of every process, plus what this one has not flushed
+                for en_attente in deltas_en_attente.values():
+                    for symbole, count in en_attente.items():
+                        total[symbole] = total.get(symbole, 0) + count
+                compteurs_global = total
+        except OSError as e:
+            logger.error(f"Could not save counter rollup: {e}")
+            with verrou_compteurs:
+                index_a_ecrire.update(canaux)
+
+    if CACHE_TTL or len(compteurs_par_canal) > CACHE_SIZE:
+        evincer(complet=True)
+
+def start_flush_compteurs(intervalle=FLUSH_INTERVAL):
+    """Flush modified channels every interval from the persistence writer thread"""
+    persistence_executor.every(intervalle, "compteurs", flush_compteurs)
+    tendances.start_flush_tendances()
+    statistiques.start_flush_statistiques()
+
+def stop_flush_compteurs():
+    """Stop the periodic flush and write pending changes (shutdown path)"""
+    persistence_executor.cancel("compteurs")
+    flush_compteurs()
+    tendances.stop_flush_tendances()
+    statistiques.stop_flush_statistiques()
+
+def get_all_channels():
+    """Get list of all channels with counters"""
+    stockage = get_stockage()
+    if stockage:
+        return stockage.get_all_channels()
+
+    with verrou_compteurs:
+        en_memoire = set(compteurs_par_canal)
+    return list(set(lire_totaux_canaux()) | en_memoire)
+
+def lire_totaux_canaux():
+    """Totals of every channel for readers such as the web process.
+
+    The index file (written with each flush) is re-read only when its mtime
+    changed.
+    """
+    stockage = get_stockage()
+    if stockage:
+        return stockage.totaux_canaux()
+
+    try:
+        st = os.stat(INDEX_FILE)
+        signature = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return {}
+    if signature != cache_index["signature"]:
+        cache_index["totaux"] = lire_index_canaux() or {}
+        cache_index["signature"] = signature
+    return cache_index["totaux"]
+
+def lire_compteurs_global():
+    """Global totals for readers (rollup file, or summed from SQLite)"""
+    if get_stockage():
+        total = compteurs_vides()
+        for compteurs in get_stockage().totaux_canaux().values():
+            for symbole, count in compteurs.items():
+                total[symbole] = total.get(symbole, 0) + count
+        return total
+    try:
+        return lire_json(ROLLUP_FILE) or compteurs_vides()
+    except json.JSONDecodeError:
+        total = compteurs_vides()
+        for compteurs in lire_totaux_canaux().values():
+            for symbole, count in compteurs.items():
+                total[symbole] = total.get(symbole, 0) + count
+        return total
+
 # Legacy compatibility
 compteurs = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
 
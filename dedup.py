@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Processed message tracking: per-channel sliding-window index and its
+append-only journal (group commit + compaction)
+"""
+import json
+import os
+import threading
+import time
+import logging
+from persistance import persistence_executor
+from etat_partage import verrou_fichier
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "processed_messages.json"
+JOURNAL_FILE = "processed_messages.journal"
+
+# Seconds between two journal flushes (0 = flush on every key)
+FLUSH_INTERVAL = float(os.getenv("DEDUP_FLUSH_INTERVAL", "1"))
+# Number of journal entries before the snapshot is rewritten
+COMPACT_EVERY = int(os.getenv("DEDUP_COMPACT_EVERY", "5000"))
+# Number of recent game numbers remembered per channel
+RETENTION = int(os.getenv("DEDUP_RETENTION", "2048"))
+# Consecutive increasing numbers below the window that mean the numbering
+# restarted (a single old game is a late edit or a redelivery)
+RESTART_RUN = int(os.getenv("DEDUP_RESTART_RUN", "8"))
+
+class ChannelWindow:
+    """High-water mark plus a ring bitmap of the last `retention` game numbers.
+
+    Numbers below the window leave it unchanged; they are kept in `bas`, and
+    only a run of RESTART_RUN of them starts a new window (new numbering).
+    """
+    __slots__ = ("high", "retention", "bits", "bas")
+
+    def __init__(self, retention=RETENTION):
+        self.high = -1
+        self.retention = retention
+        self.bits = bytearray((retention + 7) // 8)
+        self.bas = []
+
+    def _clear(self):
+        self.bits[:] = bytes(len(self.bits))
+
+    def contains(self, numero):
+        """Check if a game number was processed (O(1))"""
+        if numero > self.high:
+            return False
+        if numero <= self.high - self.retention:
+            return numero in self.bas
+        slot = numero % self.retention
+        return bool(self.bits[slot >> 3] & (1 << (slot & 7)))
+
+    def add(self, numero):
+        """Mark a game number as processed, sliding the window forward"""
+        if numero > self.high - self.retention:
+            # The live numbering goes on: no restart in progress
+            self.bas = []
+        if numero > self.high:
+            if self.high < 0 or numero - self.high >= self.retention:
+                self._clear()
+            else:
+                # Free the slots of the numbers leaving the window
+                for n in range(self.high + 1, numero + 1):
+                    slot = n % self.retention
+                    self.bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+            self.high = numero
+        elif numero <= self.high - self.retention:
+            if self.bas and numero <= self.bas[-1]:
+                if numero not in self.bas:
+                    self.bas = [numero]
+                return
+            self.bas.append(numero)
+            if len(self.bas) < RESTART_RUN:
+                return
+            # Numbering restarted far below the window: start a new one
+            bas = self.bas
+            self._clear()
+            self.bas = []
+            self.high = bas[-1]
+            for n in bas[:-1]:
+                slot = n % self.retention
+                self.bits[slot >> 3] |= 1 << (slot & 7)
+            numero = bas[-1]
+        slot = numero % self.retention
+        self.bits[slot >> 3] |= 1 << (slot & 7)
+
+    def copy(self):
+        window = ChannelWindow(self.retention)
+        window.high = self.high
+        window.bits[:] = self.bits
+        window.bas = list(self.bas)
+        return window
+
+    def numbers(self):
+        """Processed game numbers still inside the window"""
+        start = max(self.high - self.retention + 1, 0)
+        return [n for n in range(start, self.high + 1) if self.contains(n)]
+
+class DedupIndex:
+    """Processed game numbers per channel, bounded by the window retention"""
+
+    def __init__(self, retention=RETENTION):
+        self.retention = retention
+        self.channels = {}
+
+    def contains(self, chat_id, numero):
+        """Check if a game of a channel was processed"""
+        window = self.channels.get(chat_id)
+        return window is not None and window.contains(numero)
+
+    def add(self, chat_id, numero):
+        """Mark a game of a channel as processed"""
+        window = self.channels.get(chat_id)
+        if window is None:
+            window = self.channels[chat_id] = ChannelWindow(self.retention)
+        window.add(numero)
+
+    def add_key(self, key):
+        """Mark a '{chat_id}_{numero}' key as processed"""
+        try:
+            chat_id, _, numero = key.rpartition("_")
+            self.add(int(chat_id), int(numero))
+        except ValueError:
+            logger.warning(f"Ignoring invalid dedup key: {key!r}")
+
+    def reset_channel(self, chat_id):
+        """Forget every processed game of a channel (O(1))"""
+        self.channels.pop(chat_id, None)
+
+    def copy(self):
+        """Independent copy, safe to serialize from another thread"""
+        index = DedupIndex(self.retention)
+        index.channels = {chat_id: window.copy() for chat_id, window in list(self.channels.items())}
+        return index
+
+    def keys(self):
+        """All '{chat_id}_{numero}' keys, as stored in the snapshot"""
+        for chat_id, window in self.channels.items():
+            for numero in window.numbers():
+                yield f"{chat_id}_{numero}"
+
+    def __len__(self):
+        return sum(len(window.numbers()) for window in self.channels.values())
+
+class DedupJournal:
+    """Journal lines: '+<key>' marks a key processed, '-<chat_id>' resets a channel.
+
+    Appends and compactions hold the lock of the journal file, and a
+    compaction rebuilds the snapshot from the files (plus the entries still
+    pending here), so keys appended by another process are kept. The index
+    in memory is still per process (see etat_partage).
+    """
+
+    def __init__(self, snapshot_file=SNAPSHOT_FILE, journal_file=JOURNAL_FILE,
+                 flush_interval=FLUSH_INTERVAL, compact_every=COMPACT_EVERY):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.pending = []
+        self.entries = 0
+        self.last_flush = time.monotonic()
+        # lock guards the pending list, io_lock the journal/snapshot files
+        self.lock = threading.Lock()
+        self.io_lock = threading.Lock()
+
+    def load(self, index=None):
+        """Rebuild the dedup index from the snapshot and the journal"""
+        if index is None:
+            index = DedupIndex()
+        try:
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                for key in json.load(f):
+                    index.add_key(key)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+        self.entries = 0
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    # A line without newline was cut by a crash, ignore it
+                    if not line.endswith("\n"):
+                        break
+                    op, value = line[0], line[1:-1]
+                    if op == "+":
+                        index.add_key(value)
+                    elif op == "-":
+                        index.reset_channel(int(value))
+                    self.entries += 1
+        except FileNotFoundError:
+            pass
+        return index
+
+    def append(self, key):
+        """Record a processed key, written at the next group commit"""
+        self._write(f"+{key}\n")
+
+    def record_reset(self, chat_id):
+        """Record that every key of a channel was forgotten"""
+        self._write(f"-{chat_id}\n")
+
+    def _write(self, line):
+        with self.lock:
+            self.pending.append(line)
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.last_flush = time.monotonic()
+            persistence_executor.submit(self.journal_file, self.flush)
+
+    def flush(self):
+        """Write pending entries to the journal in a single append"""
+        with self.io_lock:
+            with self.lock:
+                data = "".join(self.pending)
+                count = len(self.pending)
+                self.pending = []
+            self.last_flush = time.monotonic()
+            if not count:
+                return
+            try:
+                with verrou_fichier(self.journal_file), open(self.journal_file, "a", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.entries += count
+            except OSError as e:
+                logger.error(f"Could not write dedup journal: {e}")
+
+    def needs_compaction(self):
+        """True when the journal grew past the compaction threshold"""
+        return self.entries >= self.compact_every
+
+    def compact(self):
+        """Rewrite the snapshot atomically from snapshot + journal + pending
+        entries, and truncate the journal"""
+        with self.io_lock, verrou_fichier(self.journal_file):
+            # Anything recorded after this point goes to the new journal
+            with self.lock:
+                pending = self.pending
+                self.pending = []
+            index = self.load()
+            for line in pending:
+                op, value = line[0], line[1:-1]
+                if op == "+":
+                    index.add_key(value)
+                elif op == "-":
+                    index.reset_channel(int(value))
+            tmp_file = f"{self.snapshot_file}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(list(index.keys()), f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.snapshot_file)
+                open(self.journal_file, "w").close()
+                self.entries = 0
+            except OSError as e:
+                logger.error(f"Could not compact dedup journal: {e}")
+                # Not written: keep the entries for the next flush
+                with self.lock:
+                    self.pending = pending + self.pending
+
+    def request_compaction(self):
+        """Compact from the persistence writer thread"""
+        persistence_executor.submit(self.snapshot_file, self.compact)
+
+    def start_flusher(self):
+        """Flush pending entries every interval so idle channels are persisted"""
+        persistence_executor.every(max(self.flush_interval, 0.1), f"{self.journal_file}:flusher", self.flush)
+
+    def stop(self):
+        """Stop the periodic flush and write what is still pending"""
+        persistence_executor.cancel(f"{self.journal_file}:flusher")
+        self.flush()
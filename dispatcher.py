@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Update processor: channels are handled concurrently, updates of one channel in order
+"""
+import asyncio
+import os
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "8"))
+MAX_QUEUED_UPDATES = int(os.getenv("BOT_MAX_QUEUED_UPDATES", "4096"))
+
+class ChannelUpdateProcessor(BaseUpdateProcessor):
+    """Per-chat_id sharding for Application.concurrent_updates().
+
+    Each update waits for the previous update of the same chat before it
+    runs, so '#n' progress edits and final versions of a channel are applied
+    in arrival order, while up to max_concurrent_updates updates of
+    different chats run at the same time.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES,
+                 max_queued_updates=MAX_QUEUED_UPDATES):
+        # The base class semaphore only bounds the updates in flight: it does
+        # not block in practice, so do_process_update is entered in the order
+        # the Application received the updates. The concurrency limit is
+        # applied below, once the update has its place in its chat queue.
+        super().__init__(max(max_queued_updates, max_concurrent_updates))
+        self.limite = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat_id -> future resolved when the last queued update of the chat is done
+        self.tails = {}
+        # Updates entered and not finished yet
+        self.en_vol = 0
+        # Called once no update is in flight any more: end of a polling round
+        self.fin_de_lot = None
+
+    @staticmethod
+    def chat_key(update):
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        # The place in the chat queue is taken before the first await
+        chat_id = self.chat_key(update)
+        previous = self.tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        self.tails[chat_id] = done
+        self.en_vol += 1
+        try:
+            if previous is not None:
+                await previous
+            async with self.limite:
+                await coroutine
+        finally:
+            done.set_result(None)
+            if self.tails.get(chat_id) is done:
+                del self.tails[chat_id]
+            self.en_vol -= 1
+            if self.en_vol == 0 and self.fin_de_lot:
+                # After the tasks already scheduled: the rest of the round
+                asyncio.get_running_loop().call_soon(self.verifier_fin_de_lot)
+
+    def verifier_fin_de_lot(self):
+        if self.en_vol == 0:
+            try:
+                self.fin_de_lot()
+            except Exception as e:
+                logger.error(f"Error committing the update batch: {e}")
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def active_chats(self):
+        """Number of chats with updates queued or running"""
+        return len(self.tails)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Outbound Telegram sends: rate-limited retry queue, and the live counter
+message of each channel (edited in place)
+"""
+import asyncio
+import json
+import os
+import time
+import logging
+from collections import deque
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from persistance import persistence_executor
+from metriques import latence_envoi
+from etat_partage import ecrire_json
+
+logger = logging.getLogger(__name__)
+
+# "reply": one new message per result (default), "edit": one live message per channel
+REPLY_MODE = os.getenv("COUNTER_REPLY_MODE", "reply").lower()
+# Seconds during which results of a channel are collapsed into one edit
+EDIT_DEBOUNCE = float(os.getenv("COUNTER_EDIT_DEBOUNCE", "2"))
+MESSAGES_FILE = "counter_messages.json"
+
+# Telegram limits: ~30 messages/s per bot, 20 messages/min per group or channel
+GLOBAL_PER_SECOND = float(os.getenv("SEND_GLOBAL_PER_SECOND", "30"))
+CHAT_PER_MINUTE = float(os.getenv("SEND_CHAT_PER_MINUTE", "20"))
+CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "3"))
+MAX_QUEUE = int(os.getenv("SEND_MAX_QUEUE", "1000"))
+
+class TokenBucket:
+    """rate tokens per second, up to capacity; block() pauses it (RetryAfter)"""
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        """Take a token and return 0, or return the seconds to wait for one"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            attente = self.reserve()
+            if not attente:
+                return
+            await asyncio.sleep(attente)
+
+    def block(self, secondes):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + secondes)
+
+class SendQueue:
+    """Outbound send queue honouring Telegram flood limits.
+
+    Sends are queued per chat and delivered in order by one task per active
+    chat, after taking a token from the chat bucket and the global bucket.
+    RetryAfter pauses the chat for the requested time and retries; network
+    errors are retried with backoff; any other error (BadRequest, Forbidden,
+    ChatMigrated...) is not retried.
+    A send is dropped after max_retries retries or when the queue is full.
+    """
+
+    def __init__(self, global_per_second=GLOBAL_PER_SECOND, chat_per_minute=CHAT_PER_MINUTE,
+                 chat_burst=CHAT_BURST, max_retries=MAX_RETRIES, max_queue=MAX_QUEUE):
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.chat_rate = chat_per_minute / 60
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self.chat_buckets = {}
+        self.queues = {}
+        self.workers = {}
+        self.queued = 0
+        self.stats = {"sent": 0, "retries": 0, "retry_after": 0, "dropped": 0, "failed": 0, "max_depth": 0}
+
+    def submit(self, chat_id, fonction, *args, wait=False):
+        """Queue `await fonction(*args)`; returns a future with its result.
+
+        Without wait the future never raises: failures are logged and counted.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self.queued >= self.max_queue:
+            self.stats["dropped"] += 1
+            logger.warning(f"Send queue full, dropping message to {chat_id}")
+            future.set_result(None)
+            return future
+        self.queues.setdefault(chat_id, deque()).append((fonction, args, future, wait, time.perf_counter()))
+        self.queued += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.queued)
+        if chat_id not in self.workers:
+            self.workers[chat_id] = loop.create_task(self._worker(chat_id))
+        return future
+
+    async def send(self, chat_id, fonction, *args):
+        """Queue a send and wait for its result (raises the final error)"""
+        return await self.submit(chat_id, fonction, *args, wait=True)
+
+    async def _worker(self, chat_id):
+        queue = self.queues[chat_id]
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        try:
+            while queue:
+                fonction, args, future, wait, debut = queue[0]
+                try:
+                    result, error = await self._deliver(chat_id, bucket, fonction, args)
+                except BaseException:
+                    # Task cancelled (shutdown): the waiting caller is released
+                    future.cancel()
+                    raise
+                finally:
+                    # The head always leaves the queue, so it never blocks the chat
+                    latence_envoi.observe(time.perf_counter() - debut)
+                    queue.popleft()
+                    self.queued -= 1
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                elif wait:
+                    future.set_exception(error)
+                else:
+                    logger.error(f"Could not send message to {chat_id}: {error}")
+                    future.set_result(None)
+        finally:
+            del self.workers[chat_id]
+            if not queue:
+                self.queues.pop(chat_id, None)
+
+    async def _deliver(self, chat_id, bucket, fonction, args):
+        """Send with rate limiting and bounded retries; returns (result, error)"""
+        attempts = 0
+        while True:
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                result = await fonction(*args)
+                self.stats["sent"] += 1
+                return result, None
+            except RetryAfter as e:
+                self.stats["retry_after"] += 1
+                logger.warning(f"Flood control for {chat_id}: retry in {e.retry_after}s")
+                bucket.block(float(e.retry_after))
+                error = e
+            except (BadRequest, Forbidden) as e:
+                self.stats["failed"] += 1
+                return None, e
+            except NetworkError as e:
+                bucket.block(2 ** attempts)
+                error = e
+            except Exception as e:
+                # ChatMigrated, other TelegramError or a bug in fonction: not retried
+                self.stats["failed"] += 1
+                return None, e
+            attempts += 1
+            if attempts > self.max_retries:
+                self.stats["dropped"] += 1
+                return None, error
+            self.stats["retries"] += 1
+
+    def metrics(self):
+        """Queue depth and send counters"""
+        metrics = dict(self.stats)
+        metrics["depth"] = self.queued
+        metrics["active_chats"] = len(self.workers)
+        return metrics
+
+# Global instance
+send_queue = SendQueue()
+
+class CounterMessages:
+    """Keeps the last counter message of each channel and edits it.
+
+    schedule() only records that a channel has fresh counters; the text is
+    rendered and sent once the debounce window is over, so a burst of
+    results costs a single API call. When the live message is gone (deleted,
+    too old to edit) a new reply becomes the live message.
+    """
+
+    def __init__(self, render, debounce=EDIT_DEBOUNCE, fichier=MESSAGES_FILE):
+        self.render = render
+        self.debounce = debounce
+        self.fichier = fichier
+        self.messages = {}
+        self.last_text = {}
+        self.pending = {}
+        self.tasks = {}
+
+    def load(self):
+        """Load the live message ids saved by a previous run"""
+        try:
+            with open(self.fichier, "r", encoding="utf-8") as f:
+                self.messages = {int(chat_id): message_id for chat_id, message_id in json.load(f).items()}
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            self.messages = {}
+
+    def _write(self, messages):
+        ecrire_json(self.fichier, messages)
+
+    def save(self):
+        persistence_executor.submit(self.fichier, self._write, {str(k): v for k, v in self.messages.items()})
+
+    def schedule(self, bot, msg):
+        """Publish the counters of msg's channel at the end of the debounce window"""
+        chat_id = msg.chat_id
+        self.pending[chat_id] = msg
+        if chat_id not in self.tasks:
+            self.tasks[chat_id] = asyncio.get_running_loop().create_task(self._publish_later(bot, chat_id))
+
+    async def _publish_later(self, bot, chat_id):
+        # Registered until the publish is sent (it can outlast the debounce
+        # once the chat's send budget is spent), so a channel never has two
+        # publishes, hence two replies, in flight; results that arrived
+        # meanwhile get one more window
+        try:
+            while chat_id in self.pending:
+                await asyncio.sleep(self.debounce)
+                msg = self.pending.pop(chat_id, None)
+                if msg is None:
+                    return
+                try:
+                    await self.publish(bot, chat_id, msg, self.render(chat_id))
+                except Exception as e:
+                    logger.error(f"Could not publish counters to {chat_id}: {e}")
+        finally:
+            self.tasks.pop(chat_id, None)
+
+    async def publish(self, bot, chat_id, msg, text):
+        """Edit the live message of the channel, or reply when it is gone"""
+        message_id = self.messages.get(chat_id)
+        if message_id is not None:
+            if self.last_text.get(chat_id) == text:
+                return
+            try:
+                await send_queue.send(chat_id, bot.edit_message_text, text, chat_id, message_id)
+                self.last_text[chat_id] = text
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    self.last_text[chat_id] = text
+                    return
+                logger.info(f"Counter message of {chat_id} can't be edited ({e}), sending a new one")
+                self.messages.pop(chat_id, None)
+
+        sent = await send_queue.send(chat_id, msg.reply_text, text)
+        self.messages[chat_id] = sent.message_id
+        self.last_text[chat_id] = text
+        self.save()
+
+    def forget(self, chat_id):
+        """Drop the live message of a channel (next result starts a new one)"""
+        if self.messages.pop(chat_id, None) is not None:
+            self.save()
+        self.last_text.pop(chat_id, None)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+State files shared by several processes (bot workers, web workers).
+
+Writes go to a per-process temporary file renamed over the target, so a
+reader always sees a complete file. Read-modify-write cycles (counters
+merged by several bot workers, the channel index) hold an advisory lock
+on <file>.lock. This keeps the files consistent, but the dedup index and
+the game ledger in memory are per process: only one process should handle
+updates with files (the polling lease of bail.py ensures it for polling);
+several webhook workers need BOT_STORAGE=sqlite or redis.
+"""
+import json
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): a single process per directory
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ESSAIS_LECTURE = 3
+
+@contextmanager
+def verrou_fichier(fichier, exclusif=True):
+    """Advisory lock on <fichier>.lock, shared or exclusive, across processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{fichier}.lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusif else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def ecrire_json(fichier, data):
+    """Replace fichier atomically: readers see the old or the new content"""
+    fichier_tmp = f"{fichier}.{os.getpid()}.tmp"
+    with open(fichier_tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(fichier_tmp, fichier)
+
+def lire_json(fichier, defaut=None):
+    """Content of fichier, defaut when it does not exist.
+
+    A file that does not decode is read again a few times (it may come from
+    a writer that does not rename yet) and then raises json.JSONDecodeError:
+    the caller decides, instead of silently starting from zero.
+    """
+    for essai in range(ESSAIS_LECTURE):
+        try:
+            with open(fichier, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return defaut
+        except json.JSONDecodeError:
+            if essai == ESSAIS_LECTURE - 1:
+                raise
+            time.sleep(0.01 * (essai + 1))
+
+def maj_json(fichier, fonction, defaut=None):
+    """Locked read-modify-write: writes and returns fonction(current content)"""
+    with verrou_fichier(fichier):
+        data = fonction(lire_json(fichier, defaut))
+        ecrire_json(fichier, data)
+        return data
+
+def mettre_de_cote(fichier):
+    """Rename an unreadable file aside (kept for inspection), returns the new name"""
+    nom = f"{fichier}.corrupt-{int(time.time())}"
+    try:
+        os.replace(fichier, nom)
+        logger.error(f"Unreadable {fichier} moved to {nom}")
+    except OSError as e:
+        logger.error(f"Could not move unreadable {fichier} aside: {e}")
+    return nom
@@ -1,39 +1,293 @@
-import json
+#!/usr/bin/env python3
+"""
+History of processed messages, per (channel, message_id): a scalable Bloom
+filter in memory in front of an exact on-disk index.
+
+New messages, the common case, are answered by the filter alone; the exact
+index is only read to confirm a positive. Exact index: the historique table
+of the storage backend (BOT_STORAGE=sqlite/redis), or its own SQLite file
+(HISTORY_DB_PATH) with JSON files.
+
+render_bot does not use it: games are deduplicated by game number
+(dedup.py), since an edit keeps its message_id but must be counted again.
+The dashboards only read the count (get_messages_count, no filter load).
+"""
+import base64
+import hashlib
+import math
 import os
+import sqlite3
+import threading
+import logging
+from etat_partage import ecrire_json, lire_json
+from persistance import persistence_executor
+from stockage_sqlite import get_stockage
 
-messages_traite = set()
+logger = logging.getLogger(__name__)
 
-def sauvegarder_messages_traite():
-    """Save processed messages to JSON file"""
-    with open("messages_traite.json", "w") as f:
-        json.dump(list(messages_traite), f)
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "historique.db")
+FILTER_FILE = "historique_bloom.json"
+LEGACY_FILE = "messages_traite.json"
+# Items of the first filter and overall false-positive rate
+BLOOM_CAPACITY = int(os.getenv("HISTORY_BLOOM_CAPACITY", "4096"))
+BLOOM_FP_RATE = float(os.getenv("HISTORY_BLOOM_FP_RATE", "0.001"))
+# Filter state saved every N additions: a state behind the index is rebuilt
+# at load, so losing the last additions only costs startup time
+FILTER_SAVE_EVERY = int(os.getenv("HISTORY_FILTER_SAVE_EVERY", "500"))
+
+class FiltreBloom:
+    """Bloom filter sized for `capacite` items at `taux` false positives"""
+    __slots__ = ("capacite", "taux", "m", "k", "bits", "nombre")
+
+    def __init__(self, capacite, taux, bits=None, nombre=0):
+        self.capacite = capacite
+        self.taux = taux
+        self.m = max(8, math.ceil(-capacite * math.log(taux) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / capacite * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.m + 7) // 8)
+        self.nombre = nombre
+
+    def contient(self, h1, h2):
+        m, bits = self.m, self.bits
+        for i in range(self.k):
+            position = (h1 + i * h2) % m
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def ajouter(self, h1, h2):
+        m, bits = self.m, self.bits
+        for i in range(self.k):
+            position = (h1 + i * h2) % m
+            bits[position >> 3] |= 1 << (position & 7)
+        self.nombre += 1
+
+    def vers_dict(self):
+        return {"capacite": self.capacite, "taux": self.taux, "nombre": self.nombre,
+                "bits": base64.b64encode(self.bits).decode("ascii")}
+
+    @classmethod
+    def depuis_dict(cls, d):
+        return cls(d["capacite"], d["taux"], bytearray(base64.b64decode(d["bits"])), d["nombre"])
+
+class BloomExtensible:
+    """Scalable Bloom filter (Almeida et al.): when the newest filter is full,
+    one twice as large with half its error rate is added. The rates form a
+    geometric series, so the overall rate stays under `taux` however many
+    items are added, and memory grows with the items actually seen.
+    """
+    CROISSANCE = 2
+    RESSERREMENT = 0.5
+
+    def __init__(self, capacite=BLOOM_CAPACITY, taux=BLOOM_FP_RATE, filtres=None):
+        self.capacite = capacite
+        self.taux = taux
+        self.filtres = filtres or [FiltreBloom(capacite, taux * (1 - self.RESSERREMENT))]
+
+    @staticmethod
+    def hacher(cle):
+        """Two 64-bit hashes (double hashing gives the k positions)"""
+        digest = hashlib.blake2b(cle.encode("utf-8"), digest_size=16).digest()
+        return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+    def contient(self, cle):
+        h1, h2 = self.hacher(cle)
+        for filtre in self.filtres:
+            if filtre.contient(h1, h2):
+                return True
+        return False
+
+    def ajouter(self, cle):
+        """Add a key not added before (the caller checks the exact index)"""
+        h1, h2 = self.hacher(cle)
+        dernier = self.filtres[-1]
+        if dernier.nombre >= dernier.capacite:
+            dernier = FiltreBloom(dernier.capacite * self.CROISSANCE, dernier.taux * self.RESSERREMENT)
+            self.filtres.append(dernier)
+        dernier.ajouter(h1, h2)
+
+    def nombre(self):
+        return sum(filtre.nombre for filtre in self.filtres)
+
+    def taille_octets(self):
+        return sum(len(filtre.bits) for filtre in self.filtres)
+
+    def vers_dict(self):
+        return {"capacite": self.capacite, "taux": self.taux,
+                "filtres": [filtre.vers_dict() for filtre in self.filtres]}
+
+    @classmethod
+    def depuis_dict(cls, d):
+        return cls(d["capacite"], d["taux"], [FiltreBloom.depuis_dict(f) for f in d["filtres"]])
+
+class IndexExact:
+    """Exact set of processed keys in a SQLite file (JSON-files mode)"""
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS historique (numero TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def ajouter_historique(self, cle):
+        with self.lock:
+            return self.conn.execute("INSERT OR IGNORE INTO historique (numero) VALUES (?)", (cle,)).rowcount == 1
+
+    def ajouter_historiques(self, cles):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR IGNORE INTO historique (numero) VALUES (?)", [(cle,) for cle in cles])
+            self.conn.execute("COMMIT")
+
+    def est_historique(self, cle):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM historique WHERE numero = ?", (cle,)).fetchone() is not None
+
+    def compter_historique(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM historique").fetchone()[0]
+
+    def cles_historique(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT numero FROM historique")]
+
+    def reset_historique(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM historique")
+
+# Loaded on first use
+index_exact = None
+filtre = None
+verrou = threading.RLock()
+stats = {"negatifs": 0, "confirmes": 0, "faux_positifs": 0}
+ajouts_non_sauves = 0
+
+def cle_message(chat_id, message_id):
+    return f"{chat_id}:{message_id}"
+
+def get_index():
+    """Exact index: the storage backend, or the history SQLite file"""
+    global index_exact
+    if index_exact is None:
+        index = get_stockage() or IndexExact()
+        migrer_ancien_fichier(index)
+        index_exact = index
+    return index_exact
+
+def reconstruire_filtre(index):
+    """Filter holding every key of the exact index"""
+    nouveau = BloomExtensible()
+    for cle in index.cles_historique():
+        nouveau.ajouter(cle)
+    return nouveau
 
 def charger_messages_traite():
-    """Load processed messages from JSON file if it exists"""
-    global messages_traite
-    if os.path.exists("messages_traite.json"):
-        with open("messages_traite.json", "r") as f:
-            try:
-                data = json.load(f)
-                messages_traite = set(data)
-            except json.JSONDecodeError:
-                messages_traite = set()
+    """Load the filter (once per process), rebuilt when it lags behind the index"""
+    global filtre
+    with verrou:
+        if filtre is not None:
+            return
+        index = get_index()
+        try:
+            data = lire_json(FILTER_FILE)
+            charge = BloomExtensible.depuis_dict(data) if data else None
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Could not load history filter: {e}")
+            charge = None
+        # Keys added after the last save (crash, other process) would be
+        # false negatives: the filter must cover the whole index
+        if charge is None or charge.nombre() != index.compter_historique():
+            charge = reconstruire_filtre(index)
+            persistence_executor.submit(FILTER_FILE, sauvegarder_messages_traite)
+        filtre = charge
+
+def migrer_ancien_fichier(index):
+    """Import the former messages_traite.json list into the exact index"""
+    if not os.path.exists(LEGACY_FILE):
+        return
+    try:
+        anciens = lire_json(LEGACY_FILE, [])
+        if isinstance(index, IndexExact):
+            index.ajouter_historiques(str(numero) for numero in anciens)
+        else:
+            for numero in anciens:
+                index.ajouter_historique(str(numero))
+        os.replace(LEGACY_FILE, f"{LEGACY_FILE}.migrated")
+        logger.info(f"{len(anciens)} history entries imported from {LEGACY_FILE}")
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not import {LEGACY_FILE}: {e}")
+
+def sauvegarder_messages_traite():
+    """Save the filter state (the exact index is written on every add)"""
+    global ajouts_non_sauves
+    with verrou:
+        if filtre is None:
+            return
+        data = filtre.vers_dict()
+        ajouts_non_sauves = 0
+    ecrire_json(FILTER_FILE, data)
+
+def message_deja_traite(chat_id, message_id):
+    """Check if a message of a channel was processed"""
+    return est_traite(cle_message(chat_id, message_id))
+
+def ajouter_message_traite(chat_id, message_id):
+    """Record a processed message; False when it was already recorded.
+
+    The filter is per process: when several processes record messages, use
+    this return value (exact index) rather than message_deja_traite.
+    """
+    return ajouter(cle_message(chat_id, message_id))
+
+def est_traite(cle):
+    charger_messages_traite()
+    with verrou:
+        if not filtre.contient(cle):
+            stats["negatifs"] += 1
+            return False
+    if get_index().est_historique(cle):
+        stats["confirmes"] += 1
+        return True
+    stats["faux_positifs"] += 1
+    return False
+
+def ajouter(cle):
+    global ajouts_non_sauves
+    charger_messages_traite()
+    nouveau = get_index().ajouter_historique(cle)
+    with verrou:
+        if nouveau or not filtre.contient(cle):
+            filtre.ajouter(cle)
+            ajouts_non_sauves += 1
+        a_sauver = ajouts_non_sauves >= FILTER_SAVE_EVERY
+    if a_sauver:
+        persistence_executor.submit(FILTER_FILE, sauvegarder_messages_traite)
+    return nouveau
 
 def add_message_traite(numero):
     """Add a message number to processed messages"""
-    messages_traite.add(numero)
-    sauvegarder_messages_traite()
+    ajouter(str(numero))
 
 def is_message_traite(numero):
     """Check if a message number has been processed"""
-    return numero in messages_traite
+    return est_traite(str(numero))
 
 def get_messages_count():
     """Get count of processed messages"""
-    return len(messages_traite)
+    return get_index().compter_historique()
+
+def get_filter_stats():
+    """Filter size and how lookups were answered"""
+    charger_messages_traite()
+    with verrou:
+        return dict(stats, elements=filtre.nombre(), filtres=len(filtre.filtres),
+                    octets=filtre.taille_octets(), taux=filtre.taux)
 
 def reset_messages_traite():
     """Reset processed messages"""
-    global messages_traite
-    messages_traite.clear()
-    sauvegarder_messages_traite()
+    global filtre
+    get_index().reset_historique()
+    with verrou:
+        filtre = BloomExtensible()
+    persistence_executor.submit(FILTER_FILE, sauvegarder_messages_traite)
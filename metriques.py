@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Metrics registry (counters, histograms, gauges) in the Prometheus text format
+"""
+import os
+import time
+from bisect import bisect_left
+
+METRICS_FILE = "metrics.prom"
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "15"))
+# Seconds: 50 µs .. 10 s
+BUCKETS_LATENCE = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Compteur:
+    """Monotonic counter.
+
+    No lock: each metric is updated from a single thread (the event loop or
+    the writer thread), and reading a slightly old value is fine.
+    """
+    __slots__ = ("valeur",)
+
+    def __init__(self):
+        self.valeur = 0
+
+    def inc(self, n=1):
+        self.valeur += n
+
+class Histogramme:
+    """Fixed buckets; observe() only increments preallocated slots"""
+    __slots__ = ("bornes", "comptes", "somme", "nombre")
+
+    def __init__(self, bornes=BUCKETS_LATENCE):
+        self.bornes = bornes
+        self.comptes = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+        self.nombre = 0
+
+    def observe(self, valeur):
+        self.comptes[bisect_left(self.bornes, valeur)] += 1
+        self.somme += valeur
+        self.nombre += 1
+
+class Famille:
+    """A metric and its children, one per label value, created up front"""
+
+    def __init__(self, nom, aide, type_metrique, label=None, valeurs=(), fabrique=Compteur):
+        self.nom = nom
+        self.aide = aide
+        self.type = type_metrique
+        self.label = label
+        self.enfants = {valeur: fabrique() for valeur in valeurs} if label else {None: fabrique()}
+
+    def labels(self, valeur=None):
+        """Child of a label value (the only child when unlabelled)"""
+        return self.enfants[valeur]
+
+    def lignes(self):
+        yield f"# HELP {self.nom} {self.aide}"
+        yield f"# TYPE {self.nom} {self.type}"
+        for valeur, enfant in self.enfants.items():
+            etiquette = f'{self.label}="{valeur}"' if self.label else ""
+            if isinstance(enfant, Histogramme):
+                cumul = 0
+                for borne, compte in zip(enfant.bornes + (float("inf"),), enfant.comptes):
+                    cumul += compte
+                    le = "+Inf" if borne == float("inf") else repr(borne)
+                    yield f'{self.nom}_bucket{{{etiquette + "," if etiquette else ""}le="{le}"}} {cumul}'
+                suffixe = f"{{{etiquette}}}" if etiquette else ""
+                yield f"{self.nom}_sum{suffixe} {enfant.somme}"
+                yield f"{self.nom}_count{suffixe} {enfant.nombre}"
+            else:
+                suffixe = f"{{{etiquette}}}" if etiquette else ""
+                yield f"{self.nom}{suffixe} {enfant.valeur}"
+
+class Jauge:
+    """Value read from a function at export time (queue depths...)"""
+
+    def __init__(self, nom, aide, fonction):
+        self.nom = nom
+        self.aide = aide
+        self.fonction = fonction
+
+    def lignes(self):
+        yield f"# HELP {self.nom} {self.aide}"
+        yield f"# TYPE {self.nom} gauge"
+        try:
+            yield f"{self.nom} {self.fonction()}"
+        except Exception:
+            pass
+
+class Registre:
+    """Every metric of the process, exported as Prometheus text"""
+
+    def __init__(self):
+        self.metriques = {}
+        # True once the bot runs in this process: /metrics serves live values
+        self.local = False
+
+    def compteur(self, nom, aide, label=None, valeurs=()):
+        return self._ajouter(Famille(nom, aide, "counter", label, valeurs))
+
+    def histogramme(self, nom, aide, label=None, valeurs=(), bornes=BUCKETS_LATENCE):
+        return self._ajouter(Famille(nom, aide, "histogram", label, valeurs, lambda: Histogramme(bornes)))
+
+    def jauge(self, nom, aide, fonction):
+        return self._ajouter(Jauge(nom, aide, fonction))
+
+    def _ajouter(self, metrique):
+        self.metriques[metrique.nom] = metrique
+        return metrique
+
+    def exposer(self):
+        """Prometheus text exposition of every metric"""
+        lignes = []
+        for metrique in self.metriques.values():
+            lignes.extend(metrique.lignes())
+        return "\n".join(lignes) + "\n"
+
+    def ecrire(self, fichier=METRICS_FILE):
+        """Snapshot for the web process when the bot runs in another one"""
+        fichier_tmp = f"{fichier}.{os.getpid()}.tmp"
+        with open(fichier_tmp, "w", encoding="utf-8") as f:
+            f.write(self.exposer())
+            f.write(f"# snapshot {time.time():.0f}\n")
+        os.replace(fichier_tmp, fichier)
+
+# Global instance
+registre = Registre()
+
+TYPES_UPDATE = ("message", "edited_message", "channel_post", "edited_channel_post", "other")
+SUITS = {"❤️": "hearts", "♦️": "diamonds", "♣️": "clubs", "♠️": "spades"}
+
+# Hot-path metrics: children are resolved once here, not per event
+updates_recus = registre.compteur("bot_updates_total", "Updates received by handle_message", "type", TYPES_UPDATE)
+updates_ignores = registre.compteur("bot_updates_skipped_total", "Updates skipped", "reason",
+                                    ("progress", "duplicate", "no_text", "unchanged_edit", "unrecorded_edit"))
+ignores_progression = updates_ignores.labels("progress")
+ignores_doublon = updates_ignores.labels("duplicate")
+ignores_sans_texte = updates_ignores.labels("no_text")
+ignores_edition_identique = updates_ignores.labels("unchanged_edit")
+ignores_edition_inconnue = updates_ignores.labels("unrecorded_edit")
+editions_retraitees = registre.compteur("bot_edits_reprocessed_total", "Edited results corrected").labels()
+cartes_comptees = registre.compteur("bot_cards_counted_total", "Cards counted per suit", "suit", SUITS.values())
+cartes_par_symbole = {symbole: cartes_comptees.labels(nom) for symbole, nom in SUITS.items()}
+latence_handler = registre.histogramme("bot_handle_message_seconds", "handle_message duration").labels()
+latence_envoi = registre.histogramme("bot_send_seconds", "Send duration from queueing to delivery").labels()
+duree_ecriture = registre.histogramme("bot_disk_write_seconds", "Duration of each persistence write").labels()
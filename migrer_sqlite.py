@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Import the JSON state files, the history series and the game ledger into the
+SQLite database (BOT_STORAGE=sqlite)
+
+Usage: python migrer_sqlite.py [--db bot_data.db] [--dir .]
+"""
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+from dedup import DedupJournal
+from historique import IndexExact, HISTORY_DB_PATH
+from registre_parties import LEDGER_DB_PATH
+from stockage_sqlite import (
+    StockageSQLite, SQL_ECRIRE_COMPTEUR, SQL_MARQUER_TRAITE, SQL_AJOUTER_HISTORIQUE, SQL_ECRIRE_PARTIE,
+    SQL_ECRIRE_TENDANCE, SQL_ECRIRE_STATISTIQUES, DB_PATH)
+
+def lire_json(chemin, defaut=None):
+    """Read a JSON file, returning defaut if missing or invalid"""
+    try:
+        with open(chemin, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return defaut
+
+def migrer(db_path, dossier):
+    """Import counters, processed games, history, time series, game ledger
+    and status; returns the counts"""
+    stockage = StockageSQLite(db_path)
+    resume = {"canaux": 0, "messages_traites": 0, "historique": 0, "tendances": 0, "statistiques": 0, "parties": 0,
+              "statut": False}
+
+    compteurs = {}
+    for fichier in glob.glob(os.path.join(dossier, "compteurs_*.json")):
+        nom = os.path.basename(fichier)[len("compteurs_"):-len(".json")]
+        try:
+            # Files store abs(chat_id); channels and groups are negative
+            chat_id = -int(nom)
+        except ValueError:
+            continue
+        data = lire_json(fichier)
+        if isinstance(data, dict):
+            compteurs[chat_id] = data
+
+    journal = DedupJournal(os.path.join(dossier, "processed_messages.json"),
+                           os.path.join(dossier, "processed_messages.journal"))
+    index = journal.load()
+    historique = [str(numero) for numero in lire_json(os.path.join(dossier, "messages_traite.json"), [])]
+    # Exact history index of the JSON-files mode
+    chemin_historique = os.path.join(dossier, HISTORY_DB_PATH)
+    if os.path.exists(chemin_historique):
+        historique.extend(IndexExact(chemin_historique).cles_historique())
+
+    # Time series of tendances.py: tendances_<chat_id>.json (signed chat_id)
+    tendances = []
+    for fichier in glob.glob(os.path.join(dossier, "tendances_*.json")):
+        nom = os.path.basename(fichier)[len("tendances_"):-len(".json")]
+        data = lire_json(fichier)
+        try:
+            chat_id = int(nom)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            tendances.extend((chat_id, resolution, json.dumps(serie)) for resolution, serie in data.items())
+            resume["tendances"] += 1
+
+    # Rolling statistics: statistiques_<chat_id>.json, or the former single file
+    statistiques = {}
+    for chat_id, d in (lire_json(os.path.join(dossier, "statistiques.json")) or {}).items():
+        statistiques[int(chat_id)] = d
+    for fichier in glob.glob(os.path.join(dossier, "statistiques_*.json")):
+        nom = os.path.basename(fichier)[len("statistiques_"):-len(".json")]
+        data = lire_json(fichier)
+        try:
+            chat_id = int(nom)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            statistiques[chat_id] = data
+    resume["statistiques"] = len(statistiques)
+
+    # Game ledger of the JSON-files mode: edits of these games stay counted
+    parties = []
+    chemin_registre = os.path.join(dossier, LEDGER_DB_PATH)
+    if os.path.exists(chemin_registre):
+        conn_registre = sqlite3.connect(chemin_registre)
+        try:
+            parties = conn_registre.execute("SELECT chat_id, numero, resultat FROM parties").fetchall()
+        finally:
+            conn_registre.close()
+
+    def operations(conn):
+        for chat_id, data in compteurs.items():
+            conn.executemany(SQL_ECRIRE_COMPTEUR,
+                             [(chat_id, symbole, total) for symbole, total in data.items()])
+        for chat_id, window in index.channels.items():
+            numeros = window.numbers()
+            conn.executemany(SQL_MARQUER_TRAITE, [(chat_id, numero) for numero in numeros])
+            resume["messages_traites"] += len(numeros)
+        conn.executemany(SQL_AJOUTER_HISTORIQUE, [(cle,) for cle in historique])
+        conn.executemany(SQL_ECRIRE_TENDANCE, tendances)
+        conn.executemany(SQL_ECRIRE_STATISTIQUES, [(chat_id, json.dumps(d)) for chat_id, d in statistiques.items()])
+        conn.executemany(SQL_ECRIRE_PARTIE, parties)
+
+    stockage.transaction(operations)
+    resume["canaux"] = len(compteurs)
+    resume["historique"] = len(historique)
+    resume["parties"] = len(parties)
+
+    statut = lire_json(os.path.join(dossier, "bot_status.json"))
+    if statut is not None:
+        stockage.sauver_statut(statut)
+        resume["statut"] = True
+    return resume
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate JSON state files to SQLite")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database file")
+    parser.add_argument("--dir", default=".", help="Directory holding the JSON files")
+    args = parser.parse_args()
+
+    try:
+        resume = migrer(args.db, args.dir)
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
+
+    print(f"✅ Migration done into {args.db}")
+    print(f"   Channels: {resume['canaux']}")
+    print(f"   Processed games: {resume['messages_traites']}")
+    print(f"   History entries: {resume['historique']}")
+    print(f"   Channels with time series: {resume['tendances']}")
+    print(f"   Channels with statistics: {resume['statistiques']}")
+    print(f"   Ledger games: {resume['parties']}")
+    print(f"   Status imported: {resume['statut']}")
+    print("Set BOT_STORAGE=sqlite to use it.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Card result message parser: game number, progress state and suit histogram
+"""
+import re
+from collections import namedtuple
+
+SYMBOLES = ("❤️", "♦️", "♣️", "♠️")
+
+# Common layout "#n<numero> ... (<cards>)" is matched in a single pass: first
+# game number, no "(" before it, then the first parentheses. The separate
+# patterns are only used for other layouts
+_ENTETE = re.compile(r"[^(]*?#n(\d+)[^(]*\(([^()]*)\)")
+_NUMERO = re.compile(r"#n(\d+)")
+_PARENTHESES = re.compile(r"\(([^()]*)\)")
+_PROGRESSION = re.compile("⏰|▶|🕐|➡️")
+
+class ResultatMessage(namedtuple("ResultatMessage", "numero contenu en_cours coeurs carreaux trefles piques")):
+    """Immutable parse result; numero/contenu are None when absent"""
+    __slots__ = ()
+
+    @property
+    def total(self):
+        return self.coeurs + self.carreaux + self.trefles + self.piques
+
+    def cartes(self):
+        """Non-zero suit counts as {symbol: count}"""
+        _, _, _, coeurs, carreaux, trefles, piques = self
+        cartes = {}
+        if coeurs:
+            cartes["❤️"] = coeurs
+        if carreaux:
+            cartes["♦️"] = carreaux
+        if trefles:
+            cartes["♣️"] = trefles
+        if piques:
+            cartes["♠️"] = piques
+        return cartes
+
+# Skips the Python-level namedtuple __new__ on the hot path
+_nouveau = tuple.__new__
+
+def analyser_message(text):
+    """Parse a channel message.
+
+    en_cours is True for a numbered message that still shows a progress
+    indicator (⏰ ▶ 🕐 ➡️) without a confirmation symbol (✅ 🔰): the final
+    version is still to come. Hearts count both ❤️ and ♥️.
+    """
+    entete = _ENTETE.match(text)
+    if entete is not None:
+        numero, contenu = entete.groups()
+        numero = int(numero)
+    else:
+        match_numero = _NUMERO.search(text)
+        numero = int(match_numero.group(1)) if match_numero else None
+        match = _PARENTHESES.search(text)
+        contenu = match.group(1) if match else None
+
+    en_cours = (numero is not None
+                and "✅" not in text and "🔰" not in text
+                and _PROGRESSION.search(text) is not None)
+
+    if contenu is None or en_cours:
+        return _nouveau(ResultatMessage, (numero, contenu, en_cours, 0, 0, 0, 0))
+
+    return _nouveau(ResultatMessage, (
+        numero, contenu, False,
+        contenu.count("❤️") + contenu.count("♥️"),
+        contenu.count("♦️"),
+        contenu.count("♣️"),
+        contenu.count("♠️"),
+    ))
+
+def delta_a_compter(resultat, deja_traite, modifie=False):
+    """Counting decision of handle_message for a parsed message.
+
+    None when there is nothing to count: no game number nor parentheses,
+    game still in progress, or game already counted and not edited.
+    Otherwise the {symbol: count} delta (possibly empty) to commit with
+    the game number.
+    """
+    if resultat.numero is not None:
+        if resultat.en_cours or (deja_traite and not modifie):
+            return None
+    elif resultat.contenu is None:
+        return None
+    return resultat.cartes() if resultat.contenu is not None else {}
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Single writer thread for blocking file I/O, fed by the async handlers
+"""
+import os
+import threading
+import time
+import logging
+from metriques import duree_ecriture
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = int(os.getenv("PERSISTENCE_MAX_PENDING", "1000"))
+
+class PersistenceExecutor:
+    """Runs writes in one background thread.
+
+    Writes are keyed (usually by file name): a write submitted while another
+    one with the same key is still queued replaces it, so a burst of status or
+    counter saves costs one disk write. Periodic jobs (flushers) run in the
+    same thread. When the thread is not started, writes run inline.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending = {}
+        self.periodic = {}
+        self.cond = threading.Condition()
+        self.running = False
+        self.busy = False
+        self.thread = None
+        self.stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "written": 0,
+            "errors": 0,
+            "max_depth": 0,
+            "blocked": 0,
+            "blocked_seconds": 0.0,
+            "write_seconds": 0.0,
+            "last_write_ms": 0.0,
+        }
+
+    def submit(self, key, fonction, *args):
+        """Queue fonction(*args), replacing a queued write with the same key"""
+        if not self.running:
+            self._execute(fonction, args)
+            return
+        with self.cond:
+            self.stats["submitted"] += 1
+            if key in self.pending:
+                self.stats["coalesced"] += 1
+            else:
+                if len(self.pending) >= self.max_pending:
+                    # Backpressure: wait for the writer to catch up
+                    self.stats["blocked"] += 1
+                    debut = time.monotonic()
+                    while len(self.pending) >= self.max_pending and self.running:
+                        self.cond.wait(0.1)
+                    self.stats["blocked_seconds"] += time.monotonic() - debut
+            self.pending[key] = (fonction, args)
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.pending))
+            self.cond.notify_all()
+
+    def every(self, intervalle, key, fonction):
+        """Run fonction() every intervalle seconds in the writer thread"""
+        with self.cond:
+            self.periodic[key] = [intervalle, fonction, time.monotonic() + intervalle]
+            self.cond.notify_all()
+
+    def cancel(self, key):
+        """Remove a periodic job"""
+        with self.cond:
+            self.periodic.pop(key, None)
+
+    def _execute(self, fonction, args):
+        debut = time.perf_counter()
+        try:
+            fonction(*args)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"Persistence write failed: {e}")
+        duree = time.perf_counter() - debut
+        duree_ecriture.observe(duree)
+        self.stats["written"] += 1
+        self.stats["write_seconds"] += duree
+        self.stats["last_write_ms"] = duree * 1000
+
+    def _next_job(self):
+        """Wait for the next queued write or due periodic job"""
+        with self.cond:
+            while self.running:
+                if self.pending:
+                    key = next(iter(self.pending))
+                    self.busy = True
+                    return self.pending.pop(key)
+                now = time.monotonic()
+                prochain = None
+                for job in self.periodic.values():
+                    intervalle, fonction, echeance = job
+                    if echeance <= now:
+                        job[2] = now + intervalle
+                        self.busy = True
+                        return fonction, ()
+                    prochain = echeance if prochain is None else min(prochain, echeance)
+                self.cond.wait(None if prochain is None else prochain - now)
+            return None
+
+    def run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._execute(*job)
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True, name="persistence-writer")
+        self.thread.start()
+        logger.info("Persistence writer started")
+
+    def flush(self, timeout=10.0):
+        """Wait until every queued write is done"""
+        limite = time.monotonic() + timeout
+        with self.cond:
+            while (self.pending or self.busy) and self.running:
+                restant = limite - time.monotonic()
+                if restant <= 0:
+                    return False
+                self.cond.wait(restant)
+        return True
+
+    def stop(self, timeout=10.0):
+        """Drain the queue and stop the writer thread (shutdown path)"""
+        if not self.running:
+            return
+        self.flush(timeout)
+        with self.cond:
+            self.running = False
+            restants = list(self.pending.values())
+            self.pending.clear()
+            self.cond.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        # Anything the thread could not finish is written inline
+        for fonction, args in restants:
+            self._execute(fonction, args)
+
+    def metrics(self):
+        """Queue depth and write counters"""
+        with self.cond:
+            metrics = dict(self.stats)
+            metrics["depth"] = len(self.pending)
+        return metrics
+
+# Global instance
+persistence_executor = PersistenceExecutor()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Per-game result ledger: (channel, game number) -> suit histogram counted.
+
+An edited result is counted as the difference with the recorded one, so an
+edit never counts the game twice. The last LEDGER_CACHE games of each
+channel are kept in a ring in memory (O(1) per game); every entry is also
+written behind, by the persistence writer thread, to the parties table of
+the storage backend (BOT_STORAGE=sqlite/redis) or to its own SQLite file
+(LEDGER_DB_PATH) with JSON files, keeping the last LEDGER_RETENTION games
+of each channel. Handlers never touch the disk: a ring miss reads the table
+in a thread (lire_async) and resets are written by the writer thread.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import logging
+from array import array
+from persistance import persistence_executor
+from stockage_sqlite import get_stockage
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DB_PATH = os.getenv("LEDGER_DB_PATH", "registre_parties.db")
+# Games kept on disk per channel (edits of older games are not counted)
+LEDGER_RETENTION = int(os.getenv("LEDGER_RETENTION", os.getenv("DEDUP_RETENTION", "2048")))
+# Games kept in memory per channel
+LEDGER_CACHE = int(os.getenv("LEDGER_CACHE", "64"))
+
+SYMBOLES = ("❤️", "♦️", "♣️", "♠️")
+# One 16-bit field per suit in a single integer
+BITS = 16
+MASQUE = (1 << BITS) - 1
+
+def compresser(cartes):
+    """{symbol: count} -> integer"""
+    valeur = 0
+    for i, symbole in enumerate(SYMBOLES):
+        valeur |= min(cartes.get(symbole, 0), MASQUE) << (BITS * i)
+    return valeur
+
+def decompresser(valeur):
+    """integer -> {symbol: count}"""
+    return {symbole: (valeur >> (BITS * i)) & MASQUE for i, symbole in enumerate(SYMBOLES)}
+
+class RegistreCanal:
+    """Ring of the last `taille` games of a channel: slot = numero % taille"""
+    __slots__ = ("numeros", "resultats")
+
+    def __init__(self, taille=LEDGER_CACHE):
+        self.numeros = array("q", [-1]) * taille
+        self.resultats = array("Q", [0]) * taille
+
+    def get(self, numero):
+        slot = numero % len(self.numeros)
+        return self.resultats[slot] if self.numeros[slot] == numero else None
+
+    def set(self, numero, resultat):
+        slot = numero % len(self.numeros)
+        self.numeros[slot] = numero
+        self.resultats[slot] = resultat
+
+class IndexParties:
+    """Ledger table in a SQLite file (JSON-files mode)"""
+
+    def __init__(self, path=LEDGER_DB_PATH):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS parties (chat_id INTEGER NOT NULL, numero INTEGER NOT NULL, "
+                          "resultat INTEGER NOT NULL, PRIMARY KEY (chat_id, numero)) WITHOUT ROWID")
+
+    def ecrire_parties(self, lignes, retention):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR REPLACE INTO parties (chat_id, numero, resultat) VALUES (?, ?, ?)", lignes)
+            plus_hauts = {}
+            for chat_id, numero, _ in lignes:
+                plus_hauts[chat_id] = max(numero, plus_hauts.get(chat_id, numero))
+            self.conn.executemany("DELETE FROM parties WHERE chat_id = ? AND numero <= ?",
+                                  [(chat_id, numero - retention) for chat_id, numero in plus_hauts.items()])
+            self.conn.execute("COMMIT")
+
+    def lire_partie(self, chat_id, numero):
+        with self.lock:
+            row = self.conn.execute("SELECT resultat FROM parties WHERE chat_id = ? AND numero = ?",
+                                    (chat_id, numero)).fetchone()
+        return row[0] if row else None
+
+    def reset_parties(self, chat_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM parties WHERE chat_id = ?", (chat_id,))
+
+# Loaded on first use (render_bot opens it in load_state)
+index_parties = None
+# chat_id -> ring, for the channels of the counter cache (see liberer)
+registres = {}
+# (chat_id, numero) -> result not written yet, and the results being written
+en_attente = {}
+en_ecriture = {}
+# Channels reset and not cleared on disk yet, and the ones being cleared
+a_effacer = set()
+en_effacement = set()
+verrou = threading.Lock()
+
+def get_index():
+    """Ledger table: the storage backend, or the ledger SQLite file"""
+    global index_parties
+    if index_parties is None:
+        index_parties = get_stockage() or IndexParties()
+    return index_parties
+
+def lire_memoire(chat_id, numero):
+    """Result from the ring or the pending writes, None on a miss"""
+    with verrou:
+        registre = registres.get(chat_id)
+        resultat = registre.get(numero) if registre else None
+        if resultat is None:
+            resultat = en_attente.get((chat_id, numero), en_ecriture.get((chat_id, numero)))
+        return resultat
+
+def lire_disque(chat_id, numero):
+    """Result from the ledger table (blocking)"""
+    with verrou:
+        if chat_id in a_effacer or chat_id in en_effacement:
+            return None  # Rows from before a reset not cleared yet
+    return get_index().lire_partie(chat_id, numero)
+
+def lire(chat_id, numero):
+    """Recorded result (integer) of a game, None if unknown (blocking on a
+    ring miss: for scripts, handlers use lire_async)"""
+    resultat = lire_memoire(chat_id, numero)
+    return resultat if resultat is not None else lire_disque(chat_id, numero)
+
+async def lire_async(chat_id, numero):
+    """lire() for the handlers: a ring miss reads the table in a thread"""
+    resultat = lire_memoire(chat_id, numero)
+    if resultat is None:
+        resultat = await asyncio.to_thread(lire_disque, chat_id, numero)
+    return resultat
+
+def enregistrer(chat_id, numero, cartes):
+    """Record the {symbol: count} counted for a game"""
+    resultat = compresser(cartes)
+    with verrou:
+        registre = registres.get(chat_id)
+        if registre is None:
+            registre = registres[chat_id] = RegistreCanal()
+        registre.set(numero, resultat)
+        en_attente[(chat_id, numero)] = resultat
+    persistence_executor.submit("registre_parties", ecrire_en_attente)
+
+async def corriger(chat_id, numero, cartes):
+    """Delta to count for an edited result: the new histogram minus the
+    recorded one, which it replaces. None when the game is not recorded
+    (counted before the ledger, or older than LEDGER_RETENTION games)."""
+    ancien = await lire_async(chat_id, numero)
+    if ancien is None:
+        return None
+    enregistrer(chat_id, numero, cartes)
+    return difference(cartes, decompresser(ancien))
+
+def difference(cartes, ancien):
+    """{symbol: count} to add to the counters to go from ancien to cartes"""
+    return {symbole: cartes.get(symbole, 0) - ancien.get(symbole, 0)
+            for symbole in SYMBOLES if cartes.get(symbole, 0) != ancien.get(symbole, 0)}
+
+def ecrire_en_attente():
+    """Clear the reset channels, then write the recorded results (runs in
+    the persistence writer thread)"""
+    global en_attente, en_ecriture, a_effacer, en_effacement
+    with verrou:
+        if not en_attente and not a_effacer:
+            return
+        en_ecriture, en_attente = en_attente, {}
+        en_effacement, a_effacer = a_effacer, set()
+        lignes = [(chat_id, numero, resultat) for (chat_id, numero), resultat in en_ecriture.items()]
+    # Games recorded after a reset are in lignes, so the clear goes first
+    for chat_id in en_effacement:
+        try:
+            get_index().reset_parties(chat_id)
+        except Exception as e:
+            logger.error(f"Could not clear game ledger of {chat_id}: {e}")
+    try:
+        if lignes:
+            get_index().ecrire_parties(lignes, LEDGER_RETENTION)
+    except Exception as e:
+        logger.error(f"Could not save game ledger: {e}")
+    with verrou:
+        en_ecriture = {}
+        en_effacement = set()
+
+async def resultat_partie(chat_id, numero):
+    """{symbol: count} recorded for a game, None if unknown"""
+    resultat = await lire_async(chat_id, numero)
+    return decompresser(resultat) if resultat is not None else None
+
+def liberer(chat_id):
+    """Drop the ring of a channel evicted from the counter cache (its
+    pending writes stay readable until written)"""
+    with verrou:
+        registres.pop(chat_id, None)
+
+def reset_canal(chat_id):
+    """Forget the games of a channel (cleared on disk by the writer thread)"""
+    with verrou:
+        registres.pop(chat_id, None)
+        for attente in (en_attente, en_ecriture):
+            for cle in [cle for cle in attente if cle[0] == chat_id]:
+                del attente[cle]
+        a_effacer.add(chat_id)
+    persistence_executor.submit("registre_parties", ecrire_en_attente)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Recount a channel from an exported message log, with the parsing, dedup and
+edit-correction rules of handle_message, and rebuild its counters, processed
+games and game ledger.
+
+Usage: python rejouer.py --chat -1001234567890 export.json [--format export|jsonl] [--dry-run]
+
+Sources: a Telegram Desktop JSON export of the channel (result.json) or a
+JSONL log with one message per line ({"text": ..., "chat_id": ...,
+"edited": ...}, or raw Bot API updates). Messages are streamed one at a time, so memory does not
+grow with the size of the log. Stop the bot before writing: it would
+overwrite the rebuilt state with its own.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from compteur import remplacer_compteurs_canal, flush_compteurs
+from dedup import ChannelWindow, DedupJournal
+from parseur import analyser_message, delta_a_compter
+from stockage_sqlite import get_stockage
+import registre_parties
+
+TAILLE_BLOC = 1 << 20
+_SEPARATEURS = re.compile(r"[\s,]*")
+CLES_UPDATE = (("message", False), ("channel_post", False),
+               ("edited_message", True), ("edited_channel_post", True))
+
+def lire_export(fichier, taille_bloc=TAILLE_BLOC):
+    """Messages of a Telegram Desktop export, decoded one at a time"""
+    decodeur = json.JSONDecoder()
+    with open(fichier, "r", encoding="utf-8") as f:
+        # Skip to the start of the "messages" array
+        tampon = ""
+        while True:
+            bloc = f.read(taille_bloc)
+            if not bloc:
+                return
+            tampon += bloc
+            debut = tampon.find('"messages"')
+            if debut >= 0 and tampon.find("[", debut) >= 0:
+                tampon = tampon[tampon.find("[", debut) + 1:]
+                break
+            if debut < 0:
+                tampon = tampon[-len('"messages"'):]
+
+        # scan_once is what raw_decode calls, without its per-call wrapper
+        scan_once = decodeur.scan_once
+        separateurs = _SEPARATEURS.match
+        pos = 0
+        while True:
+            pos = separateurs(tampon, pos).end()
+            try:
+                message, pos = scan_once(tampon, pos)
+            except (StopIteration, ValueError):
+                if tampon.startswith("]", pos):
+                    return
+                # Message cut at the end of the block: read the next one
+                bloc = f.read(taille_bloc)
+                if not bloc:
+                    return
+                tampon = tampon[pos:] + bloc
+                pos = 0
+                continue
+            yield message
+
+def lire_jsonl(fichier):
+    """One message (or Bot API update) per line"""
+    with open(fichier, "r", encoding="utf-8") as f:
+        for ligne in f:
+            if ligne.strip():
+                yield json.loads(ligne)
+
+def texte_message(texte):
+    """Export texts are either a string or a list of strings and entities"""
+    if isinstance(texte, list):
+        return "".join(morceau if isinstance(morceau, str) else morceau.get("text", "") for morceau in texte)
+    return texte
+
+def textes_export(messages, chat_id, resume):
+    """(text, edited) of an export: one chat, final versions of the messages"""
+    for message in messages:
+        resume["messages"] += 1
+        if message.get("type") == "message":
+            texte = message.get("text")
+            if texte.__class__ is not str:
+                texte = texte_message(texte)
+            if texte:
+                yield texte, False
+
+def textes_jsonl(messages, chat_id, resume):
+    """(text, edited) of the text messages of the channel in a JSONL log"""
+    for message in messages:
+        resume["messages"] += 1
+        modifie = message.get("edited") is True
+        if "update_id" in message:
+            for cle, edition in CLES_UPDATE:
+                if cle in message:
+                    message, modifie = message[cle], edition
+                    break
+            else:
+                continue
+        source = message.get("chat_id")
+        if source is None and "chat" in message:
+            source = message["chat"].get("id")
+        if source is not None and source != chat_id:
+            continue
+        texte = texte_message(message.get("text"))
+        if texte:
+            yield texte, modifie
+
+def deltas(textes, fenetre, parties):
+    """(numero, delta) committed by handle_message for each text of one channel.
+
+    parties is the game ledger of the channel ({numero: histogram}): an
+    edited game yields the difference with its recorded result, like
+    registre_parties.corriger, and nothing when it is not recorded.
+    """
+    contains = fenetre.contains
+    add = fenetre.add
+    retention = registre_parties.LEDGER_RETENTION
+    plus_haut = None
+    for texte, modifie in textes:
+        resultat = analyser_message(texte)
+        numero = resultat.numero
+        if numero is not None:
+            # Most lines of a log are progress versions and repeats of a
+            # counted game: skip them before delta_a_compter
+            if resultat.en_cours:
+                continue
+            deja_traite = contains(numero)
+            if deja_traite and not modifie:
+                continue
+        else:
+            deja_traite = False
+        delta = delta_a_compter(resultat, deja_traite, modifie)
+        if delta is None:
+            continue
+        if numero is not None:
+            if deja_traite:
+                ancien = parties.get(numero)
+                if ancien is None:
+                    continue
+                parties[numero] = delta
+                delta = registre_parties.difference(delta, ancien)
+                if not delta:
+                    continue
+            else:
+                parties[numero] = delta
+            add(numero)
+            # Same retention as the ledger table
+            plus_haut = numero if plus_haut is None else max(plus_haut, numero)
+            if len(parties) > 2 * retention:
+                for ancien_numero in [n for n in parties if n <= plus_haut - retention]:
+                    del parties[ancien_numero]
+        yield numero, delta
+
+def rejouer(fichier, chat_id, format_source="export"):
+    """Recount a channel; returns (counters, dedup window, game ledger, summary)"""
+    fenetre = ChannelWindow()
+    parties = {}
+    compteurs = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
+    resume = {"messages": 0, "parties": 0}
+    if format_source == "export":
+        textes = textes_export(lire_export(fichier), chat_id, resume)
+    else:
+        textes = textes_jsonl(lire_jsonl(fichier), chat_id, resume)
+
+    comptees = 0
+    for numero, delta in deltas(textes, fenetre, parties):
+        if numero is not None:
+            comptees += 1
+        for symbole, count in delta.items():
+            compteurs[symbole] += count
+    resume["parties"] = comptees
+    return compteurs, fenetre, parties, resume
+
+def ecrire(chat_id, compteurs, fenetre, parties):
+    """Replace the counters, processed games and game ledger of the channel"""
+    stockage = get_stockage()
+    if stockage:
+        stockage.remplacer_traites(chat_id, fenetre.numbers())
+    else:
+        # Same entries as a /reset followed by the replayed games
+        journal = DedupJournal()
+        journal.record_reset(chat_id)
+        for numero in fenetre.numbers():
+            journal.append(f"{chat_id}_{numero}")
+        journal.compact()
+    remplacer_compteurs_canal(chat_id, compteurs)
+    flush_compteurs()
+    # Later edits are corrected against the replayed results
+    registre_parties.reset_canal(chat_id)
+    for numero, cartes in parties.items():
+        registre_parties.enregistrer(chat_id, numero, cartes)
+    registre_parties.ecrire_en_attente()
+
+def main():
+    parser = argparse.ArgumentParser(description="Recount a channel from an exported message log")
+    parser.add_argument("fichier", help="Telegram JSON export or JSONL message log")
+    parser.add_argument("--chat", type=int, required=True, help="Channel chat_id (e.g. -1001234567890)")
+    parser.add_argument("--format", choices=("export", "jsonl"), help="Source format (default: from the extension)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the counters without writing them")
+    args = parser.parse_args()
+    format_source = args.format or ("jsonl" if args.fichier.endswith(".jsonl") else "export")
+
+    debut = time.perf_counter()
+    try:
+        compteurs, fenetre, parties, resume = rejouer(args.fichier, args.chat, format_source)
+    except (OSError, ValueError) as e:
+        print(f"❌ Replay failed: {e}")
+        sys.exit(1)
+    duree = time.perf_counter() - debut
+
+    print(f"📼 {resume['messages']} messages replayed in {duree:.2f}s "
+          f"({resume['messages'] / duree if duree else 0:.0f} msg/s), {resume['parties']} games counted")
+    print("   " + " ".join(f"{symbole} {count}" for symbole, count in compteurs.items()))
+    if args.dry_run:
+        return
+    ecrire(args.chat, compteurs, fenetre, parties)
+    print(f"✅ Counters, processed games and game ledger of {args.chat} rebuilt")
+
+if __name__ == "__main__":
+    main()
@@ -10,16 +10,31 @@ import sys
 import signal
 import time
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from telegram import Update
 from telegram.ext import ContextTypes
-from compteur import get_compteurs, update_compteurs, reset_compteurs_canal
-from style import afficher_compteurs_canal
-import re
-import json
+from compteur import (
+    get_compteurs, get_version, update_compteurs_delta, update_compteurs_lot, reset_compteurs_canal,
+    start_flush_compteurs, stop_flush_compteurs, prechauffer, get_cache_stats
+)
+from style import afficher_compteurs_canal, afficher_statistiques
+from dedup import DedupIndex, DedupJournal
+from stockage_sqlite import get_stockage
+from etat_partage import ecrire_json
+from parseur import analyser_message, delta_a_compter
+from persistance import persistence_executor
+from dispatcher import ChannelUpdateProcessor
+from envoi import CounterMessages, REPLY_MODE, send_queue
+import tendances
+import statistiques
+import metriques
+import registre_parties
+from bail import get_bail
 
-# Track processed messages per channel
-processed_messages = set()
+# Track processed messages per channel (sliding window of game numbers)
+processed_messages = DedupIndex()
+dedup_journal = DedupJournal()
 
 # Configure logging for production
 logging.basicConfig(
@@ -31,61 +46,241 @@ logger = logging.getLogger(__name__)
 # Global variables
 style_affichage = 1
 app_instance = None
+# Single-poller lease (taken in main) and whether load_state ran
+bail = None
+etat_charge = False
+# SQLite or Redis backend (BOT_STORAGE), None when JSON files are used
+stockage = get_stockage()
+# BOT_BATCH_MODE=1: the games of a polling round are committed together,
+# with one write and one reply per channel (catching up after a downtime)
+BATCH_MODE = os.getenv("BOT_BATCH_MODE", "0") == "1"
+# chat_id -> {"bot", "msg", "parties"}: games parsed in the current round
+lots = {}
+# Live counter message per channel (COUNTER_REPLY_MODE=edit)
+counter_messages = CounterMessages(lambda chat_id: afficher_compteurs_canal(
+    get_compteurs(chat_id), style_affichage, (chat_id, get_version(chat_id)),
+    lambda: statistiques.get_stats(chat_id)))
+
+metriques.registre.jauge("bot_writer_queue_depth", "Persistence writes queued",
+                         lambda: persistence_executor.metrics()["depth"])
+metriques.registre.jauge("bot_send_queue_depth", "Messages waiting in the send queue",
+                         lambda: send_queue.queued)
+metriques.registre.jauge("bot_dedup_channels", "Channels in the dedup index",
+                         lambda: len(processed_messages.channels))
+
+def write_bot_status(status):
+    """Write status to file (runs in the persistence writer thread)"""
+    try:
+        if stockage:
+            stockage.sauver_statut(status)
+            return
+        ecrire_json("bot_status.json", status)
+    except Exception as e:
+        logger.error(f"Could not save status: {e}")
 
 def save_bot_status(running, message=None, error=None):
-    """Save status to file"""
+    """Queue a status save; only the latest queued status is written"""
     status = {
         "running": running,
         "last_message": message,
         "error": error
     }
-    try:
-        with open("bot_status.json", "w") as f:
-            json.dump(status, f)
-    except Exception as e:
-        logger.error(f"Could not save status: {e}")
+    persistence_executor.submit("bot_status", write_bot_status, status)
 
-def is_message_processed(message_key):
+def is_message_processed(chat_id, numero):
     """Check if message was already processed"""
-    return message_key in processed_messages
+    return processed_messages.contains(chat_id, numero)
 
-def mark_message_processed(message_key):
+def mark_message_processed(chat_id, numero):
     """Mark message as processed"""
-    processed_messages.add(message_key)
+    if not processed_messages.contains(chat_id, numero):
+        processed_messages.add(chat_id, numero)
+        # With SQLite the key is committed together with the counters
+        if not stockage:
+            dedup_journal.append(f"{chat_id}_{numero}")
+
+async def commit_message(chat_id, numero, cards_found, horodatage=None, retraite=False):
+    """Persist the counter delta of one message (and its dedup key with a
+    storage backend). False when another worker already counted the game.
+
+    The storage transaction (SQLite, Redis) runs in a worker thread, so the
+    event loop never waits on the database; updates of a chat stay ordered
+    since the dispatcher awaits each one before the next.
+    """
+    if stockage:
+        return await asyncio.to_thread(update_compteurs_delta, chat_id, cards_found, numero, horodatage, retraite)
+    return update_compteurs_delta(chat_id, cards_found, numero, horodatage, retraite)
+
+def ajouter_au_lot(bot, msg, numero, cards_found, retraite):
+    """Keep a parsed game for the commit of the polling round"""
+    lot = lots.get(msg.chat_id)
+    if lot is None:
+        lot = lots[msg.chat_id] = {"bot": bot, "msg": None, "parties": []}
+    if cards_found:
+        # The channel gets one reply, to its last game with cards
+        lot["msg"] = msg
+    lot["parties"].append((numero, cards_found, msg.date.timestamp() if msg.date else None, retraite))
+
+def commettre_lots():
+    """Commit the games of the polling round: one counter write, one reply
+    per channel, one dedup journal flush and one status for the round.
+
+    Runs on the event loop (end-of-round callback): with a storage backend
+    this is one blocking transaction per channel per round, the price of
+    keeping rounds committed in order.
+    """
+    if not lots:
+        return
+    a_commettre = list(lots.items())
+    lots.clear()
+    dernier = None
+    # save_state() commits the last round after run_polling returned: the
+    # counters are still written, but there is no event loop left to reply
+    try:
+        asyncio.get_running_loop()
+        en_boucle = True
+    except RuntimeError:
+        en_boucle = False
+    for chat_id, lot in a_commettre:
+        try:
+            comptees = update_compteurs_lot(chat_id, lot["parties"])
+        except Exception as e:
+            logger.error(f"Error committing batch of channel {chat_id}: {e}")
+            continue
+        metriques.ignores_doublon.inc(len(lot["parties"]) - len(comptees))
+        cartes = {}
+        for _, delta, _, _ in comptees:
+            for symbole, count in delta.items():
+                cartes[symbole] = cartes.get(symbole, 0) + count
+        for symbole, count in cartes.items():
+            if count > 0:
+                metriques.cartes_par_symbole[symbole].inc(count)
+        logger.info(f"Channel {chat_id} - {len(comptees)}/{len(lot['parties'])} games committed, cards counted: {cartes}")
+        if any(cartes.values()) and lot["msg"] is not None:
+            if en_boucle:
+                repondre(lot["bot"], lot["msg"])
+            dernier = f"Channel {chat_id}: {cartes}"
+    save_processed_messages()
+    if dernier:
+        save_bot_status(True, dernier)
+
+def fin_de_lot(application):
+    """End of a polling round (no update in flight)"""
+    # Updates of the round not dispatched yet: the last one commits
+    if application.update_queue.qsize():
+        return
+    commettre_lots()
+
+def repondre(bot, msg):
+    """Edit the live counter message (debounced) or send a new response"""
+    chat_id = msg.chat_id
+    if REPLY_MODE == "edit":
+        counter_messages.schedule(bot, msg)
+        logger.info(f"Counter update scheduled for channel {chat_id}")
+        return
+    
+    compteurs_updated = get_compteurs(chat_id)
+    response = afficher_compteurs_canal(compteurs_updated, style_affichage, (chat_id, get_version(chat_id)),
+                                        lambda: statistiques.get_stats(chat_id))
+    # Rate-limited, retried on flood control; failures are logged by the queue
+    send_queue.submit(chat_id, msg.reply_text, response)
+    logger.info(f"Response queued for channel {chat_id}")
     
 def load_processed_messages():
-    """Load processed messages from file"""
+    """Load processed messages from snapshot + journal (or SQLite)"""
     global processed_messages
     try:
-        with open("processed_messages.json", "r") as f:
-            processed_messages = set(json.load(f))
-    except:
-        processed_messages = set()
+        if stockage:
+            processed_messages = DedupIndex()
+            for chat_id, numero in stockage.tous_traites():
+                processed_messages.add(chat_id, numero)
+            return
+        processed_messages = dedup_journal.load()
+    except Exception as e:
+        logger.error(f"Could not load processed messages: {e}")
+        processed_messages = DedupIndex()
+    dedup_journal.start_flusher()
 
 def save_processed_messages():
-    """Save processed messages to file"""
+    """Group commit of the dedup journal, compacting it when it grew too large"""
+    if stockage:
+        return
+    try:
+        persistence_executor.submit(dedup_journal.journal_file, dedup_journal.flush)
+        if dedup_journal.needs_compaction():
+            dedup_journal.request_compaction()
+    except Exception as e:
+        logger.error(f"Could not save processed messages: {e}")
+
+def load_state():
+    """Load persisted state and start the periodic flushers"""
+    global etat_charge
+    etat_charge = True
+    load_processed_messages()
+    # Ledger table opened here, not by the first handler that needs it
+    registre_parties.get_index()
+    prechauffes = prechauffer()
+    if prechauffes:
+        logger.info(f"Counter cache warmed up with {prechauffes} channels")
+    start_flush_compteurs()
+    counter_messages.load()
+    # Live metrics in this process, snapshot file for a separate web process
+    metriques.registre.local = True
+    persistence_executor.every(metriques.METRICS_INTERVAL, "metrics", metriques.registre.ecrire)
+
+def save_state():
+    """Flush every pending write (shutdown path)"""
     try:
-        with open("processed_messages.json", "w") as f:
-            json.dump(list(processed_messages), f)
-    except:
-        pass
+        commettre_lots()
+    except Exception as e:
+        logger.error(f"Could not commit the last batch: {e}")
+    if not stockage:
+        dedup_journal.stop()
+        dedup_journal.compact()
+    stop_flush_compteurs()
+    save_bot_status(False, "Bot stopped")
+    persistence_executor.cancel("metrics")
+    persistence_executor.submit("metrics", metriques.registre.ecrire)
+    persistence_executor.stop()
+
+def arreter():
+    """Flush the state, then hand the lease over to the next instance"""
+    global etat_charge
+    if etat_charge:
+        etat_charge = False
+        save_state()
+    if bail:
+        bail.liberer()
 
 def signal_handler(sig, frame):
-    """Handle shutdown signals gracefully"""
+    """Handle shutdown signals received before polling starts (PTB installs
+    its own handlers while polling, and main() then calls arreter())"""
     logger.info("Shutting down bot gracefully...")
-    save_bot_status(False, "Bot stopped")
-    if app_instance:
-        app_instance.stop()
+    arreter()
     sys.exit(0)
 
+def type_update(update):
+    if update.message:
+        return "message"
+    if update.channel_post:
+        return "channel_post"
+    if update.edited_channel_post:
+        return "edited_channel_post"
+    if update.edited_message:
+        return "edited_message"
+    return "other"
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming messages and edited messages"""
     global style_affichage
     
+    debut = time.perf_counter()
     try:
+        metriques.updates_recus.labels(type_update(update)).inc()
         # Get message from any source (including edited messages)
         msg = update.message or update.channel_post or update.edited_channel_post or update.edited_message
         if not msg or not msg.text:
+            metriques.ignores_sans_texte.inc()
             return
         
         text = msg.text
@@ -96,84 +291,78 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"Channel {chat_id}: {'[EDITED] ' if is_edited else ''}{text[:80]}")
         
-        # Check for message number
-        match_numero = re.search(r"#n(\d+)", text)
-        if not match_numero:
-            # Find FIRST parentheses only for messages without number
-            match = re.search(r'\(([^()]*)\)', text)
-            if not match:
-                return
-            content = match.group(1)
-        else:
-            numero = int(match_numero.group(1))
-            message_key = f"{chat_id}_{numero}"
-            
-            # Check for progress indicators
-            progress_indicators = ['⏰', '▶', '🕐', '➡️']
-            confirmation_symbols = ['✅', '🔰']
-            
-            has_progress = any(indicator in text for indicator in progress_indicators)
-            has_confirmation = any(symbol in text for symbol in confirmation_symbols)
-            
-            # If message has progress indicators without confirmation, wait for final version
-            if has_progress and not has_confirmation:
+        # Game number, progress state and suit histogram in one pass
+        resultat = analyser_message(text)
+        numero = resultat.numero
+        deja_traite = numero is not None and not resultat.en_cours and is_message_processed(chat_id, numero)
+        cards_found = delta_a_compter(resultat, deja_traite, bool(is_edited))
+        
+        if cards_found is None:
+            if resultat.en_cours:
+                # If message has progress indicators without confirmation, wait for final version
+                metriques.ignores_progression.inc()
                 logger.info(f"Message #{numero} has progress indicators, waiting for final version")
-                return
-            
-            # For final messages: check if already processed unless edited
-            if is_message_processed(message_key):
-                if not is_edited:
-                    logger.info(f"Message #{numero} already processed and not edited, skipping")
-                    return
-                else:
-                    logger.info(f"Message #{numero} was edited, reprocessing...")
-            
-            # Mark as processed
-            mark_message_processed(message_key)
-            save_processed_messages()
-            
-            # Find FIRST parentheses only
-            match = re.search(r'\(([^()]*)\)', text)
-            if not match:
-                return
-            content = match.group(1)
+            elif deja_traite:
+                metriques.ignores_doublon.inc()
+                logger.info(f"Message #{numero} already processed and not edited, skipping")
+            return
         
-        logger.info(f"Channel {chat_id} - Content: '{content}'")
+        if numero is not None:
+            if deja_traite:
+                # Only the difference with the result counted before
+                cards_found = await registre_parties.corriger(chat_id, numero, cards_found)
+                if cards_found is None:
+                    metriques.ignores_edition_inconnue.inc()
+                    logger.info(f"Message #{numero} was edited but its counted result is not recorded, skipping")
+                    return
+                if not cards_found:
+                    metriques.ignores_edition_identique.inc()
+                    logger.info(f"Message #{numero} was edited, result unchanged")
+                    return
+                metriques.editions_retraitees.inc()
+                logger.info(f"Message #{numero} was edited, correcting counters by {cards_found}")
+            else:
+                registre_parties.enregistrer(chat_id, numero, cards_found)
+            # Mark as processed (written by the next journal group commit)
+            mark_message_processed(chat_id, numero)
+            if dedup_journal.needs_compaction():
+                save_processed_messages()
         
-        # Count ALL card symbols in the content (including both heart symbols)
-        cards_found = {}
-        total_cards = 0
+        # FIRST parentheses only, ALL card symbols counted (including both heart symbols)
+        content = resultat.contenu
+        if content is not None:
+            logger.info(f"Channel {chat_id} - Content: '{content}'")
         
-        # Check for hearts (both symbols)
-        heart_count = content.count("❤️") + content.count("♥️")
-        if heart_count > 0:
-            update_compteurs(chat_id, "❤️", heart_count)
-            cards_found["❤️"] = heart_count
-            total_cards += heart_count
+        if not cards_found and content is not None:
+            logger.info(f"No card symbols found in: '{content}'")
         
-        # Check other symbols
-        for symbol in ["♦️", "♣️", "♠️"]:
-            count = content.count(symbol)
-            if count > 0:
-                update_compteurs(chat_id, symbol, count)
-                cards_found[symbol] = count
-                total_cards += count
+        if BATCH_MODE:
+            # Committed with the rest of the polling round (commettre_lots)
+            ajouter_au_lot(context.bot, msg, numero, cards_found, deja_traite)
+            return
         
         if not cards_found:
-            logger.info(f"No card symbols found in: '{content}'")
+            await commit_message(chat_id, numero, {}, retraite=deja_traite)
             return
         
+        # One update per message: in memory + flusher, or one storage transaction
+        if not await commit_message(chat_id, numero, cards_found, msg.date.timestamp() if msg.date else None, deja_traite):
+            metriques.ignores_doublon.inc()
+            logger.info(f"Message #{numero} already counted by another worker, skipping")
+            return
+        for symbole, count in cards_found.items():
+            if count > 0:
+                metriques.cartes_par_symbole[symbole].inc(count)
+        
         logger.info(f"Channel {chat_id} - Cards counted: {cards_found}")
         save_bot_status(True, f"Channel {chat_id}: {cards_found}")
         
-        # Get updated counters and send response
-        compteurs_updated = get_compteurs(chat_id)
-        response = afficher_compteurs_canal(compteurs_updated, style_affichage)
-        await msg.reply_text(response)
-        logger.info(f"Response sent to channel {chat_id}")
+        repondre(context.bot, msg)
         
     except Exception as e:
         logger.error(f"Error handling message: {e}")
+    finally:
+        metriques.latence_handler.observe(time.perf_counter() - debut)
 
 async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Reset command"""
@@ -182,12 +371,20 @@ async def reset_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
             
         chat_id = update.message.chat_id
-        reset_compteurs_canal(chat_id)
+        # Games of the round before the reset are cleared with the rest
+        lots.pop(chat_id, None)
+        if stockage:
+            await asyncio.to_thread(reset_compteurs_canal, chat_id)
+        else:
+            reset_compteurs_canal(chat_id)
+        registre_parties.reset_canal(chat_id)
+        counter_messages.forget(chat_id)
         
         # Clear processed messages for this channel
-        global processed_messages
-        processed_messages = {key for key in processed_messages if not key.startswith(f"{chat_id}_")}
-        save_processed_messages()
+        processed_messages.reset_channel(chat_id)
+        if not stockage:
+            dedup_journal.record_reset(chat_id)
+            save_processed_messages()
         
         await update.message.reply_text("✅ Reset done for this channel")
         save_bot_status(True, f"Reset completed for channel {chat_id}")
@@ -220,11 +417,78 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def health_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Health check command for monitoring"""
     try:
-        await update.message.reply_text("🟢 Bot is running perfectly!")
+        writer = persistence_executor.metrics()
+        sends = send_queue.metrics()
+        cache = get_cache_stats()
+        await update.message.reply_text(
+            "🟢 Bot is running perfectly!\n"
+            f"💾 Writes queued: {writer['depth']} (max {writer['max_depth']}), "
+            f"done: {writer['written']}, coalesced: {writer['coalesced']}, errors: {writer['errors']}\n"
+            f"📤 Sends queued: {sends['depth']} (max {sends['max_depth']}), "
+            f"sent: {sends['sent']}, retries: {sends['retries']}, dropped: {sends['dropped']}\n"
+            f"🗂 Channels cached: {cache['size']}/{cache['capacity']}, "
+            f"hits: {cache['hits']}, misses: {cache['misses']}, evictions: {cache['evictions']}"
+        )
         save_bot_status(True, "Health check passed")
     except Exception as e:
         logger.error(f"Health check failed: {e}")
 
+async def tendance_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Trend command: /tendance [minute|hour|day] [number of buckets]"""
+    try:
+        msg = update.effective_message
+        if not msg:
+            return
+        args = context.args or []
+        resolution = args[0].lower() if args else "hour"
+        if resolution not in tendances.RESOLUTIONS:
+            await msg.reply_text("Usage : /tendance [minute|hour|day] [nombre]")
+            return
+        largeur, taille = tendances.RESOLUTIONS[resolution]
+        nombre = min(int(args[1]), taille) if len(args) > 1 and args[1].isdigit() else 12
+        fin = (time.time() // largeur + 1) * largeur
+        resultat = tendances.interroger(msg.chat_id, fin - nombre * largeur, fin, resolution)
+
+        format_heure = "%d/%m" if resolution == "day" else "%H:%M"
+        lignes = [f"📈 Derniers {nombre} × {resolution} :"]
+        for point in resultat["points"][-24:]:
+            if point["total"]:
+                cartes = " ".join(f"{s}{n}" for s, n in point["counters"].items() if n)
+                lignes.append(f"{time.strftime(format_heure, time.localtime(point['t']))}  {cartes}")
+        lignes.append("Total : " + " ".join(f"{s}{n}" for s, n in resultat["totals"].items()))
+        await msg.reply_text("\n".join(lignes))
+    except Exception as e:
+        logger.error(f"Error in tendance command: {e}")
+
+async def partie_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Game command: /partie <number>, result counted for a game of this channel"""
+    try:
+        msg = update.effective_message
+        if not msg:
+            return
+        args = context.args or []
+        if not args or not args[0].lstrip("#n").isdigit():
+            await msg.reply_text("Usage : /partie <numéro>")
+            return
+        numero = int(args[0].lstrip("#n"))
+        cartes = await registre_parties.resultat_partie(msg.chat_id, numero)
+        if cartes is None:
+            await msg.reply_text(f"Partie #{numero} non enregistrée")
+            return
+        await msg.reply_text(f"Partie #{numero} : " + " ".join(f"{s}{n}" for s, n in cartes.items()))
+    except Exception as e:
+        logger.error(f"Error in partie command: {e}")
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Statistics command: rolling window of the last games of this channel"""
+    try:
+        msg = update.effective_message
+        if not msg:
+            return
+        await msg.reply_text(afficher_statistiques(statistiques.get_stats(msg.chat_id)))
+    except Exception as e:
+        logger.error(f"Error in stats command: {e}")
+
 async def new_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle when bot is added to a group or channel"""
     try:
@@ -243,13 +507,14 @@ async def new_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "💡 Commandes :\n"
                     "• /reset - Réinitialiser ce canal\n"
                     "• /start - Aide\n"
+                    "• /stats - Statistiques récentes\n"
+                    "• /tendance - Cartes par heure\n"
+                    "• /partie <n> - Résultat compté d'une partie\n"
                     "• /health - État du bot"
                 )
                 
-                await context.bot.send_message(
-                    chat_id=update.message.chat_id,
-                    text=welcome_msg
-                )
+                send_queue.submit(update.message.chat_id, context.bot.send_message,
+                                  update.message.chat_id, welcome_msg)
                 
                 chat_id = update.message.chat_id
                 save_bot_status(True, f"Bot added to channel {chat_id}")
@@ -259,9 +524,35 @@ async def new_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Error handling new chat member: {e}")
 
+ALLOWED_UPDATES = ["message", "edited_message", "channel_post", "edited_channel_post"]
+
+def build_application(token):
+    """Create the Application with all handlers (used by polling and webhook modes)"""
+    # Channels are processed concurrently, each one strictly in order
+    processeur = ChannelUpdateProcessor()
+    application = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(processeur)
+        .build()
+    )
+    if BATCH_MODE:
+        processeur.fin_de_lot = lambda: fin_de_lot(application)
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", start_cmd))
+    application.add_handler(CommandHandler("reset", reset_cmd))
+    application.add_handler(CommandHandler("health", health_check))
+    application.add_handler(CommandHandler("tendance", tendance_cmd))
+    application.add_handler(CommandHandler("stats", stats_cmd))
+    application.add_handler(CommandHandler("partie", partie_cmd))
+    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat_member))
+    application.add_handler(MessageHandler(filters.ALL, handle_message))
+    return application
+
 def main():
     """Main function"""
-    global app_instance
+    global app_instance, bail
     
     # Set up signal handlers for graceful shutdown
     signal.signal(signal.SIGTERM, signal_handler)
@@ -274,44 +565,55 @@ def main():
         save_bot_status(False, error="No token")
         sys.exit(1)
     
+    # File writes go through a single background writer thread
+    persistence_executor.start()
+    
     logger.info("🤖 Starting bot optimized for Render.com...")
     logger.info(f"Python version: {sys.version}")
     
-    # Wait to allow any previous instances to shut down (Render.com optimization)  
-    time.sleep(3)
-    logger.info("✅ Ready to start bot polling")
+    # Only one instance may poll: wait until the previous one (deploy,
+    # restart) flushed its state and released the lease
+    bail = get_bail()
+    bail.acquerir()
+    logger.info("✅ Polling lease acquired")
     
     logger.info("Starting Telegram bot...")
     save_bot_status(True, "Starting...")
     
     try:
         # Create application
-        app_instance = Application.builder().token(token).build()
-        
-        # Add handlers
-        app_instance.add_handler(CommandHandler("start", start_cmd))
-        app_instance.add_handler(CommandHandler("reset", reset_cmd))
-        app_instance.add_handler(CommandHandler("health", health_check))
-        app_instance.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_chat_member))
-        app_instance.add_handler(MessageHandler(filters.ALL, handle_message))
+        app_instance = build_application(token)
+        boucle = asyncio.new_event_loop()
+        asyncio.set_event_loop(boucle)
+        # Another instance took the lease over (this one was paused past
+        # LEASE_TTL): stop polling before both get Conflict errors
+        bail.perdu = lambda: boucle.call_soon_threadsafe(app_instance.stop_running)
         
-        logger.info("Bot ready - starting polling...")
-        save_bot_status(True, "Bot online and polling")
-        
-        # Load processed messages
-        load_processed_messages()
-        
-        # Run bot with edited messages support and conflict prevention
-        app_instance.run_polling(
-            drop_pending_updates=True,  # Clear old messages to prevent conflicts
-            allowed_updates=["message", "edited_message", "channel_post", "edited_channel_post"],
-            close_loop=False  # Prevent event loop conflicts
-        )
+        # State loads while run_polling initializes the bot (getMe...);
+        # polling only starts once it is loaded
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="load_state") as chargeur:
+            chargement = chargeur.submit(load_state)
+            
+            async def attendre_chargement(application):
+                await asyncio.wrap_future(chargement)
+                logger.info("Bot ready - starting polling...")
+                save_bot_status(True, "Bot online and polling")
+            app_instance.post_init = attendre_chargement
+            
+            # Updates sent while no instance was polling are processed, not
+            # dropped: dedup skips the games the previous instance counted
+            app_instance.run_polling(
+                drop_pending_updates=False,
+                allowed_updates=ALLOWED_UPDATES,
+                close_loop=False  # Prevent event loop conflicts
+            )
         
     except Exception as e:
         logger.error(f"Critical error: {e}")
         save_bot_status(False, error=str(e))
         sys.exit(1)
+    finally:
+        arreter()
 
 if __name__ == "__main__":
     main()
@@ -4,10 +4,12 @@ Simple web interface for the card counting bot
 """
 import json
 import os
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
 from compteur import get_compteurs, reset_compteurs
 from historique import get_messages_count, reset_messages_traite
 from style import get_all_styles
+from stockage_sqlite import get_stockage
+from statut import StatusCache
 import glob
 
 app = Flask(__name__)
@@ -15,6 +17,9 @@ current_style = 1
 
 def get_bot_status():
     """Get bot status from JSON file"""
+    stockage = get_stockage()
+    if stockage:
+        return stockage.lire_statut() or {"running": False, "last_message": "Bot not started", "error": None}
     try:
         with open("bot_status.json", "r", encoding="utf-8") as f:
             return json.load(f)
@@ -28,9 +33,8 @@ def index():
     """Main dashboard"""
     return render_template('index.html')
 
-@app.route('/api/status')
-def api_status():
-    """API: Get current status"""
+def build_status(style):
+    """Status payload, rebuilt only when a state file changed"""
     status = get_bot_status()
     try:
         with open("compteurs_global.json", "r") as f:
@@ -41,18 +45,36 @@ def api_status():
     messages_count = get_messages_count()
     styles = get_all_styles()
 
-    return jsonify({
+    return {
         'bot_status': status,
         'counters': counters,
         'messages_processed': messages_count,
-        'current_style': current_style,
+        'current_style': style,
         'styles': styles
-    })
+    }
+
+status_cache = StatusCache(build_status)
+
+@app.route('/api/status')
+def api_status():
+    """API: Get current status (cached, ETag / If-None-Match)"""
+    body, etag, _ = status_cache.get(current_style)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/reset', methods=['POST'])
 def api_reset():
     """API: Reset counters and history"""
     try:
+        stockage = get_stockage()
+        if stockage:
+            for chat_id in stockage.get_all_channels():
+                stockage.reset_canal(chat_id)
         for file in glob.glob("compteurs_*.json"):
             os.remove(file)
         reset_messages_traite()
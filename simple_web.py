@@ -3,22 +3,50 @@
 Simple web interface for the card counting bot
 """
 import json
-from flask import Flask, render_template, jsonify, request
-from compteur import get_compteurs, reset_compteurs
+import math
+import threading
+import time
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
+from compteur import (
+    get_compteurs, reset_compteurs, reset_compteurs_canal, get_all_channels, lire_totaux_canaux, lire_compteurs_global)
 from historique import get_messages_count, reset_messages_traite
-from style import get_all_styles
+from style import get_all_styles, afficher_compteurs_canal
+from stockage_sqlite import get_stockage
+from etat_partage import lire_json, ecrire_json
+from statut import StatusCache
+import tendances
+import statistiques
+import registre_parties
+from dedup import DedupJournal
+from metriques import registre, METRICS_FILE
 import os
 
 app = Flask(__name__)
 current_style = 1
+# Style chosen on the dashboard, shared by every web worker
+STYLE_FILE = "web_style.json"
+cache_style = {"signature": None}
+
+# /api/stream: seconds between two change checks, keepalive period, and
+# lifetime of one stream (the browser reconnects by itself)
+STREAM_CHECK_INTERVAL = float(os.getenv("STREAM_CHECK_INTERVAL", "0.5"))
+STREAM_KEEPALIVE = 15
+STREAM_MAX_SECONDS = int(os.getenv("STREAM_MAX_SECONDS", "300"))
+# Streams open at once per worker: keep it under the gunicorn --threads
+# (8 in the Procfile) so /api/status still gets a thread. A closed tab
+# frees its slot at the next write (STREAM_KEEPALIVE seconds at most)
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "4"))
+flux_actifs = threading.BoundedSemaphore(STREAM_MAX_CLIENTS)
+CHANNELS_PAGE_SIZE = 100
+CHANNELS_MAX_PAGE_SIZE = 1000
 
 def get_bot_status():
     """Get bot status from JSON file"""
+    stockage = get_stockage()
+    if stockage:
+        return stockage.lire_statut() or {"running": False, "last_message": "Bot not started", "error": None}
     try:
-        with open("bot_status.json", "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {"running": False, "last_message": "Bot not started", "error": None}
+        return lire_json("bot_status.json") or {"running": False, "last_message": "Bot not started", "error": None}
     except json.JSONDecodeError:
         return {"running": False, "last_message": "Error reading status", "error": "JSON decode error"}
 
@@ -27,39 +55,200 @@ def index():
     """Main dashboard"""
     return render_template('index.html')
 
-@app.route('/api/status')
-def api_status():
-    """API: Get current status"""
-    status = get_bot_status()
-    # Get counters for all channels or default empty
+def get_current_style():
+    """Style chosen by any web worker (re-read when the style file changed)"""
+    global current_style
     try:
-        # Try to load from file directly
-        import json
-        with open("compteurs_global.json", "r") as f:
-            counters = json.load(f)
-    except:
-        counters = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
+        st = os.stat(STYLE_FILE)
+        signature = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return current_style
+    if signature != cache_style["signature"]:
+        try:
+            current_style = int(lire_json(STYLE_FILE, current_style))
+        except (json.JSONDecodeError, ValueError, TypeError):
+            pass
+        cache_style["signature"] = signature
+    return current_style
+
+def build_status(style):
+    """Status payload, rebuilt only when a state file changed"""
+    status = get_bot_status()
+    counters = lire_compteurs_global()
 
     messages_count = get_messages_count()
     styles = get_all_styles()
 
-    return jsonify({
+    return {
         'bot_status': status,
         'counters': counters,
         'messages_processed': messages_count,
-        'current_style': current_style,
-        'styles': styles
+        'current_style': style,
+        'styles': styles,
+        'preview': afficher_compteurs_canal(counters, style, ("global", tuple(counters.items())))
+    }
+
+status_cache = StatusCache(build_status)
+
+@app.route('/api/status')
+def api_status():
+    """API: Get current status (cached, ETag / If-None-Match)"""
+    body, etag, _ = status_cache.get(get_current_style())
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Event"""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+def statut_courant():
+    """(body, etag, version) of the status for the current style"""
+    return status_cache.get(get_current_style())
+
+class FluxStatut:
+    """One /api/stream client: full status first, then the changed fields,
+    and a keepalive comment when nothing changed for STREAM_KEEPALIVE s"""
+
+    def __init__(self):
+        self.debut = time.monotonic()
+        self.dernier_envoi = self.debut
+        self.version = None
+        self.precedent = None
+
+    def actif(self):
+        return time.monotonic() - self.debut < STREAM_MAX_SECONDS
+
+    def suivant(self, body, version):
+        """Chunk to send for the current status, None when nothing to send"""
+        if version != self.version:
+            statut = json.loads(body)
+            if self.precedent is None:
+                evenement = sse_event("status", statut, version)
+            else:
+                delta = {cle: valeur for cle, valeur in statut.items() if self.precedent.get(cle) != valeur}
+                evenement = sse_event("delta", delta, version) if delta else None
+            self.version = version
+            self.precedent = statut
+            self.dernier_envoi = time.monotonic()
+            return evenement
+        if time.monotonic() - self.dernier_envoi >= STREAM_KEEPALIVE:
+            self.dernier_envoi = time.monotonic()
+            return ": keepalive\n\n"
+        return None
+
+@app.route('/api/stream')
+def api_stream():
+    """API: Server-Sent Events stream of status changes (full status, then deltas).
+
+    Each stream holds a server thread while open, so at most
+    STREAM_MAX_CLIENTS are served at once; the next ones get a 503 and the
+    dashboard polls /api/status instead. webhook_asgi serves this route
+    without a thread per client.
+    """
+    if not flux_actifs.acquire(blocking=False):
+        return Response("Too many open streams, poll /api/status", status=503, mimetype='text/plain')
+
+    def events():
+        flux = FluxStatut()
+        yield "retry: 1000\n\n"
+        while flux.actif():
+            body, _, version = statut_courant()
+            evenement = flux.suivant(body, version)
+            if evenement:
+                yield evenement
+            time.sleep(STREAM_CHECK_INTERVAL)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(flux_actifs.release)
+    return response
+
+@app.route('/api/channels')
+def api_channels():
+    """API: Totals of every channel, paginated (?offset=&limit=&sort=total|chat_id)"""
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', CHANNELS_PAGE_SIZE))), CHANNELS_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset and limit must be integers'}), 400
+
+    totaux = lire_totaux_canaux()
+    if request.args.get('sort', 'total') == 'chat_id':
+        ordre = sorted(totaux)
+    else:
+        ordre = sorted(totaux, key=lambda chat_id: sum(totaux[chat_id].values()), reverse=True)
+
+    global_counters = {}
+    for compteurs in totaux.values():
+        for symbole, count in compteurs.items():
+            global_counters[symbole] = global_counters.get(symbole, 0) + count
+
+    return jsonify({
+        'total_channels': len(totaux),
+        'offset': offset,
+        'limit': limit,
+        'global': global_counters,
+        'channels': [
+            {'chat_id': chat_id, 'counters': totaux[chat_id], 'total': sum(totaux[chat_id].values())}
+            for chat_id in ordre[offset:offset + limit]
+        ],
     })
 
+@app.route('/api/history')
+def api_history():
+    """API: Suit counts of a channel per bucket (?channel=&from=&to=&bucket=minute|hour|day)"""
+    try:
+        chat_id = int(request.args['channel'])
+        debut = request.args.get('from', type=float)
+        fin = request.args.get('to', type=float)
+        bucket = request.args.get('bucket', 'hour')
+        for nom, valeur in (('from', debut), ('to', fin)):
+            if valeur is not None and not math.isfinite(valeur):
+                raise ValueError(f"'{nom}' must be a finite timestamp")
+        return jsonify(tendances.interroger(chat_id, debut, fin, bucket,
+                                            series=tendances.charger_series(chat_id)))
+    except (KeyError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Invalid query: {e}'}), 400
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics of the bot: live when it runs in this process, else its last snapshot"""
+    if registre.local:
+        body = registre.exposer()
+    else:
+        try:
+            with open(METRICS_FILE, "r", encoding="utf-8") as f:
+                body = f.read()
+        except FileNotFoundError:
+            body = "# Bot metrics not available yet\n"
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/reset', methods=['POST'])
 def api_reset():
-    """API: Reset counters and history"""
+    """API: Reset counters and history of every channel, through the same
+    functions as the bot's /reset (rollup, time series, statistics, game
+    ledger and processed games stay consistent with the counters)"""
     try:
-        # Reset all channel counters
-        import os
-        import glob
-        for file in glob.glob("compteurs_*.json"):
-            os.remove(file)
+        stockage = get_stockage()
+        # With a backend, stockage.reset_canal clears the processed games
+        journal = None if stockage else DedupJournal()
+        for chat_id in get_all_channels():
+            reset_compteurs_canal(chat_id)
+            registre_parties.reset_canal(chat_id)
+            if journal:
+                journal.record_reset(chat_id)
+        if journal:
+            journal.compact()
+        statistiques.sauvegarder_statistiques()
         reset_messages_traite()
         return jsonify({'success': True, 'message': 'Reset completed'})
     except Exception as e:
@@ -72,11 +261,12 @@ def api_style():
     try:
         data = request.get_json()
         new_style = int(data.get('style', 1))
-        if 1 <= new_style <= 5:
+        if new_style in get_all_styles():
             current_style = new_style
+            ecrire_json(STYLE_FILE, new_style)
             return jsonify({'success': True, 'message': f'Style {new_style} selected'})
         else:
-            return jsonify({'success': False, 'error': 'Style must be 1-5'}), 400
+            return jsonify({'success': False, 'error': f'Style must be one of {list(get_all_styles())}'}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
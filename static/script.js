@@ -1,6 +1,8 @@
 // JavaScript for Telegram Card Counter Bot Dashboard
 
 let updateInterval;
+let eventSource = null;
+let currentStatus = null;
 let activityLog = [];
 
 // Initialize dashboard
@@ -15,8 +17,53 @@ function initializeDashboard() {
 }
 
 function startAutoUpdate() {
+    // Server push when supported, polling otherwise
+    if (window.EventSource) {
+        startStream();
+    } else {
+        startPolling();
+    }
+}
+
+function startPolling() {
     // Update every 3 seconds
-    updateInterval = setInterval(updateStatus, 3000);
+    if (!updateInterval) {
+        updateInterval = setInterval(updateStatus, 3000);
+    }
+}
+
+function stopPolling() {
+    if (updateInterval) {
+        clearInterval(updateInterval);
+        updateInterval = null;
+    }
+}
+
+function startStream() {
+    eventSource = new EventSource('/api/stream');
+    
+    // Full status on (re)connection, then only the changed fields
+    eventSource.addEventListener('status', function(event) {
+        stopPolling();
+        currentStatus = JSON.parse(event.data);
+        renderStatus(currentStatus);
+    });
+    
+    eventSource.addEventListener('delta', function(event) {
+        if (!currentStatus) {
+            return;
+        }
+        Object.assign(currentStatus, JSON.parse(event.data));
+        renderStatus(currentStatus);
+    });
+    
+    eventSource.onerror = function() {
+        // Poll while the browser reconnects; give up on the stream if closed
+        startPolling();
+        if (eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+        }
+    };
 }
 
 function setupEventListeners() {
@@ -35,11 +82,8 @@ async function updateStatus() {
         const response = await fetch('/api/status');
         const data = await response.json();
         
-        updateBotStatus(data.bot_status);
-        updateCounters(data.counters);
-        updateMessagesCount(data.messages_processed);
-        updateStyleSelector(data.current_style);
-        updateStylePreview(data.styles[data.current_style]);
+        currentStatus = data;
+        renderStatus(data);
         
     } catch (error) {
         console.error('Error updating status:', error);
@@ -47,6 +91,14 @@ async function updateStatus() {
     }
 }
 
+function renderStatus(data) {
+    updateBotStatus(data.bot_status);
+    updateCounters(data.counters);
+    updateMessagesCount(data.messages_processed);
+    updateStyleSelector(data.current_style);
+    updateStylePreview(data.preview || data.styles[data.current_style]);
+}
+
 function updateBotStatus(status) {
     const statusBadge = document.getElementById('status-badge');
     const lastActivity = document.getElementById('last-activity');
@@ -237,7 +289,8 @@ function showNotification(message, type) {
 
 // Cleanup on page unload
 window.addEventListener('beforeunload', function() {
-    if (updateInterval) {
-        clearInterval(updateInterval);
+    stopPolling();
+    if (eventSource) {
+        eventSource.close();
     }
 });
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Rolling suit statistics per channel, updated in O(1) per game. Saved per
+channel, only when changed: statistiques_<chat_id>.json files, or the
+storage backend (BOT_STORAGE=sqlite/redis).
+"""
+import json
+import os
+import threading
+import logging
+from collections import deque
+from persistance import persistence_executor
+from etat_partage import ecrire_json
+from stockage_sqlite import get_stockage
+
+logger = logging.getLogger(__name__)
+
+SYMBOLES = ["❤️", "♦️", "♣️", "♠️"]
+INDEX_SYMBOLE = {symbole: i for i, symbole in enumerate(SYMBOLES)}
+WINDOW = int(os.getenv("STATS_WINDOW", "100"))
+FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "30"))
+# Former single file of every channel, split at first use
+STATS_FILE = "statistiques.json"
+# Chi-square critical value for 3 degrees of freedom at 5%
+CHI2_SEUIL = 7.815
+
+class StatsCanal:
+    """Statistics over the last `taille` games of a channel.
+
+    Each game updates the window sums (the game leaving the window is
+    subtracted), the current and best streak of games containing each suit
+    and the gap since its last appearance: a constant amount of work.
+    """
+    __slots__ = ("fenetre", "fenetre_totaux", "parties", "serie", "meilleure_serie", "ecart", "ecart_max")
+
+    def __init__(self, taille=WINDOW):
+        self.fenetre = deque(maxlen=taille)
+        self.fenetre_totaux = [0, 0, 0, 0]
+        self.parties = 0
+        self.serie = [0, 0, 0, 0]
+        self.meilleure_serie = [0, 0, 0, 0]
+        self.ecart = [0, 0, 0, 0]
+        self.ecart_max = [0, 0, 0, 0]
+
+    def ajouter(self, valeurs):
+        """Add one game: list of 4 per-suit counts"""
+        if len(self.fenetre) == self.fenetre.maxlen:
+            ancien = self.fenetre[0]
+            for i in range(4):
+                self.fenetre_totaux[i] -= ancien[i]
+        self.fenetre.append(tuple(valeurs))
+        self.parties += 1
+        for i in range(4):
+            if valeurs[i]:
+                self.fenetre_totaux[i] += valeurs[i]
+                self.serie[i] += 1
+                self.ecart[i] = 0
+                if self.serie[i] > self.meilleure_serie[i]:
+                    self.meilleure_serie[i] = self.serie[i]
+            else:
+                self.serie[i] = 0
+                self.ecart[i] += 1
+                if self.ecart[i] > self.ecart_max[i]:
+                    self.ecart_max[i] = self.ecart[i]
+
+    def chi2(self):
+        """Chi-square of the window counts against a uniform suit distribution"""
+        total = sum(self.fenetre_totaux)
+        if not total:
+            return 0.0
+        attendu = total / 4
+        return sum((observe - attendu) ** 2 for observe in self.fenetre_totaux) / attendu
+
+    def resume(self):
+        """Statistics as a dict keyed by suit"""
+        total = sum(self.fenetre_totaux)
+        chi2 = self.chi2()
+        return {
+            "parties": len(self.fenetre),
+            "total": total,
+            "frequences": {s: (self.fenetre_totaux[i] / total if total else 0.0) for i, s in enumerate(SYMBOLES)},
+            "fenetre": dict(zip(SYMBOLES, self.fenetre_totaux)),
+            "serie": dict(zip(SYMBOLES, self.serie)),
+            "meilleure_serie": dict(zip(SYMBOLES, self.meilleure_serie)),
+            "ecart": dict(zip(SYMBOLES, self.ecart)),
+            "ecart_max": dict(zip(SYMBOLES, self.ecart_max)),
+            "chi2": round(chi2, 3),
+            "biais": chi2 > CHI2_SEUIL,
+        }
+
+    def vers_dict(self):
+        return {"fenetre": [list(v) for v in self.fenetre], "parties": self.parties, "serie": self.serie,
+                "meilleure_serie": self.meilleure_serie, "ecart": self.ecart, "ecart_max": self.ecart_max}
+
+    @classmethod
+    def depuis_dict(cls, d, taille=WINDOW):
+        stats = cls(taille)
+        for valeurs in d.get("fenetre", []):
+            stats.fenetre.append(tuple(valeurs))
+        for valeurs in stats.fenetre:
+            for i in range(4):
+                stats.fenetre_totaux[i] += valeurs[i]
+        stats.parties = d.get("parties", len(stats.fenetre))
+        for attribut in ("serie", "meilleure_serie", "ecart", "ecart_max"):
+            setattr(stats, attribut, list(d.get(attribut, [0, 0, 0, 0])))
+        return stats
+
+# chat_id -> StatsCanal, loaded per channel on first use
+stats_par_canal = {}
+canaux_modifies = set()
+# Channels evicted from the counter cache: dropped once written
+a_liberer = set()
+verrou = threading.Lock()
+ancien_fichier_migre = False
+
+def get_stats_fichier(chat_id):
+    return f"statistiques_{chat_id}.json"
+
+def migrer_ancien_fichier():
+    """Split the former statistiques.json (every channel in one file) into
+    per-channel entries, written by the next flush"""
+    global ancien_fichier_migre
+    ancien_fichier_migre = True
+    if not os.path.exists(STATS_FILE):
+        return
+    try:
+        with open(STATS_FILE, "r", encoding="utf-8") as f:
+            anciens = json.load(f)
+        for chat_id, d in anciens.items():
+            stats_par_canal[int(chat_id)] = StatsCanal.depuis_dict(d)
+            canaux_modifies.add(int(chat_id))
+        os.replace(STATS_FILE, f"{STATS_FILE}.migrated")
+        logger.info(f"Statistics of {len(anciens)} channels imported from {STATS_FILE}")
+    except (OSError, json.JSONDecodeError, ValueError, AttributeError) as e:
+        logger.error(f"Could not import {STATS_FILE}: {e}")
+
+def charger_canal(chat_id):
+    """Statistics of a channel from storage (empty when missing)"""
+    stockage = get_stockage()
+    try:
+        if stockage:
+            d = stockage.lire_statistiques(chat_id)
+        else:
+            with open(get_stats_fichier(chat_id), "r", encoding="utf-8") as f:
+                d = json.load(f)
+    except FileNotFoundError:
+        d = None
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error(f"Could not load statistics of {chat_id}: {e}")
+        d = None
+    try:
+        return StatsCanal.depuis_dict(d) if d else StatsCanal()
+    except (ValueError, AttributeError, TypeError) as e:
+        logger.error(f"Invalid statistics of {chat_id}: {e}")
+        return StatsCanal()
+
+def get_canal(chat_id):
+    """StatsCanal of a channel, loaded on first use (call with verrou held)"""
+    if not ancien_fichier_migre:
+        migrer_ancien_fichier()
+    a_liberer.discard(chat_id)
+    stats = stats_par_canal.get(chat_id)
+    if stats is None:
+        stats = stats_par_canal[chat_id] = charger_canal(chat_id)
+    return stats
+
+def enregistrer_partie(chat_id, delta):
+    """Add the {symbol: count} of one game to the channel statistics"""
+    valeurs = [0, 0, 0, 0]
+    for symbole, count in delta.items():
+        i = INDEX_SYMBOLE.get(symbole)
+        if i is not None:
+            valeurs[i] += count
+    with verrou:
+        get_canal(chat_id).ajouter(valeurs)
+        canaux_modifies.add(chat_id)
+
+def get_stats(chat_id):
+    """Statistics summary of a channel (see StatsCanal.resume)"""
+    with verrou:
+        return get_canal(chat_id).resume()
+
+def reset_canal(chat_id):
+    with verrou:
+        stats_par_canal[chat_id] = StatsCanal()
+        canaux_modifies.add(chat_id)
+
+def liberer(chat_id):
+    """Drop the statistics of a channel from memory (reloaded on next use),
+    after the next flush when they changed"""
+    with verrou:
+        if chat_id in canaux_modifies:
+            a_liberer.add(chat_id)
+        else:
+            stats_par_canal.pop(chat_id, None)
+
+def liberer_ecrits():
+    with verrou:
+        for chat_id in a_liberer - canaux_modifies:
+            stats_par_canal.pop(chat_id, None)
+        a_liberer.intersection_update(canaux_modifies)
+
+def sauvegarder_statistiques():
+    """Write the statistics of the channels that changed"""
+    with verrou:
+        a_ecrire = {chat_id: stats_par_canal[chat_id].vers_dict() for chat_id in canaux_modifies}
+        canaux_modifies.clear()
+    if not a_ecrire:
+        return
+
+    stockage = get_stockage()
+    if stockage:
+        try:
+            stockage.sauver_statistiques(a_ecrire)
+        except Exception as e:
+            logger.error(f"Could not save statistics: {e}")
+            with verrou:
+                canaux_modifies.update(a_ecrire)
+        liberer_ecrits()
+        return
+
+    for chat_id, d in a_ecrire.items():
+        try:
+            ecrire_json(get_stats_fichier(chat_id), d)
+        except OSError as e:
+            logger.error(f"Could not save statistics of {chat_id}: {e}")
+            with verrou:
+                canaux_modifies.add(chat_id)
+    liberer_ecrits()
+
+def start_flush_statistiques(intervalle=FLUSH_INTERVAL):
+    persistence_executor.every(intervalle, "statistiques", sauvegarder_statistiques)
+
+def stop_flush_statistiques():
+    persistence_executor.cancel("statistiques")
+    sauvegarder_statistiques()
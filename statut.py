@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Cached dashboard status: rebuilt only when a state file changed, served with an ETag
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from stockage_sqlite import DB_PATH, backend_stockage
+from historique import HISTORY_DB_PATH
+
+# Files the status is built from (JSON mode and SQLite mode)
+STATUS_SOURCES = (
+    "bot_status.json",
+    "compteurs_global.json",
+    "messages_traite.json",
+    HISTORY_DB_PATH,
+    f"{HISTORY_DB_PATH}-wal",
+    DB_PATH,
+    f"{DB_PATH}-wal",
+)
+# Redis changes leave no file to stat: the status is then rebuilt at most every second
+TTL_REDIS = 1.0
+
+def signature_fichiers(fichiers):
+    """(mtime, size) of each file, None when missing"""
+    signature = []
+    for fichier in fichiers:
+        try:
+            st = os.stat(fichier)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+class StatusCache:
+    """Serialized status snapshot, invalidated by file mtime.
+
+    builder(*key) returns the status dict; key holds in-process values the
+    status depends on (e.g. the current style). The JSON body and its ETag
+    are computed once per change, so unchanged polls cost a few stat() calls.
+    With ttl the status is also rebuilt every ttl seconds.
+    """
+
+    def __init__(self, builder, sources=STATUS_SOURCES, ttl=None):
+        self.builder = builder
+        self.sources = sources
+        self.ttl = ttl if ttl is not None else (TTL_REDIS if backend_stockage() == "redis" else None)
+        self.lock = threading.Lock()
+        self.signature = None
+        self.body = b""
+        self.etag = ""
+        self.version = 0
+
+    def invalidate(self):
+        """Force a rebuild on the next request (change notification)"""
+        with self.lock:
+            self.signature = None
+
+    def get(self, *key):
+        """(body, etag, version) of the current status"""
+        signature = (signature_fichiers(self.sources), key)
+        if self.ttl:
+            signature += (int(time.monotonic() // self.ttl),)
+        with self.lock:
+            if signature != self.signature:
+                body = json.dumps(self.builder(*key), ensure_ascii=False).encode("utf-8")
+                if body != self.body:
+                    self.body = body
+                    self.etag = hashlib.sha1(body).hexdigest()[:20]
+                    self.version += 1
+                self.signature = signature
+            return self.body, self.etag, self.version
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Optional Redis (or compatible server: Valkey, KeyDB, Dragonfly) storage for
+counters, dedup history and bot status, with the interface of StockageSQLite.
+Enabled with BOT_STORAGE=redis (server: REDIS_URL, keys prefixed by REDIS_PREFIX).
+
+Needs the redis package, which is not a dependency of the bot:
+pip install redis
+"""
+import json
+import os
+import logging
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+PREFIX = os.getenv("REDIS_PREFIX", "baccarat:")
+# Processed games kept per channel, below the highest one (dedup window)
+DEDUP_RETENTION = int(os.getenv("DEDUP_RETENTION", "2048"))
+SYMBOLES = ["❤️", "♦️", "♣️", "♠️"]
+
+# Dedup claim and counter delta in one atomic step, so several bot workers
+# never count the same game twice. Processed games are a sorted set scored
+# by game number: each claim drops every game `retention` numbers or more
+# before it, so gaps and skipped numbers never leave entries behind.
+# KEYS: processed sorted set, counters hash, channels set
+# ARGV: game number ('' for none), '1' to count a game already claimed, chat_id, retention, symbol, count, ...
+SCRIPT_PARTIE = """
+if ARGV[1] ~= '' then
+    if redis.call('ZADD', KEYS[1], 'NX', ARGV[1], ARGV[1]) == 0 and ARGV[2] ~= '1' then
+        return false
+    end
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[4]))
+end
+for i = 5, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('SADD', KEYS[3], ARGV[3])
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# Former layout (set of processed games, hash of the ledger) to sorted sets,
+# once per key whatever the number of workers starting together.
+# KEYS: processed games, ledger
+SCRIPT_CONVERTIR = """
+if redis.call('TYPE', KEYS[1])['ok'] == 'set' then
+    local numeros = redis.call('SMEMBERS', KEYS[1])
+    redis.call('DEL', KEYS[1])
+    for _, numero in ipairs(numeros) do
+        redis.call('ZADD', KEYS[1], numero, numero)
+    end
+end
+if redis.call('TYPE', KEYS[2])['ok'] == 'hash' then
+    local parties = redis.call('HGETALL', KEYS[2])
+    redis.call('DEL', KEYS[2])
+    for i = 1, #parties, 2 do
+        redis.call('ZADD', KEYS[2], parties[i], parties[i] .. ':' .. parties[i + 1])
+    end
+end
+return 0
+"""
+
+def compteurs_depuis_hash(valeurs):
+    compteurs = {symbole: 0 for symbole in SYMBOLES}
+    for symbole, total in valeurs.items():
+        compteurs[symbole] = int(total)
+    return compteurs
+
+class StockageRedis:
+    """Store shared by any number of bot and web processes"""
+
+    def __init__(self, url=REDIS_URL, prefix=PREFIX):
+        if redis is None:
+            raise RuntimeError("BOT_STORAGE=redis needs the redis package (pip install redis)")
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.script_partie = self.client.register_script(SCRIPT_PARTIE)
+        self.convertir_anciennes_cles()
+
+    def convertir_anciennes_cles(self):
+        """Move processed games and ledger of the former layout to sorted sets"""
+        convertir = self.client.register_script(SCRIPT_CONVERTIR)
+        for chat_id in self.get_all_channels():
+            convertir(keys=[self.cle("traites", chat_id), self.cle("parties", chat_id)])
+
+    def cle(self, *parties):
+        return self.prefix + ":".join(str(partie) for partie in parties)
+
+    # ----- Counters + dedup -----
+
+    def enregistrer_partie(self, chat_id, numero, delta, retraite=False):
+        """Claim the game and add the delta atomically.
+
+        Returns the counters of the channel, or None when the game was already
+        claimed (by this or another worker) and retraite is False.
+        """
+        args = ["" if numero is None else numero, "1" if retraite else "0", chat_id, DEDUP_RETENTION]
+        for symbole, count in delta.items():
+            args.extend((symbole, count))
+        resultat = self.script_partie(
+            keys=[self.cle("traites", chat_id), self.cle("compteurs", chat_id), self.cle("canaux")], args=args)
+        if resultat is None:
+            return None
+        return compteurs_depuis_hash(dict(zip(resultat[::2], resultat[1::2])))
+
+    def enregistrer_parties(self, chat_id, parties):
+        """Several games of a channel [(numero, delta, retraite)] in one round trip.
+
+        Returns (counters of the channel, indexes of the games counted).
+        """
+        cles = [self.cle("traites", chat_id), self.cle("compteurs", chat_id), self.cle("canaux")]
+        with self.client.pipeline(transaction=False) as pipe:
+            for numero, delta, retraite in parties:
+                args = ["" if numero is None else numero, "1" if retraite else "0", chat_id, DEDUP_RETENTION]
+                for symbole, count in delta.items():
+                    args.extend((symbole, count))
+                self.script_partie(keys=cles, args=args, client=pipe)
+            resultats = pipe.execute()
+        comptees = [i for i, resultat in enumerate(resultats) if resultat is not None]
+        if not comptees:
+            return self.get_compteurs(chat_id), comptees
+        # The last counted game saw the deltas of all the others
+        dernier = resultats[comptees[-1]]
+        return compteurs_depuis_hash(dict(zip(dernier[::2], dernier[1::2]))), comptees
+
+    def get_compteurs(self, chat_id):
+        """Counters of a channel, zero for missing symbols"""
+        return compteurs_depuis_hash(self.client.hgetall(self.cle("compteurs", chat_id)))
+
+    def sauver_compteurs(self, chat_id, compteurs):
+        """Overwrite the counters of a channel"""
+        with self.client.pipeline() as pipe:
+            pipe.delete(self.cle("compteurs", chat_id))
+            pipe.hset(self.cle("compteurs", chat_id), mapping=compteurs)
+            pipe.sadd(self.cle("canaux"), chat_id)
+            pipe.execute()
+
+    def reset_canal(self, chat_id):
+        """Clear counters, processed games and history of a channel"""
+        self.client.delete(self.cle("compteurs", chat_id), self.cle("traites", chat_id),
+                           self.cle("tendances", chat_id), self.cle("parties", chat_id),
+                           self.cle("statistiques", chat_id))
+
+    def get_all_channels(self):
+        """Channels that have counters"""
+        return [int(chat_id) for chat_id in self.client.smembers(self.cle("canaux"))]
+
+    def totaux_canaux(self):
+        """Counters of every channel: {chat_id: {symbol: total}}"""
+        canaux = self.get_all_channels()
+        with self.client.pipeline(transaction=False) as pipe:
+            for chat_id in canaux:
+                pipe.hgetall(self.cle("compteurs", chat_id))
+            valeurs = pipe.execute()
+        return {chat_id: compteurs_depuis_hash(v) for chat_id, v in zip(canaux, valeurs) if v}
+
+    def remplacer_traites(self, chat_id, numeros):
+        """Replace the processed games of a channel"""
+        numeros = list(numeros)
+        with self.client.pipeline() as pipe:
+            pipe.delete(self.cle("traites", chat_id))
+            if numeros:
+                pipe.zadd(self.cle("traites", chat_id), {numero: numero for numero in numeros})
+            pipe.sadd(self.cle("canaux"), chat_id)
+            pipe.execute()
+
+    def est_traite(self, chat_id, numero):
+        """Check if a game of a channel was processed"""
+        return self.client.zscore(self.cle("traites", chat_id), numero) is not None
+
+    def tous_traites(self, retention=DEDUP_RETENTION):
+        """Processed (chat_id, numero) pairs of the dedup window of every
+        channel, ordered per channel"""
+        paires = []
+        for chat_id in sorted(self.get_all_channels()):
+            numeros = [int(n) for n in self.client.zrange(self.cle("traites", chat_id), 0, -1)]
+            if numeros:
+                paires.extend((chat_id, numero) for numero in numeros if numero > numeros[-1] - retention)
+        return paires
+
+    # ----- tendances.py -----
+
+    def sauver_tendances(self, series_par_canal):
+        """Write {chat_id: {resolution: serie dict}} in one round trip"""
+        with self.client.pipeline() as pipe:
+            for chat_id, series in series_par_canal.items():
+                pipe.hset(self.cle("tendances", chat_id),
+                          mapping={resolution: json.dumps(serie) for resolution, serie in series.items()})
+            pipe.execute()
+
+    def lire_tendances(self, chat_id):
+        """{resolution: serie dict} of a channel, None if never written"""
+        valeurs = self.client.hgetall(self.cle("tendances", chat_id))
+        return {resolution: json.loads(serie) for resolution, serie in valeurs.items()} or None
+
+    # ----- statistiques.py -----
+
+    def sauver_statistiques(self, stats_par_canal):
+        """Write {chat_id: statistics dict} in one round trip"""
+        with self.client.pipeline() as pipe:
+            for chat_id, d in stats_par_canal.items():
+                pipe.set(self.cle("statistiques", chat_id), json.dumps(d))
+            pipe.execute()
+
+    def lire_statistiques(self, chat_id):
+        """Statistics dict of a channel, None if never written"""
+        valeur = self.client.get(self.cle("statistiques", chat_id))
+        return json.loads(valeur) if valeur else None
+
+    # ----- historique.py -----
+
+    def ajouter_historique(self, numero):
+        """False when the entry was already there"""
+        return self.client.sadd(self.cle("historique"), str(numero)) == 1
+
+    def cles_historique(self):
+        return list(self.client.sscan_iter(self.cle("historique"), count=1000))
+
+    def est_historique(self, numero):
+        return bool(self.client.sismember(self.cle("historique"), str(numero)))
+
+    def compter_historique(self):
+        return self.client.scard(self.cle("historique"))
+
+    def reset_historique(self):
+        self.client.delete(self.cle("historique"))
+
+    # ----- registre_parties.py -----
+
+    def ecrire_parties(self, lignes, retention):
+        """Write [(chat_id, numero, resultat)], keeping the games of each
+        channel above its highest number minus `retention`.
+
+        The ledger of a channel is a sorted set scored by game number, with
+        "numero:resultat" members, so the purge is one range removal.
+        """
+        plus_hauts = {}
+        with self.client.pipeline(transaction=False) as pipe:
+            for chat_id, numero, resultat in lignes:
+                cle = self.cle("parties", chat_id)
+                pipe.zremrangebyscore(cle, numero, numero)
+                pipe.zadd(cle, {f"{numero}:{resultat}": numero})
+                plus_hauts[chat_id] = max(numero, plus_hauts.get(chat_id, numero))
+            for chat_id, numero in plus_hauts.items():
+                pipe.zremrangebyscore(self.cle("parties", chat_id), "-inf", numero - retention)
+            pipe.execute()
+
+    def lire_partie(self, chat_id, numero):
+        membres = self.client.zrangebyscore(self.cle("parties", chat_id), numero, numero)
+        return int(membres[0].split(":")[1]) if membres else None
+
+    def reset_parties(self, chat_id):
+        self.client.delete(self.cle("parties", chat_id))
+
+    # ----- Bot status -----
+
+    def sauver_statut(self, status):
+        self.client.set(self.cle("bot_status"), json.dumps(status, ensure_ascii=False))
+
+    def lire_statut(self):
+        """Bot status dict, or None if never written"""
+        valeur = self.client.get(self.cle("bot_status"))
+        return json.loads(valeur) if valeur else None
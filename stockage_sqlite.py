@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Optional SQLite storage for counters, dedup history and bot status.
+Enabled with BOT_STORAGE=sqlite (database file: BOT_DB_PATH), or
+BOT_STORAGE=redis for the Redis backend (stockage_redis.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("BOT_DB_PATH", "bot_data.db")
+# Processed games kept per channel, below the highest one (dedup window)
+DEDUP_RETENTION = int(os.getenv("DEDUP_RETENTION", "2048"))
+SYMBOLES = ["❤️", "♦️", "♣️", "♠️"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS compteurs (
+    chat_id INTEGER NOT NULL,
+    symbole TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, symbole)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS messages_traites (
+    chat_id INTEGER NOT NULL,
+    numero INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, numero)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS historique (
+    numero TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tendances (
+    chat_id INTEGER NOT NULL,
+    resolution TEXT NOT NULL,
+    serie TEXT NOT NULL,
+    PRIMARY KEY (chat_id, resolution)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS statistiques (
+    chat_id INTEGER PRIMARY KEY,
+    donnees TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parties (
+    chat_id INTEGER NOT NULL,
+    numero INTEGER NOT NULL,
+    resultat INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, numero)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS statut (
+    cle TEXT PRIMARY KEY,
+    valeur TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Constant SQL strings: sqlite3 keeps them prepared in its statement cache
+SQL_AJOUTER_COMPTEUR = (
+    "INSERT INTO compteurs (chat_id, symbole, total) VALUES (?, ?, ?) "
+    "ON CONFLICT (chat_id, symbole) DO UPDATE SET total = total + excluded.total"
+)
+SQL_ECRIRE_COMPTEUR = (
+    "INSERT INTO compteurs (chat_id, symbole, total) VALUES (?, ?, ?) "
+    "ON CONFLICT (chat_id, symbole) DO UPDATE SET total = excluded.total"
+)
+SQL_LIRE_COMPTEURS = "SELECT symbole, total FROM compteurs WHERE chat_id = ?"
+SQL_CANAUX = "SELECT DISTINCT chat_id FROM compteurs"
+SQL_TOUS_COMPTEURS = "SELECT chat_id, symbole, total FROM compteurs"
+SQL_MARQUER_TRAITE = "INSERT OR IGNORE INTO messages_traites (chat_id, numero) VALUES (?, ?)"
+SQL_EST_TRAITE = "SELECT 1 FROM messages_traites WHERE chat_id = ? AND numero = ?"
+SQL_PURGER_TRAITES = "DELETE FROM messages_traites WHERE chat_id = ? AND numero <= ?"
+# Dedup window of every channel: the last `retention` numbers below its highest
+SQL_FENETRES_TRAITES = (
+    "SELECT t.chat_id, t.numero FROM messages_traites t "
+    "JOIN (SELECT chat_id, MAX(numero) AS haut FROM messages_traites GROUP BY chat_id) m "
+    "ON t.chat_id = m.chat_id AND t.numero > m.haut - ? ORDER BY t.chat_id, t.numero"
+)
+SQL_RESET_COMPTEURS = "DELETE FROM compteurs WHERE chat_id = ?"
+SQL_RESET_TRAITES = "DELETE FROM messages_traites WHERE chat_id = ?"
+SQL_RESET_TENDANCES = "DELETE FROM tendances WHERE chat_id = ?"
+SQL_RESET_PARTIES = "DELETE FROM parties WHERE chat_id = ?"
+SQL_RESET_STATISTIQUES = "DELETE FROM statistiques WHERE chat_id = ?"
+SQL_ECRIRE_STATISTIQUES = (
+    "INSERT INTO statistiques (chat_id, donnees) VALUES (?, ?) "
+    "ON CONFLICT (chat_id) DO UPDATE SET donnees = excluded.donnees"
+)
+SQL_LIRE_STATISTIQUES = "SELECT donnees FROM statistiques WHERE chat_id = ?"
+SQL_ECRIRE_PARTIE = "INSERT OR REPLACE INTO parties (chat_id, numero, resultat) VALUES (?, ?, ?)"
+SQL_PURGER_PARTIES = "DELETE FROM parties WHERE chat_id = ? AND numero <= ?"
+SQL_LIRE_PARTIE = "SELECT resultat FROM parties WHERE chat_id = ? AND numero = ?"
+SQL_AJOUTER_HISTORIQUE = "INSERT OR IGNORE INTO historique (numero) VALUES (?)"
+SQL_EST_HISTORIQUE = "SELECT 1 FROM historique WHERE numero = ?"
+SQL_COMPTER_HISTORIQUE = "SELECT COUNT(*) FROM historique"
+SQL_CLES_HISTORIQUE = "SELECT numero FROM historique"
+SQL_ECRIRE_STATUT = (
+    "INSERT INTO statut (cle, valeur) VALUES (?, ?) "
+    "ON CONFLICT (cle) DO UPDATE SET valeur = excluded.valeur"
+)
+SQL_ECRIRE_TENDANCE = (
+    "INSERT INTO tendances (chat_id, resolution, serie) VALUES (?, ?, ?) "
+    "ON CONFLICT (chat_id, resolution) DO UPDATE SET serie = excluded.serie"
+)
+SQL_LIRE_TENDANCES = "SELECT resolution, serie FROM tendances WHERE chat_id = ?"
+SQL_LIRE_STATUT = "SELECT valeur FROM statut WHERE cle = ?"
+
+def backend_stockage():
+    """Selected backend: json, sqlite or redis"""
+    return os.getenv("BOT_STORAGE", "json").lower()
+
+def sqlite_actif():
+    """True when the SQLite backend is selected"""
+    return backend_stockage() == "sqlite"
+
+class StockageSQLite:
+    """Single-file store shared by the worker and the web process"""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None, timeout=5.0)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def transaction(self, operations):
+        """Run operations(conn) inside a single write transaction"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = operations(self.conn)
+                self.conn.execute("COMMIT")
+                return result
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    # ----- Counters + dedup -----
+
+    def enregistrer_partie(self, chat_id, numero, delta, retraite=False):
+        """One transaction per processed message: dedup key + counter delta.
+
+        Returns the counters of the channel, or None when the game was already
+        claimed (by this or another worker) and retraite is False.
+        """
+        def operations(conn):
+            if numero is not None:
+                nouveau = conn.execute(SQL_MARQUER_TRAITE, (chat_id, numero)).rowcount
+                if not nouveau and not retraite:
+                    return None
+                conn.execute(SQL_PURGER_TRAITES, (chat_id, numero - DEDUP_RETENTION))
+            if delta:
+                conn.executemany(SQL_AJOUTER_COMPTEUR,
+                                 [(chat_id, symbole, count) for symbole, count in delta.items()])
+            compteurs = {symbole: 0 for symbole in SYMBOLES}
+            for symbole, total in conn.execute(SQL_LIRE_COMPTEURS, (chat_id,)):
+                compteurs[symbole] = total
+            return compteurs
+        return self.transaction(operations)
+
+    def enregistrer_parties(self, chat_id, parties):
+        """Several games of a channel [(numero, delta, retraite)] in one transaction.
+
+        Returns (counters of the channel, indexes of the games counted); the
+        deltas of the counted games are summed into one counter write.
+        """
+        def operations(conn):
+            comptees = []
+            somme = {}
+            haut = None
+            for i, (numero, delta, retraite) in enumerate(parties):
+                if numero is not None:
+                    haut = numero if haut is None else max(haut, numero)
+                    nouveau = conn.execute(SQL_MARQUER_TRAITE, (chat_id, numero)).rowcount
+                    if not nouveau and not retraite:
+                        continue
+                comptees.append(i)
+                for symbole, count in delta.items():
+                    somme[symbole] = somme.get(symbole, 0) + count
+            if haut is not None:
+                conn.execute(SQL_PURGER_TRAITES, (chat_id, haut - DEDUP_RETENTION))
+            if somme:
+                conn.executemany(SQL_AJOUTER_COMPTEUR,
+                                 [(chat_id, symbole, count) for symbole, count in somme.items()])
+            compteurs = {symbole: 0 for symbole in SYMBOLES}
+            for symbole, total in conn.execute(SQL_LIRE_COMPTEURS, (chat_id,)):
+                compteurs[symbole] = total
+            return compteurs, comptees
+        return self.transaction(operations)
+
+    def get_compteurs(self, chat_id):
+        """Counters of a channel, zero for missing symbols"""
+        compteurs = {symbole: 0 for symbole in SYMBOLES}
+        with self.lock:
+            for symbole, total in self.conn.execute(SQL_LIRE_COMPTEURS, (chat_id,)):
+                compteurs[symbole] = total
+        return compteurs
+
+    def sauver_compteurs(self, chat_id, compteurs):
+        """Overwrite the counters of a channel"""
+        def operations(conn):
+            conn.executemany(SQL_ECRIRE_COMPTEUR,
+                             [(chat_id, symbole, total) for symbole, total in compteurs.items()])
+        self.transaction(operations)
+
+    def reset_canal(self, chat_id):
+        """Clear counters, processed games and history of a channel"""
+        def operations(conn):
+            conn.execute(SQL_RESET_COMPTEURS, (chat_id,))
+            conn.execute(SQL_RESET_TRAITES, (chat_id,))
+            conn.execute(SQL_RESET_TENDANCES, (chat_id,))
+            conn.execute(SQL_RESET_PARTIES, (chat_id,))
+            conn.execute(SQL_RESET_STATISTIQUES, (chat_id,))
+        self.transaction(operations)
+
+    def get_all_channels(self):
+        """Channels that have counters"""
+        with self.lock:
+            return [row[0] for row in self.conn.execute(SQL_CANAUX)]
+
+    def totaux_canaux(self):
+        """Counters of every channel: {chat_id: {symbol: total}}"""
+        totaux = {}
+        with self.lock:
+            for chat_id, symbole, total in self.conn.execute(SQL_TOUS_COMPTEURS):
+                if chat_id not in totaux:
+                    totaux[chat_id] = {s: 0 for s in SYMBOLES}
+                totaux[chat_id][symbole] = total
+        return totaux
+
+    def remplacer_traites(self, chat_id, numeros):
+        """Replace the processed games of a channel"""
+        def operations(conn):
+            conn.execute(SQL_RESET_TRAITES, (chat_id,))
+            conn.executemany(SQL_MARQUER_TRAITE, [(chat_id, numero) for numero in numeros])
+        self.transaction(operations)
+
+    def est_traite(self, chat_id, numero):
+        """Check if a game of a channel was processed"""
+        with self.lock:
+            return self.conn.execute(SQL_EST_TRAITE, (chat_id, numero)).fetchone() is not None
+
+    def tous_traites(self, retention=DEDUP_RETENTION):
+        """Processed (chat_id, numero) pairs of the dedup window of every
+        channel, ordered per channel"""
+        with self.lock:
+            return self.conn.execute(SQL_FENETRES_TRAITES, (retention,)).fetchall()
+
+    # ----- tendances.py -----
+
+    def sauver_tendances(self, series_par_canal):
+        """Write {chat_id: {resolution: serie dict}} in one transaction"""
+        lignes = [(chat_id, resolution, json.dumps(serie))
+                  for chat_id, series in series_par_canal.items()
+                  for resolution, serie in series.items()]
+        self.transaction(lambda conn: conn.executemany(SQL_ECRIRE_TENDANCE, lignes))
+
+    def lire_tendances(self, chat_id):
+        """{resolution: serie dict} of a channel, None if never written"""
+        with self.lock:
+            rows = self.conn.execute(SQL_LIRE_TENDANCES, (chat_id,)).fetchall()
+        return {resolution: json.loads(serie) for resolution, serie in rows} or None
+
+    # ----- statistiques.py -----
+
+    def sauver_statistiques(self, stats_par_canal):
+        """Write {chat_id: statistics dict} in one transaction"""
+        lignes = [(chat_id, json.dumps(d)) for chat_id, d in stats_par_canal.items()]
+        self.transaction(lambda conn: conn.executemany(SQL_ECRIRE_STATISTIQUES, lignes))
+
+    def lire_statistiques(self, chat_id):
+        """Statistics dict of a channel, None if never written"""
+        with self.lock:
+            row = self.conn.execute(SQL_LIRE_STATISTIQUES, (chat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # ----- historique.py -----
+
+    def ajouter_historique(self, numero):
+        """False when the entry was already there"""
+        return self.transaction(lambda conn: conn.execute(SQL_AJOUTER_HISTORIQUE, (str(numero),)).rowcount == 1)
+
+    def est_historique(self, numero):
+        with self.lock:
+            return self.conn.execute(SQL_EST_HISTORIQUE, (str(numero),)).fetchone() is not None
+
+    def cles_historique(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute(SQL_CLES_HISTORIQUE)]
+
+    def compter_historique(self):
+        with self.lock:
+            return self.conn.execute(SQL_COMPTER_HISTORIQUE).fetchone()[0]
+
+    def reset_historique(self):
+        self.transaction(lambda conn: conn.execute("DELETE FROM historique"))
+
+    # ----- registre_parties.py -----
+
+    def ecrire_parties(self, lignes, retention):
+        """Write [(chat_id, numero, resultat)], keeping `retention` games per channel"""
+        def operations(conn):
+            conn.executemany(SQL_ECRIRE_PARTIE, lignes)
+            plus_hauts = {}
+            for chat_id, numero, _ in lignes:
+                plus_hauts[chat_id] = max(numero, plus_hauts.get(chat_id, numero))
+            conn.executemany(SQL_PURGER_PARTIES,
+                             [(chat_id, numero - retention) for chat_id, numero in plus_hauts.items()])
+        self.transaction(operations)
+
+    def lire_partie(self, chat_id, numero):
+        with self.lock:
+            row = self.conn.execute(SQL_LIRE_PARTIE, (chat_id, numero)).fetchone()
+        return row[0] if row else None
+
+    def reset_parties(self, chat_id):
+        self.transaction(lambda conn: conn.execute(SQL_RESET_PARTIES, (chat_id,)))
+
+    # ----- Bot status -----
+
+    def sauver_statut(self, status):
+        self.transaction(lambda conn: conn.execute(
+            SQL_ECRIRE_STATUT, ("bot_status", json.dumps(status, ensure_ascii=False))))
+
+    def lire_statut(self):
+        """Bot status dict, or None if never written"""
+        with self.lock:
+            row = self.conn.execute(SQL_LIRE_STATUT, ("bot_status",)).fetchone()
+        return json.loads(row[0]) if row else None
+
+stockage = None
+
+def get_stockage():
+    """Shared StockageSQLite (or StockageRedis) instance, None when JSON files are used"""
+    global stockage
+    if stockage is None:
+        backend = backend_stockage()
+        if backend == "sqlite":
+            stockage = StockageSQLite()
+        elif backend == "redis":
+            from stockage_redis import StockageRedis
+            stockage = StockageRedis()
+    return stockage
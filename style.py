@@ -1,96 +1,236 @@
-def afficher_compteurs_canal(compteurs, style=1):
-    """Display counters for a specific channel with chosen style"""
-    if not compteurs:
-        compteurs = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
-
-    if style == 1:
-        return f"❤️: {compteurs.get('❤️', 0)}\n♦️: {compteurs.get('♦️', 0)}\n♣️: {compteurs.get('♣️', 0)}\n♠️: {compteurs.get('♠️', 0)}"
-    elif style == 2:
-        return f"❤️ {compteurs.get('❤️', 0)} | ♦️ {compteurs.get('♦️', 0)} | ♣️ {compteurs.get('♣️', 0)} | ♠️ {compteurs.get('♠️', 0)}"
-    elif style == 3:
-        return f"Cœurs: {compteurs.get('❤️', 0)} - Carreaux: {compteurs.get('♦️', 0)} - Trèfles: {compteurs.get('♣️', 0)} - Piques: {compteurs.get('♠️', 0)}"
-    elif style == 4:
-        return f"[❤️ {compteurs.get('❤️', 0)}] [♦️ {compteurs.get('♦️', 0)}] [♣️ {compteurs.get('♣️', 0)}] [♠️ {compteurs.get('♠️', 0)}]"
-    else:  # style 5
-        total = sum(compteurs.values())
-        return f"Total: {total} (❤️{compteurs.get('❤️', 0)} ♦️{compteurs.get('♦️', 0)} ♣️{compteurs.get('♣️', 0)} ♠️{compteurs.get('♠️', 0)})"
+#!/usr/bin/env python3
+"""
+Display styles: templates compiled once, registry, memoized renders
+"""
+import json
+import string
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Template fields: {coeurs} {carreaux} {trefles} {piques} {total}, and the
+# rolling statistics of the channel (statistiques.get_stats): {parties} games
+# in the window, {pct_coeurs}... suit share of the window in %, {chi2}
+CHAMPS = ("coeurs", "carreaux", "trefles", "piques", "total",
+          "parties", "pct_coeurs", "pct_carreaux", "pct_trefles", "pct_piques", "chi2")
+STYLES_FILE = "styles_perso.json"
+CACHE_SIZE = 4096
+
+# Field -> expression computed once per render by the compiled formatter
+EXPRESSIONS = {
+    "coeurs": "get('❤️', 0)",
+    "carreaux": "get('♦️', 0)",
+    "trefles": "get('♣️', 0)",
+    "piques": "get('♠️', 0)",
+}
+# Statistics fields: zero when no statistics are given
+EXPRESSIONS_STATS = {
+    "parties": "stats['parties'] if stats else 0",
+    "pct_coeurs": "stats['frequences']['❤️'] * 100 if stats else 0.0",
+    "pct_carreaux": "stats['frequences']['♦️'] * 100 if stats else 0.0",
+    "pct_trefles": "stats['frequences']['♣️'] * 100 if stats else 0.0",
+    "pct_piques": "stats['frequences']['♠️'] * 100 if stats else 0.0",
+    "chi2": "stats['chi2'] if stats else 0.0",
+}
+
+def compiler_gabarit(gabarit):
+    """Compile a str.format template over CHAMPS into an f-string function;
+    returns (function, whether it uses statistics fields)"""
+    morceaux = []
+    champs = set()
+    for texte, champ, spec, conversion in string.Formatter().parse(gabarit):
+        morceaux.append(texte.replace("{", "{{").replace("}", "}}"))
+        if champ is None:
+            continue
+        if champ not in CHAMPS:
+            raise ValueError(f"Unknown template field '{{{champ}}}' (use {', '.join(CHAMPS)})")
+        if "{" in spec:
+            raise ValueError(f"Nested field in the format spec of '{{{champ}}}'")
+        if conversion not in (None, "r", "s", "a"):
+            raise ValueError(f"Unknown conversion '!{conversion}' in '{{{champ}}}' (use !r, !s or !a)")
+        champs.add(champ)
+        morceaux.append("{" + champ + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}")
+
+    if "total" in champs:
+        champs.update(EXPRESSIONS)
+    lignes = ["def formater(compteurs, stats=None):", "    get = compteurs.get"]
+    lignes += [f"    {champ} = {EXPRESSIONS[champ]}" for champ in EXPRESSIONS if champ in champs]
+    lignes += [f"    {champ} = {EXPRESSIONS_STATS[champ]}" for champ in EXPRESSIONS_STATS if champ in champs]
+    if "total" in champs:
+        lignes.append("    total = coeurs + carreaux + trefles + piques")
+    lignes.append("    return f" + repr("".join(morceaux)))
+    espace = {}
+    exec(compile("\n".join(lignes), "<gabarit>", "exec"), espace)
+    return espace["formater"], not champs.isdisjoint(EXPRESSIONS_STATS)
+
+class Gabarit:
+    """A display style compiled once into formater(compteurs, stats=None).
+
+    gabarit is either a str.format template over CHAMPS, turned into an
+    f-string function when the style is registered, or a function for
+    styles with loops. avec_stats tells whether it reads the statistics (a
+    function is assumed to), so they are only computed for those styles.
+    """
+    __slots__ = ("nom", "formater", "avec_stats")
+
+    def __init__(self, nom, gabarit):
+        self.nom = nom
+        if callable(gabarit):
+            self.formater, self.avec_stats = gabarit, True
+        else:
+            self.formater, self.avec_stats = compiler_gabarit(gabarit)
+
+# Styles of the per-channel counter message (selected with style_affichage)
+STYLES_CANAL = {
+    1: Gabarit("Style vertical simple", "❤️: {coeurs}\n♦️: {carreaux}\n♣️: {trefles}\n♠️: {piques}"),
+    2: Gabarit("Style horizontal avec séparateurs", "❤️ {coeurs} | ♦️ {carreaux} | ♣️ {trefles} | ♠️ {piques}"),
+    3: Gabarit("Style avec noms complets", "Cœurs: {coeurs} - Carreaux: {carreaux} - Trèfles: {trefles} - Piques: {piques}"),
+    4: Gabarit("Style avec crochets", "[❤️ {coeurs}] [♦️ {carreaux}] [♣️ {trefles}] [♠️ {piques}]"),
+    5: Gabarit("Style avec total", "Total: {total} (❤️{coeurs} ♦️{carreaux} ♣️{trefles} ♠️{piques})"),
+    6: Gabarit("Style avec tendance",
+               "Total: {total} (❤️{coeurs} ♦️{carreaux} ♣️{trefles} ♠️{piques})\n"
+               "{parties} dernières: ❤️{pct_coeurs:.0f}% ♦️{pct_carreaux:.0f}% ♣️{pct_trefles:.0f}% "
+               "♠️{pct_piques:.0f}% • χ² {chi2:.1f}"),
+}
+STYLE_DEFAUT = 5
+
+# (cle, style) -> rendered text, least recently used first
+cache_rendus = OrderedDict()
+verrou_cache = threading.Lock()
+
+def enregistrer_style(numero, nom, gabarit):
+    """Register (or replace) a channel style at runtime"""
+    STYLES_CANAL[int(numero)] = Gabarit(nom, gabarit)
+    with verrou_cache:
+        cache_rendus.clear()
+
+def charger_styles_perso(fichier=STYLES_FILE):
+    """Register the user-defined styles of styles_perso.json ({"6": {"nom": ..., "gabarit": ...}})"""
+    try:
+        with open(fichier, "r", encoding="utf-8") as f:
+            styles = json.load(f)
+    except FileNotFoundError:
+        return
+    except json.JSONDecodeError as e:
+        logger.error(f"Could not load custom styles: {e}")
+        return
+    for numero, style in styles.items():
+        try:
+            enregistrer_style(numero, style["nom"], style["gabarit"])
+        except (KeyError, ValueError, TypeError, SyntaxError) as e:
+            logger.error(f"Invalid custom style {numero}, skipped: {e}")
+
+def afficher_compteurs_canal(compteurs, style=1, cle=None, stats=None):
+    """Display counters for a specific channel with chosen style.
+
+    cle identifies the counter state, e.g. (chat_id, version): the text of a
+    (cle, style) pair is rendered once and then served from the cache.
+    stats is a function returning statistiques.get_stats() of the channel,
+    only called on a cache miss of a style that shows them.
+    """
+    if cle is not None:
+        with verrou_cache:
+            texte = cache_rendus.get((cle, style))
+            if texte is not None:
+                cache_rendus.move_to_end((cle, style))
+                return texte
+
+    gabarit = STYLES_CANAL.get(style) or STYLES_CANAL[STYLE_DEFAUT]
+    texte = gabarit.formater(compteurs or {}, stats() if stats and gabarit.avec_stats else None)
+
+    if cle is not None:
+        with verrou_cache:
+            cache_rendus[(cle, style)] = texte
+            if len(cache_rendus) > CACHE_SIZE:
+                cache_rendus.popitem(last=False)
+    return texte
 
 def get_all_styles():
     """Return all available display styles"""
-    return {
-        1: "Style vertical simple",
-        2: "Style horizontal avec séparateurs",
-        3: "Style avec noms complets",
-        4: "Style avec crochets",
-        5: "Style avec total"
-    }
-
-def afficher_compteurs(compteurs=None, style=1):
-    """Format and display counters in different styles"""
+    return {numero: gabarit.nom for numero, gabarit in sorted(STYLES_CANAL.items())}
+
+def total_et_max(compteurs):
+    """Total and largest counter in one pass"""
+    total = 0
+    max_count = 0
+    for count in compteurs.values():
+        total += count
+        if count > max_count:
+            max_count = count
+    return total, max_count
+
+def rapport_pourcentages(compteurs, stats=None):
+    """Report style 3: percentages, plus the rolling window when stats are given"""
+    total, _ = total_et_max(compteurs)
+    if total == 0:
+        return "📊 **Compteurs vides**\n❤️♦️♣️♠️ 0 | 0 | 0 | 0"
+
+    result = "📊 **Statistiques**\n"
+    for symbole, count in compteurs.items():
+        pct = count / total * 100
+        result += f"{symbole} {count} ({pct:.1f}%)\n"
+    result += f"\n🔢 Total: {total}"
+    if stats and stats["parties"]:
+        result += f"\n\n🔄 {stats['parties']} dernières parties\n"
+        for symbole, freq in stats["frequences"].items():
+            result += f"{symbole} {freq * 100:.1f}% • série {stats['serie'][symbole]} • absent {stats['ecart'][symbole]}\n"
+        result += f"χ² {stats['chi2']:.2f}{' ⚠️' if stats['biais'] else ''}"
+    return result
+
+def rapport_graphique(compteurs, stats=None):
+    """Report style 4: bars, plus the rolling window when stats are given"""
+    total, max_count = total_et_max(compteurs)
+    result = "📊 **Graphique**\n\n"
+
+    for symbole, count in compteurs.items():
+        bars = "█" * min(10, int(count / max_count * 10)) if max_count > 0 else ""
+        result += f"{symbole} {count:2d} {bars}\n"
+
+    result += f"\n🔢 Total: {total}"
+    if stats and stats["parties"]:
+        fenetre = stats["fenetre"]
+        max_fenetre = max(fenetre.values())
+        result += f"\n\n🔄 {stats['parties']} dernières parties\n"
+        for symbole, count in fenetre.items():
+            bars = "▒" * (int(count / max_fenetre * 10) if max_fenetre > 0 else 0)
+            result += f"{symbole} {count:2d} {bars}\n"
+    return result
+
+# Styles of the full report (afficher_compteurs)
+STYLES_RAPPORT = {
+    1: Gabarit("Liste simple",
+               "📊 **Compteur de Cartes**\n\n❤️ Cœurs: {coeurs}\n♦️ Carreaux: {carreaux}\n"
+               "♣️ Trèfles: {trefles}\n♠️ Piques: {piques}\n\n🔢 Total: {total}"),
+    2: Gabarit("Format compact", "🃏 ❤️{coeurs} ♦️{carreaux} ♣️{trefles} ♠️{piques} | Total: {total}"),
+    3: Gabarit("Pourcentages", rapport_pourcentages),
+    4: Gabarit("Graphique", rapport_graphique),
+    5: Gabarit("Rapport détaillé",
+               "🎴 **Rapport Détaillé**\n\n🔸 ❤️ **Cœurs**: {coeurs}\n🔸 ♦️ **Carreaux**: {carreaux}\n"
+               "🔸 ♣️ **Trèfles**: {trefles}\n🔸 ♠️ **Piques**: {piques}\n\n📈 **Total général**: {total} cartes"),
+}
+
+def afficher_compteurs(compteurs=None, style=1, stats=None):
+    """Format and display counters in different styles (stats: statistiques.get_stats())"""
     if compteurs is None:
         compteurs = {"❤️": 0, "♦️": 0, "♣️": 0, "♠️": 0}
-
-    if style == 1:
-        # Simple vertical list
-        return f"""📊 **Compteur de Cartes**
-
-❤️ Cœurs: {compteurs['❤️']}
-♦️ Carreaux: {compteurs['♦️']}
-♣️ Trèfles: {compteurs['♣️']}
-♠️ Piques: {compteurs['♠️']}
-
-🔢 Total: {sum(compteurs.values())}"""
-
-    elif style == 2:
-        # Compact horizontal
-        total = sum(compteurs.values())
-        return f"🃏 ❤️{compteurs['❤️']} ♦️{compteurs['♦️']} ♣️{compteurs['♣️']} ♠️{compteurs['♠️']} | Total: {total}"
-
-    elif style == 3:
-        # With percentages
-        total = sum(compteurs.values())
-        if total == 0:
-            return "📊 **Compteurs vides**\n❤️♦️♣️♠️ 0 | 0 | 0 | 0"
-
-        result = "📊 **Statistiques**\n"
-        for symbole, count in compteurs.items():
-            pct = (count / total * 100) if total > 0 else 0
-            result += f"{symbole} {count} ({pct:.1f}%)\n"
-        result += f"\n🔢 Total: {total}"
-        return result
-
-    elif style == 4:
-        # Visual bars
-        total = sum(compteurs.values())
-        max_count = max(compteurs.values()) if compteurs.values() else 1
-        result = "📊 **Graphique**\n\n"
-
-        for symbole, count in compteurs.items():
-            bars = "█" * min(10, int((count / max_count * 10)) if max_count > 0 else 0)
-            result += f"{symbole} {count:2d} {bars}\n"
-
-        result += f"\n🔢 Total: {total}"
-        return result
-
-    elif style == 5:
-        # Detailed with emojis
-        total = sum(compteurs.values())
-        result = "🎴 **Rapport Détaillé**\n\n"
-
-        symbols_names = {
-            "❤️": "Cœurs",
-            "♦️": "Carreaux", 
-            "♣️": "Trèfles",
-            "♠️": "Piques"
-        }
-
-        for symbole, count in compteurs.items():
-            name = symbols_names.get(symbole, symbole)
-            result += f"🔸 {symbole} **{name}**: {count}\n"
-
-        result += f"\n📈 **Total général**: {total} cartes"
-        return result
-
-    else:
-        # Default to style 1
-        return afficher_compteurs(compteurs, 1)
\ No newline at end of file
+    # Default to style 1
+    gabarit = STYLES_RAPPORT.get(style) or STYLES_RAPPORT[1]
+    return gabarit.formater(compteurs, stats)
+
+def afficher_statistiques(stats):
+    """Rolling statistics report (/stats command)"""
+    if not stats["parties"]:
+        return "📊 Pas encore de parties pour les statistiques"
+
+    result = f"📊 **Statistiques des {stats['parties']} dernières parties**\n\n"
+    for symbole, freq in stats["frequences"].items():
+        result += (f"{symbole} {stats['fenetre'][symbole]} ({freq * 100:.1f}%)\n"
+                   f"   série {stats['serie'][symbole]} (record {stats['meilleure_serie'][symbole]}) • "
+                   f"absent depuis {stats['ecart'][symbole]} (max {stats['ecart_max'][symbole]})\n")
+    result += f"\n🔢 Cartes: {stats['total']}\nχ²: {stats['chi2']:.2f}"
+    result += " ⚠️ répartition anormale" if stats["biais"] else " ✅ répartition normale"
+    return result
+
+charger_styles_perso()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Time-bucketed suit counts per channel (minute / hour / day) for trend queries
+"""
+import base64
+import json
+import os
+import threading
+import time
+import logging
+from array import array
+from persistance import persistence_executor
+from stockage_sqlite import get_stockage
+from etat_partage import ecrire_json
+
+logger = logging.getLogger(__name__)
+
+SYMBOLES = ["❤️", "♦️", "♣️", "♠️"]
+INDEX_SYMBOLE = {symbole: i for i, symbole in enumerate(SYMBOLES)}
+
+# Resolution -> (bucket width in seconds, buckets kept)
+RESOLUTIONS = {
+    "minute": (60, int(os.getenv("HISTORY_MINUTES", "360"))),
+    "hour": (3600, int(os.getenv("HISTORY_HOURS", "168"))),
+    "day": (86400, int(os.getenv("HISTORY_DAYS", "365"))),
+}
+FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "10"))
+
+class Serie:
+    """Ring of fixed-width buckets, 4 signed counters per bucket (an edit
+    correction subtracts from the bucket of the game).
+
+    `dernier` is the absolute index (timestamp // largeur) of the newest
+    bucket; buckets older than `taille` are overwritten when time moves on.
+    """
+    __slots__ = ("largeur", "taille", "dernier", "data")
+
+    def __init__(self, largeur, taille, dernier=None, data=None):
+        self.largeur = largeur
+        self.taille = taille
+        self.dernier = dernier
+        self.data = data if data is not None else array("i", bytes(4 * taille * len(SYMBOLES)))
+
+    def ajouter(self, horodatage, valeurs):
+        """Add the per-symbol counts (list of 4) at horodatage"""
+        bucket = int(horodatage // self.largeur)
+        if self.dernier is None:
+            self.dernier = bucket
+        elif bucket > self.dernier:
+            # Clear the slots the ring moves over
+            for b in range(max(self.dernier + 1, bucket - self.taille + 1), bucket + 1):
+                debut = (b % self.taille) * 4
+                self.data[debut:debut + 4] = array("i", (0, 0, 0, 0))
+            self.dernier = bucket
+        elif bucket <= self.dernier - self.taille:
+            return  # Older than the retention
+        debut = (bucket % self.taille) * 4
+        for i in range(4):
+            self.data[debut + i] += valeurs[i]
+
+    def points(self, debut, fin):
+        """(bucket start, [4 counts]) for each bucket overlapping [debut, fin)"""
+        if self.dernier is None:
+            return
+        premier = max(int(debut // self.largeur), self.dernier - self.taille + 1)
+        dernier = min(int((fin - 1) // self.largeur), self.dernier)
+        for bucket in range(premier, dernier + 1):
+            i = (bucket % self.taille) * 4
+            yield bucket * self.largeur, self.data[i:i + 4].tolist()
+
+    def vers_dict(self):
+        return {"largeur": self.largeur, "taille": self.taille, "dernier": self.dernier,
+                "data": base64.b64encode(self.data.tobytes()).decode("ascii")}
+
+    @classmethod
+    def depuis_dict(cls, d, taille):
+        # Same bytes as the former unsigned arrays for any count below 2**31
+        data = array("i")
+        data.frombytes(base64.b64decode(d["data"]))
+        serie = cls(d["largeur"], d["taille"], d["dernier"], data)
+        return serie if serie.taille == taille else serie.redimensionner(taille)
+
+    def redimensionner(self, taille):
+        """Copy into a ring of another size (retention changed)"""
+        nouvelle = Serie(self.largeur, taille)
+        if self.dernier is not None:
+            fin = (self.dernier + 1) * self.largeur
+            for debut, valeurs in self.points(fin - taille * self.largeur, fin):
+                nouvelle.ajouter(debut, valeurs)
+            nouvelle.dernier = self.dernier
+        return nouvelle
+
+def nouvelles_series():
+    return {nom: Serie(largeur, taille) for nom, (largeur, taille) in RESOLUTIONS.items()}
+
+# chat_id -> {resolution: Serie}
+series_par_canal = {}
+canaux_modifies = set()
+# Channels evicted from the counter cache: series dropped once written
+a_liberer = set()
+verrou = threading.RLock()
+
+def get_tendances_fichier(chat_id):
+    return f"tendances_{chat_id}.json"
+
+def charger_series(chat_id):
+    """Series of a channel from storage (empty when missing)"""
+    stockage = get_stockage()
+    try:
+        if stockage:
+            brut = stockage.lire_tendances(chat_id)
+        else:
+            with open(get_tendances_fichier(chat_id), "r", encoding="utf-8") as f:
+                brut = json.load(f)
+    except FileNotFoundError:
+        brut = None
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.error(f"Could not load history of {chat_id}: {e}")
+        brut = None
+
+    series = nouvelles_series()
+    for nom, d in (brut or {}).items():
+        if nom in RESOLUTIONS:
+            series[nom] = Serie.depuis_dict(d, RESOLUTIONS[nom][1])
+    return series
+
+def get_series(chat_id):
+    with verrou:
+        a_liberer.discard(chat_id)
+        if chat_id not in series_par_canal:
+            series_par_canal[chat_id] = charger_series(chat_id)
+        return series_par_canal[chat_id]
+
+def enregistrer(chat_id, delta, horodatage=None):
+    """Add a {symbol: count} delta (negative for an edit correction) to every
+    resolution of the channel, at the date of the game"""
+    valeurs = [0, 0, 0, 0]
+    for symbole, count in delta.items():
+        i = INDEX_SYMBOLE.get(symbole)
+        if i is not None:
+            valeurs[i] += count
+    if not any(valeurs):
+        return
+    if horodatage is None:
+        horodatage = time.time()
+    with verrou:
+        for serie in get_series(chat_id).values():
+            serie.ajouter(horodatage, valeurs)
+        canaux_modifies.add(chat_id)
+
+def liberer(chat_id):
+    """Drop the series of a channel from memory (reloaded on next use),
+    after the next flush when they changed"""
+    with verrou:
+        if chat_id in canaux_modifies:
+            a_liberer.add(chat_id)
+        else:
+            series_par_canal.pop(chat_id, None)
+
+def liberer_ecrits():
+    with verrou:
+        for chat_id in a_liberer - canaux_modifies:
+            series_par_canal.pop(chat_id, None)
+        a_liberer.intersection_update(canaux_modifies)
+
+def reset_canal(chat_id):
+    """Drop the history of a channel"""
+    with verrou:
+        series_par_canal[chat_id] = nouvelles_series()
+        canaux_modifies.add(chat_id)
+
+def flush_tendances():
+    """Write the series of every modified channel"""
+    with verrou:
+        a_ecrire = {chat_id: {nom: serie.vers_dict() for nom, serie in series_par_canal[chat_id].items()}
+                    for chat_id in canaux_modifies}
+        canaux_modifies.clear()
+    if not a_ecrire:
+        return
+
+    stockage = get_stockage()
+    if stockage:
+        try:
+            stockage.sauver_tendances(a_ecrire)
+        except Exception as e:
+            logger.error(f"Could not save history: {e}")
+            with verrou:
+                canaux_modifies.update(a_ecrire)
+        liberer_ecrits()
+        return
+
+    for chat_id, series in a_ecrire.items():
+        try:
+            ecrire_json(get_tendances_fichier(chat_id), series)
+        except OSError as e:
+            logger.error(f"Could not save history of {chat_id}: {e}")
+            with verrou:
+                canaux_modifies.add(chat_id)
+    liberer_ecrits()
+
+def start_flush_tendances(intervalle=FLUSH_INTERVAL):
+    persistence_executor.every(intervalle, "tendances", flush_tendances)
+
+def stop_flush_tendances():
+    persistence_executor.cancel("tendances")
+    flush_tendances()
+
+def interroger(chat_id, debut=None, fin=None, resolution="hour", series=None):
+    """Buckets of a channel in [debut, fin): O(buckets), not O(messages).
+
+    Defaults to the whole retention of the resolution. series lets a reader
+    process pass series loaded with charger_series().
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown bucket '{resolution}' (minute, hour or day)")
+    largeur, taille = RESOLUTIONS[resolution]
+    if fin is None:
+        fin = time.time()
+    if debut is None:
+        debut = fin - largeur * taille
+    if series is None:
+        series = get_series(chat_id)
+
+    points = []
+    totaux = [0, 0, 0, 0]
+    with verrou:
+        for horodatage, valeurs in series[resolution].points(debut, fin):
+            for i in range(4):
+                totaux[i] += valeurs[i]
+            points.append({"t": horodatage, "counters": dict(zip(SYMBOLES, valeurs)), "total": sum(valeurs)})
+    return {
+        "channel": chat_id,
+        "bucket": resolution,
+        "from": debut,
+        "to": fin,
+        "totals": dict(zip(SYMBOLES, totaux)),
+        "points": points,
+    }
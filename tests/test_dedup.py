@@ -0,0 +1,119 @@
+"""ChannelWindow sliding and restart, DedupJournal load, group commit and compaction"""
+import json
+from dedup import ChannelWindow, DedupIndex, DedupJournal, RESTART_RUN
+
+def test_window_slides_forward():
+    window = ChannelWindow(retention=16)
+    for numero in range(1, 21):
+        window.add(numero)
+    assert window.numbers() == list(range(5, 21))
+    assert window.contains(5) and window.contains(20)
+    assert not window.contains(4)
+    assert not window.contains(21)
+
+def test_window_frees_slots_of_skipped_numbers():
+    window = ChannelWindow(retention=16)
+    for numero in range(1, 17):
+        window.add(numero)
+    # 17..19 reuse the slots of 1..3 and were never seen
+    window.add(20)
+    assert not window.contains(17)
+    assert not window.contains(19)
+    assert window.contains(16) and window.contains(20)
+
+def test_single_late_number_keeps_the_window():
+    window = ChannelWindow()
+    for numero in range(1, 3001):
+        window.add(numero)
+    window.add(500)
+    assert window.high == 3000
+    assert window.contains(2999)
+    assert window.contains(500)
+    # The live numbering goes on: the late number is forgotten
+    window.add(3001)
+    assert not window.contains(500)
+    assert window.contains(3001)
+
+def test_run_of_low_numbers_restarts_the_window():
+    window = ChannelWindow()
+    for numero in range(1, 3001):
+        window.add(numero)
+    for numero in range(1, RESTART_RUN):
+        window.add(numero)
+        assert window.high == 3000
+    window.add(RESTART_RUN)
+    assert window.high == RESTART_RUN
+    assert window.numbers() == list(range(1, RESTART_RUN + 1))
+    assert not window.contains(2999)
+
+def test_interrupted_run_does_not_restart():
+    window = ChannelWindow()
+    for numero in range(1, 3001):
+        window.add(numero)
+    for numero in range(100, 100 + RESTART_RUN - 1):
+        window.add(numero)
+    # A smaller number starts a new run
+    window.add(50)
+    for numero in range(51, 50 + RESTART_RUN - 1):
+        window.add(numero)
+    assert window.high == 3000
+    assert window.contains(2999)
+
+def test_redelivered_low_number_does_not_break_the_run():
+    window = ChannelWindow()
+    for numero in range(1, 3001):
+        window.add(numero)
+    for numero in range(1, RESTART_RUN):
+        window.add(numero)
+        window.add(numero)
+    window.add(RESTART_RUN)
+    assert window.high == RESTART_RUN
+
+def journal_dans(tmp_path, **options):
+    return DedupJournal(snapshot_file=str(tmp_path / "processed.json"),
+                        journal_file=str(tmp_path / "processed.journal"), **options)
+
+def test_load_ignores_the_cut_last_line(tmp_path):
+    (tmp_path / "processed.json").write_text(json.dumps(["1_5", "2_3"]))
+    (tmp_path / "processed.journal").write_text("+1_6\n-2\n+2_7\n+1_8")
+    journal = journal_dans(tmp_path)
+    index = journal.load()
+    assert index.contains(1, 5) and index.contains(1, 6)
+    assert not index.contains(1, 8)
+    # The reset forgot the snapshot key, not the key recorded after it
+    assert not index.contains(2, 3)
+    assert index.contains(2, 7)
+    assert journal.entries == 3
+
+def test_group_commit_writes_pending_entries_once(tmp_path):
+    journal = journal_dans(tmp_path, flush_interval=3600)
+    journal.append("1_1")
+    journal.append("1_2")
+    journal.record_reset(3)
+    assert not (tmp_path / "processed.journal").exists()
+    journal.flush()
+    assert (tmp_path / "processed.journal").read_text() == "+1_1\n+1_2\n-3\n"
+    assert journal.pending == []
+    assert journal.entries == 3
+
+def test_compaction_keeps_journal_pending_and_foreign_keys(tmp_path):
+    journal = journal_dans(tmp_path, flush_interval=3600)
+    journal.append("1_1")
+    journal.flush()
+    # Appended by another process after our last flush
+    with open(tmp_path / "processed.journal", "a", encoding="utf-8") as f:
+        f.write("+2_9\n")
+    journal.append("1_2")
+    journal.compact()
+    assert (tmp_path / "processed.journal").read_text() == ""
+    assert sorted(json.loads((tmp_path / "processed.json").read_text())) == ["1_1", "1_2", "2_9"]
+    assert journal.pending == [] and journal.entries == 0
+    index = journal_dans(tmp_path).load()
+    assert index.contains(1, 1) and index.contains(1, 2) and index.contains(2, 9)
+
+def test_index_ignores_invalid_keys():
+    index = DedupIndex()
+    index.add_key("not-a-key")
+    index.add_key("-100_7")
+    assert index.contains(-100, 7)
+    assert len(index) == 1
@@ -0,0 +1,61 @@
+"""ChannelUpdateProcessor: per-chat ordering, concurrency limit and fin_de_lot"""
+import asyncio
+from datetime import datetime, timezone
+from telegram import Chat, Message, Update
+from dispatcher import ChannelUpdateProcessor
+
+def update_canal(update_id, chat_id):
+    chat = Chat(id=chat_id, type=Chat.CHANNEL)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=chat, text=f"#n{update_id}")
+    return Update(update_id=update_id, channel_post=message)
+
+def traiter(updates, max_concurrent_updates=4):
+    """Run the updates through the processor; returns (finished, max running, batches)"""
+    finis = []
+    en_cours = {"actuel": 0, "max": 0}
+    lots = []
+
+    async def main():
+        processor = ChannelUpdateProcessor(max_concurrent_updates=max_concurrent_updates)
+        processor.fin_de_lot = lambda: lots.append(len(finis))
+
+        async def travail(update, duree):
+            en_cours["actuel"] += 1
+            en_cours["max"] = max(en_cours["max"], en_cours["actuel"])
+            await asyncio.sleep(duree)
+            en_cours["actuel"] -= 1
+            finis.append((update.effective_chat.id, update.update_id))
+
+        # Later updates are shorter: without ordering they would finish first
+        await asyncio.gather(*(
+            processor.process_update(update, travail(update, 0.002 * (len(updates) - i)))
+            for i, update in enumerate(updates)))
+        await asyncio.sleep(0)
+        assert processor.active_chats() == 0
+
+    asyncio.run(main())
+    return finis, en_cours["max"], lots
+
+def test_updates_of_a_chat_finish_in_arrival_order():
+    updates = [update_canal(3 * i + k, -k) for i in range(30) for k in (1, 2, 3)]
+    finis, _, _ = traiter(updates)
+    assert len(finis) == len(updates)
+    for chat_id in (-1, -2, -3):
+        ordre = [update_id for chat, update_id in finis if chat == chat_id]
+        assert ordre == sorted(ordre)
+
+def test_chats_run_concurrently_within_the_limit():
+    updates = [update_canal(i, -i) for i in range(1, 13)]
+    _, maximum, _ = traiter(updates, max_concurrent_updates=3)
+    assert maximum == 3
+
+def test_one_chat_runs_one_update_at_a_time():
+    updates = [update_canal(i, -1) for i in range(1, 6)]
+    finis, maximum, _ = traiter(updates)
+    assert maximum == 1
+    assert [update_id for _, update_id in finis] == [1, 2, 3, 4, 5]
+
+def test_fin_de_lot_once_the_batch_is_done():
+    updates = [update_canal(i, -(i % 3)) for i in range(1, 10)]
+    _, _, lots = traiter(updates)
+    assert lots == [9]
@@ -0,0 +1,89 @@
+"""SendQueue: RetryAfter pauses the chat and retries, bounded retries, per-chat order"""
+import asyncio
+import time
+from telegram.error import BadRequest, RetryAfter
+from envoi import SendQueue
+
+def file_rapide(**options):
+    return SendQueue(global_per_second=1000, chat_per_minute=60000, chat_burst=100, **options)
+
+def test_retry_after_pauses_then_retries():
+    appels = []
+
+    async def envoyer(texte):
+        appels.append(time.monotonic())
+        if len(appels) == 1:
+            raise RetryAfter(0.05)
+        return texte
+
+    async def main():
+        queue = file_rapide()
+        assert await queue.send(1, envoyer, "ok") == "ok"
+        return queue
+
+    queue = asyncio.run(main())
+    assert len(appels) == 2
+    assert appels[1] - appels[0] >= 0.05
+    assert queue.stats["retry_after"] == 1
+    assert queue.stats["retries"] == 1
+    assert queue.stats["sent"] == 1
+    assert queue.metrics()["depth"] == 0
+
+def test_retry_after_gives_up_after_max_retries():
+    appels = []
+
+    async def envoyer():
+        appels.append(1)
+        raise RetryAfter(0.01)
+
+    async def main():
+        queue = file_rapide(max_retries=2)
+        try:
+            await queue.send(1, envoyer)
+        except RetryAfter:
+            pass
+        else:
+            raise AssertionError("RetryAfter not raised")
+        # Without wait the failure is only logged
+        assert await queue.submit(1, envoyer) is None
+        return queue
+
+    queue = asyncio.run(main())
+    assert len(appels) == 6
+    assert queue.stats["dropped"] == 2
+
+def test_bad_request_is_not_retried():
+    appels = []
+
+    async def envoyer():
+        appels.append(1)
+        raise BadRequest("Message to edit not found")
+
+    async def main():
+        queue = file_rapide()
+        try:
+            await queue.send(1, envoyer)
+        except BadRequest:
+            return queue
+        raise AssertionError("BadRequest not raised")
+
+    queue = asyncio.run(main())
+    assert len(appels) == 1
+    assert queue.stats["failed"] == 1
+
+def test_sends_of_a_chat_stay_in_order_after_retry_after():
+    envoyes = []
+    refus = []
+
+    async def envoyer(numero):
+        if numero == 1 and not refus:
+            refus.append(numero)
+            raise RetryAfter(0.02)
+        envoyes.append(numero)
+
+    async def main():
+        queue = file_rapide()
+        await asyncio.gather(*(queue.submit(1, envoyer, numero) for numero in range(1, 5)))
+
+    asyncio.run(main())
+    assert envoyes == [1, 2, 3, 4]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+ASGI webhook entry point: Telegram updates are acknowledged immediately and
+processed by the running Application on the same event loop.
+
+Run with: uvicorn webhook_asgi:app --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import logging
+from telegram import Update
+import render_bot
+from render_bot import build_application, load_state, save_state, save_bot_status, ALLOWED_UPDATES
+from persistance import persistence_executor
+from stockage_sqlite import get_stockage
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Checked against the X-Telegram-Bot-Api-Secret-Token header. When not
+# configured it is derived from the bot token at startup (secret_par_defaut),
+# so every uvicorn worker registers and checks the same one
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+MAX_BODY = 1024 * 1024
+
+application = None
+
+try:
+    # Dashboard and JSON API served by the same process
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+    import simple_web
+    dashboard = WSGIMiddleware(simple_web.app)
+except ImportError:
+    dashboard = None
+
+def secret_par_defaut(token):
+    """Webhook secret derived from the bot token: the same in every worker,
+    and not the token itself (Telegram sends it back on every update)"""
+    return hmac.new(token.encode("utf-8"), b"webhook-secret", hashlib.sha256).hexdigest()
+
+async def respond(send, status, body=b"", content_type=b"text/plain; charset=utf-8"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def read_body(receive):
+    """Request body, or None when larger than MAX_BODY"""
+    body = b""
+    more = True
+    while more:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY:
+            return None
+        more = message.get("more_body", False)
+    return body
+
+async def webhook(scope, receive, send):
+    """Validate, queue the update for the Application and acknowledge at once"""
+    if scope["method"] != "POST":
+        await respond(send, 405)
+        return
+
+    headers = dict(scope["headers"])
+    token = headers.get(b"x-telegram-bot-api-secret-token", b"").decode("latin-1")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        await respond(send, 403)
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        await respond(send, 413)
+        return
+    try:
+        update = Update.de_json(json.loads(body), application.bot)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Invalid update payload: {e}")
+        await respond(send, 400)
+        return
+
+    # Processing happens in the Application's update fetcher, not in this request
+    application.update_queue.put_nowait(update)
+    await respond(send, 200)
+
+async def attendre_deconnexion(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+async def stream(scope, receive, send):
+    """/api/stream on the event loop: an open stream costs a task, not a
+    server thread (the status itself is read in a worker thread)"""
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")],
+    })
+    deconnexion = asyncio.create_task(attendre_deconnexion(receive))
+    try:
+        flux = simple_web.FluxStatut()
+        await send({"type": "http.response.body", "body": b"retry: 1000\n\n", "more_body": True})
+        while flux.actif() and not deconnexion.done():
+            body, _, version = await asyncio.to_thread(simple_web.statut_courant)
+            evenement = flux.suivant(body, version)
+            if evenement:
+                await send({"type": "http.response.body", "body": evenement.encode(), "more_body": True})
+            await asyncio.wait({deconnexion}, timeout=simple_web.STREAM_CHECK_INTERVAL)
+        if not deconnexion.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        deconnexion.cancel()
+
+async def startup():
+    global application, WEBHOOK_SECRET
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        save_bot_status(False, error="No token")
+        raise RuntimeError("TELEGRAM_BOT_TOKEN environment variable not set")
+    if not WEBHOOK_SECRET:
+        WEBHOOK_SECRET = secret_par_defaut(token)
+    webhook_url = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+    if not webhook_url:
+        raise RuntimeError("WEBHOOK_URL environment variable not set")
+
+    # uvicorn starts WEB_CONCURRENCY workers, each handling updates (see etat_partage)
+    if not get_stockage() and int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        logger.warning("Several webhook workers with JSON files: a game may be counted twice")
+    persistence_executor.start()
+    load_state()
+    application = build_application(token)
+    render_bot.app_instance = application
+    await application.initialize()
+    await application.start()
+    await application.bot.set_webhook(
+        url=f"{webhook_url}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+    save_bot_status(True, "Bot online (webhook)")
+    logger.info(f"Webhook registered on {webhook_url}{WEBHOOK_PATH}")
+
+async def shutdown():
+    if application is not None:
+        await application.stop()
+        await application.shutdown()
+    save_state()
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                logger.error(f"Critical error: {e}")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] != "http":
+        return
+    elif scope["path"] == WEBHOOK_PATH:
+        await webhook(scope, receive, send)
+    elif scope["path"] == "/health":
+        await respond(send, 200, b"OK")
+    elif scope["path"] == "/api/stream" and dashboard is not None:
+        await stream(scope, receive, send)
+    elif dashboard is not None:
+        await dashboard(scope, receive, send)
+    else:
+        await respond(send, 404)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))